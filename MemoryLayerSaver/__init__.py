@@ -17,8 +17,9 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA 02110-1301, USA.
 
-from .memory_layer_saver import MemoryLayerSaver
-
 
 def classFactory(iface):  # noqa
+    # Imported here so that the modules which do not depend on QGIS (e.g. decoder) can be used without it
+    from .memory_layer_saver import MemoryLayerSaver
+
     return MemoryLayerSaver()
@@ -0,0 +1,110 @@
+"""Command line tools on mldata files, which do not require QGIS
+
+    python -m MemoryLayerSaver export project.qgz layers.gpkg
+    python -m MemoryLayerSaver export project.qgs.mldata layers_dir --format FlatGeobuf --jobs 4
+    python -m MemoryLayerSaver import layers.mldata roads.gpkg buildings.fgb:buildings
+    python -m MemoryLayerSaver verify project.qgz
+
+The conversions require the GDAL python bindings (osgeo).
+"""
+
+import argparse
+import os
+import sys
+
+from .convert import DEFAULT_TRANSACTION_SIZE, export_layers, import_layers, open_source
+from .mldata import COMPRESSION_FLAGS, DEFAULT_CHUNK_SIZE
+from .verify import verify_file
+
+
+def export_command(args):
+    counts = export_layers(
+        args.source,
+        args.output,
+        args.format,
+        args.layers,
+        args.jobs,
+        args.transaction_size,
+        args.crs,
+    )
+    for layer_id, count in counts.items():
+        print(f"{layer_id}: {count} features")
+
+
+def import_command(args):
+    sources = []
+    for source in args.sources:
+        # dataset[:layer1,layer2]
+        path, _sep, names = source.rpartition(":") if not os.path.exists(source) else (source, "", "")
+        sources.append((path, [name for name in names.split(",") if name]))
+    for layer_id, name, count in import_layers(
+        sources, args.output, args.jobs, args.chunk_size, args.compression, args.compact_geometry, args.precision
+    ):
+        print(f"{name}: {count} features, layer id {layer_id}")
+
+
+def verify_command(args):
+    """Check the mldata files, return 1 if any of them is damaged"""
+    status = 0
+    for source in args.sources:
+        with open_source(source) as (paths, _layers):
+            reports = [verify_file(path) for path in paths]
+        for report in reports:
+            print(report)
+            for damaged in report.damaged:
+                print("    " + str(damaged))
+            if report.unchecked_layers:
+                print(f"    {len(report.unchecked_layers)} layers written without checksums")
+            if not report.ok:
+                status = 1
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m MemoryLayerSaver", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Convert the memory layers of an mldata file or project to GeoPackage or FlatGeobuf"
+    )
+    export_parser.add_argument("source", help="mldata file, or .qgz/.qgs project")
+    export_parser.add_argument("output", help="GeoPackage file, or directory of FlatGeobuf files")
+    export_parser.add_argument("--format", choices=["GPKG", "FlatGeobuf"], help="Default: from the output suffix")
+    export_parser.add_argument("--layers", nargs="+", help="Ids of the layers to convert (default: all)")
+    export_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of parallel processes")
+    export_parser.add_argument(
+        "--transaction-size", type=int, default=DEFAULT_TRANSACTION_SIZE, help="Features per transaction"
+    )
+    export_parser.add_argument("--crs", help="CRS of the layers which are not described by a project")
+    export_parser.set_defaults(function=export_command)
+
+    import_parser = subparsers.add_parser("import", help="Build an mldata file from GDAL datasets")
+    import_parser.add_argument("output", help="mldata file to write")
+    import_parser.add_argument("sources", nargs="+", help="GDAL datasets, optionally followed by :layer1,layer2")
+    import_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of parallel processes")
+    import_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Features per chunk")
+    import_parser.add_argument("--compression", choices=list(COMPRESSION_FLAGS), help="Compress the chunks")
+    import_parser.add_argument(
+        "--compact-geometry", action="store_true", help="Store the geometries without their WKB headers"
+    )
+    import_parser.add_argument(
+        "--precision", type=int, help="Round the coordinates to this number of decimals (compact geometries)"
+    )
+    import_parser.set_defaults(function=import_command)
+
+    verify_parser = subparsers.add_parser("verify", help="Check the chunk checksums of mldata files")
+    verify_parser.add_argument("sources", nargs="+", help="mldata files, or .qgz/.qgs projects")
+    verify_parser.set_defaults(function=verify_command)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.function(args) or 0
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""Background autosave checkpoints of the memory layers
+
+The memory layers are only written when the project is saved. Between two saves, the layers whose
+edits were committed are written to a checkpoint file beside the project file (see checkpoint_file),
+from which they can be recovered when the project is opened again after a crash:
+
+- The checkpoints are debounced: a checkpoint is written once no edit was committed for the autosave
+  delay (see Settings.autosave_delay), and at the latest MAX_DELAY_FACTOR times the delay after the
+  first edit which is not checkpointed yet, so that a continuous flow of edits is still checkpointed.
+- The checkpoint file only holds the layers modified since the project was saved. Only the layers
+  modified since the previous checkpoint are written again, the others are copied from it.
+- The layers are snapshotted on the main thread, which only creates a feature source of each of them
+  (see LayerSnapshot). Their features are iterated and written by a background task which works at most
+  DUTY_CYCLE of the time, sleeping between the chunks, so it never competes with the editing for the CPU
+  and the disk.
+- The checkpoint file is removed when the project is saved or closed.
+"""
+
+import time
+from functools import partial
+
+from qgis.core import QgsApplication, QgsProject, QgsTask
+from qgis.PyQt.QtCore import QFile, QFileInfo, QObject, QTimer
+
+from .mldata import CanceledError
+from .reader import Reader
+from .settings import Settings
+from .toolbox import log, log_error
+from .writer import LayerSnapshot, Writer
+
+# Suffix of the checkpoint file, added to the name of the project file
+CHECKPOINT_SUFFIX = ".mldata.autosave"
+# A checkpoint is written at the latest this number of autosave delays after the first edit not checkpointed
+MAX_DELAY_FACTOR = 4
+# Maximum share of the time the checkpoint task spends writing, it sleeps the rest of the time
+DUTY_CYCLE = 0.25
+
+
+def checkpoint_file():
+    """Return the path to the checkpoint file of the project, "" if the project was never saved"""
+    name = QgsProject.instance().fileName()
+    return name + CHECKPOINT_SUFFIX if name else ""
+
+
+class CheckpointTask(QgsTask):
+    """Write snapshots of the modified memory layers to the checkpoint file in a background thread
+
+    The layers which are not in modified_layers are copied from the previous checkpoint file.
+    The task is the feedback of the Writer: it sleeps after each chunk to limit its CPU and I/O use.
+    """
+
+    def __init__(self, filepath, snapshots, modified_layers, writer_options=None):
+        super().__init__(
+            QgsApplication.translate("MemoryLayerSaver", "Autosaving memory layers"), QgsTask.Flag.CanCancel
+        )
+        self.filepath = filepath
+        self.snapshots = snapshots
+        self.modified_layers = set(modified_layers)
+        self.writer_options = writer_options or {}
+        self.error = None
+        self._resumed = time.perf_counter()
+
+    def setProgress(self, progress):  # noqa
+        super().setProgress(progress)
+        # Called by the Writer after each chunk: sleep in proportion to the time spent writing it
+        busy = time.perf_counter() - self._resumed
+        time.sleep(busy * (1 - DUTY_CYCLE) / DUTY_CYCLE)
+        self._resumed = time.perf_counter()
+
+    def run(self):
+        self._resumed = time.perf_counter()
+        previous = Reader.try_open(self.filepath)
+        try:
+            with Writer(self.filepath, feedback=self, **self.writer_options) as writer:
+                writer.write_layers(self.snapshots, previous, self.modified_layers)
+                # The previous file must be closed before it is replaced
+                if previous:
+                    previous.close()
+        except CanceledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            if previous:
+                previous.close()
+        # Release the feature sources as soon as possible
+        self.snapshots = []
+        return self.error is None and not self.isCanceled()
+
+    def finished(self, result):
+        if result:
+            log(f"Memory layers autosaved to {self.filepath}")
+        elif self.error is not None:
+            log_error(f"Error while autosaving memory layers to {self.filepath}: {self.error}")
+
+
+class Autosave(QObject):
+    """Debounced checkpoints of the memory layers modified since the project was saved"""
+
+    def __init__(self, is_complete=None):
+        super().__init__()
+        # Whether a layer holds all its features: the layers loaded partially are left out of the checkpoints
+        self.is_complete = is_complete or (lambda layer: True)
+        # Checkpoint file written by this session, None until the first checkpoint
+        self.filepath = None
+        # Ids of the layers modified since the project was saved, and since the last checkpoint
+        self.modified_layers = set()
+        self.pending_layers = set()
+        # time.monotonic() of the first edit which is not checkpointed yet
+        self.first_edit = None
+        self.task = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.checkpoint)
+
+    @staticmethod
+    def is_enabled():
+        # The edit journal of a separate .mldata file already keeps the edits which are not saved
+        return Settings.autosave() and not (Settings.edit_journal() and Settings.legacy_mode())
+
+    def schedule(self, layer_id):
+        """Checkpoint a layer whose edits were committed, once the edits stop for the autosave delay"""
+        if not self.is_enabled() or not checkpoint_file():
+            return
+        self.modified_layers.add(layer_id)
+        self.pending_layers.add(layer_id)
+        now = time.monotonic()
+        if self.first_edit is None:
+            self.first_edit = now
+        delay = Settings.autosave_delay()
+        # A continuous flow of edits does not postpone the checkpoint forever
+        remaining = self.first_edit + MAX_DELAY_FACTOR * delay - now
+        self.timer.start(int(1000 * max(0, min(delay, remaining))))
+
+    def discard(self, layer_id):
+        """Forget a layer removed from the project, or no longer saved"""
+        self.modified_layers.discard(layer_id)
+        self.pending_layers.discard(layer_id)
+
+    def checkpoint(self):
+        """Snapshot the layers modified since the last checkpoint and write them in a background task"""
+        if not self.pending_layers:
+            return
+        if self.task is not None:
+            # The next checkpoint starts once the current one is written
+            self.timer.start(1000 * Settings.autosave_delay())
+            return
+        filepath = checkpoint_file()
+        if not filepath or not self.is_enabled():
+            return
+        if filepath != self.filepath:
+            # The project was saved under another name
+            self.remove()
+            self.filepath = filepath
+
+        project = QgsProject.instance()
+        layers = [project.mapLayer(layer_id) for layer_id in sorted(self.modified_layers)]
+        layers = [layer for layer in layers if layer is not None and Settings.is_saved_layer(layer)]
+        incomplete = {layer.id() for layer in layers if not self.is_complete(layer)}
+        layers = [layer for layer in layers if layer.id() not in incomplete]
+        # Only the layers which cannot be copied from the previous checkpoint keep a source of their features,
+        # which are iterated by the CheckpointTask
+        previous = Reader.try_open(filepath)
+        try:
+            snapshots = LayerSnapshot.of_layers(layers, previous, self.pending_layers)
+        finally:
+            if previous:
+                previous.close()
+
+        log(f"Autosaving memory layers to {filepath} ({len(self.pending_layers)} modified layers)")
+        # The previous checkpoint is useless once replaced, no backup is kept
+        writer_options = {**Settings.writer_options(), "backup": False}
+        task = CheckpointTask(filepath, snapshots, self.pending_layers - incomplete, writer_options)
+        task.taskCompleted.connect(partial(self.on_task_finished, task, True))
+        task.taskTerminated.connect(partial(self.on_task_finished, task, False))
+        # The incomplete layers are checkpointed once they are loaded and modified again
+        self.pending_layers = incomplete
+        self.first_edit = None
+        self.task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def on_task_finished(self, task, success):
+        if self.task is task:
+            self.task = None
+        if not success:
+            # The layers are written again by the next checkpoint
+            self.pending_layers |= task.modified_layers & self.modified_layers
+            # A task canceled by stop is not retried
+            if self.pending_layers and not task.isCanceled() and not self.timer.isActive():
+                self.timer.start(1000 * Settings.autosave_delay())
+
+    def wait(self):
+        """Block until the pending checkpoint, if any, is written"""
+        if self.task is None:
+            return
+        try:
+            # 0: no timeout
+            self.task.waitForFinished(0)
+        except RuntimeError:
+            # The task was already deleted by the task manager
+            pass
+        self.task = None
+
+    def stop(self):
+        """Stop the checkpoints, the checkpoint file is kept as written by the last complete checkpoint"""
+        self.timer.stop()
+        if self.task is not None:
+            try:
+                self.task.cancel()
+            except RuntimeError:
+                pass
+        self.wait()
+
+    def remove(self):
+        """Remove the checkpoint file written by this session, if any"""
+        if self.filepath and QFile.exists(self.filepath):
+            log(f"Removing the autosave checkpoint {self.filepath}")
+            QFile.remove(self.filepath)
+        self.filepath = None
+
+    def clear(self):
+        """Forget the modified layers and remove the checkpoint file (the project was saved or closed)"""
+        self.stop()
+        self.remove()
+        self.modified_layers.clear()
+        self.pending_layers.clear()
+        self.first_edit = None
+
+    @staticmethod
+    def recoverable_file(check_age=True):
+        """Return the checkpoint file of the project if it is newer than the project file, "" otherwise
+
+        An older checkpoint file is removed, unless check_age is False.
+        """
+        filepath = checkpoint_file()
+        if not filepath or not QFile.exists(filepath):
+            return ""
+        if (
+            check_age
+            and QFileInfo(filepath).lastModified() <= QFileInfo(QgsProject.instance().fileName()).lastModified()
+        ):
+            log(f"Removing the autosave checkpoint {filepath}, which is older than the project")
+            QFile.remove(filepath)
+            return ""
+        return filepath
+
+    def resume(self, filepath, layer_ids):
+        """Continue the checkpoints from a recovered checkpoint file, whose layers are still not saved"""
+        self.filepath = filepath
+        self.modified_layers = set(layer_ids)
+        self.pending_layers = set()
+        self.first_edit = None
@@ -0,0 +1,140 @@
+"""Columnar encoding of the attributes of a chunk of features
+
+Each field is stored as a contiguous block made of the column encoding (uint8),
+a null bitmap (one bit per feature, set for NULL values) and the non-null values:
+
+- ``COLUMN_VARIANT``: one QVariant per value (any type)
+- ``COLUMN_INT64``: big endian int64
+- ``COLUMN_DOUBLE``: big endian float64
+- ``COLUMN_BOOL``: one byte per value
+- ``COLUMN_STRING``: a dictionary of the distinct strings (uint32 count followed by QStrings)
+  and a big endian uint32 index in the dictionary per value
+
+The encoding is chosen per chunk, from the field type and the actual values,
+falling back to ``COLUMN_VARIANT`` whenever the values do not fit the typed encoding.
+"""
+
+import sys
+from array import array
+
+from qgis.PyQt.QtCore import QMetaType, QVariant
+
+from .mldata import COLUMN_BOOL, COLUMN_DOUBLE, COLUMN_INT64, COLUMN_STRING, COLUMN_VARIANT
+
+INT_TYPES = (int(QMetaType.Type.Int), int(QMetaType.Type.UInt), int(QMetaType.Type.LongLong))
+DOUBLE_TYPE = int(QMetaType.Type.Double)
+BOOL_TYPE = int(QMetaType.Type.Bool)
+STRING_TYPE = int(QMetaType.Type.QString)
+
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+# QDataStream is big endian
+SWAP_BYTES = sys.byteorder == "little"
+
+
+def is_null(value):
+    return value is None or (isinstance(value, QVariant) and value.isNull())
+
+
+def column_encoding(field_type, values):
+    """Return the encoding of a column given its field type and its non-null values"""
+    if field_type in INT_TYPES:
+        if all(type(v) is int and INT64_MIN <= v <= INT64_MAX for v in values):
+            return COLUMN_INT64
+    elif field_type == DOUBLE_TYPE:
+        if all(type(v) in (float, int) for v in values):
+            return COLUMN_DOUBLE
+    elif field_type == BOOL_TYPE:
+        if all(type(v) is bool for v in values):
+            return COLUMN_BOOL
+    elif field_type == STRING_TYPE:
+        if all(type(v) is str for v in values):
+            return COLUMN_STRING
+    return COLUMN_VARIANT
+
+
+def write_array(stream, typecode, values):
+    data = array(typecode, values)
+    if SWAP_BYTES:
+        data.byteswap()
+    stream.writeRawData(data.tobytes())
+
+
+def read_array(stream, typecode, count):
+    data = array(typecode)
+    if count:
+        data.frombytes(stream.readRawData(count * data.itemsize))
+        if SWAP_BYTES:
+            data.byteswap()
+    return data
+
+
+def encode_columns(stream, rows, field_types):
+    """Write the attributes of a chunk (list of attribute lists) column by column"""
+    count = len(rows)
+    for i, field_type in enumerate(field_types):
+        bitmap = bytearray((count + 7) // 8)
+        values = []
+        for j, row in enumerate(rows):
+            value = row[i]
+            if is_null(value):
+                bitmap[j >> 3] |= 1 << (j & 7)
+            else:
+                values.append(value)
+
+        encoding = column_encoding(field_type, values)
+        stream.writeUInt8(encoding)
+        stream.writeRawData(bytes(bitmap))
+        if encoding == COLUMN_INT64:
+            write_array(stream, "q", values)
+        elif encoding == COLUMN_DOUBLE:
+            write_array(stream, "d", values)
+        elif encoding == COLUMN_BOOL:
+            stream.writeRawData(bytes(values))
+        elif encoding == COLUMN_STRING:
+            dictionary = {}
+            indexes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+            stream.writeUInt32(len(dictionary))
+            for value in dictionary:
+                stream.writeQString(value)
+            write_array(stream, "I", indexes)
+        else:
+            for value in values:
+                stream.writeQVariant(value)
+
+
+def decode_columns(stream, count, nfields, interners=None):
+    """Read the attributes of a chunk, return a list of attribute lists
+
+    interners is the intern function of each field (None for the fields whose values are not interned),
+    see interning.interners. Only the dictionary of a string column is interned, not each of its values.
+    """
+    rows = [[None] * nfields for _j in range(count)]
+    for i in range(nfields):
+        encoding = stream.readUInt8()
+        bitmap = stream.readRawData((count + 7) // 8)
+        present = [j for j in range(count) if not bitmap[j >> 3] & (1 << (j & 7))]
+        nvalues = len(present)
+
+        if encoding == COLUMN_INT64:
+            values = read_array(stream, "q", nvalues)
+        elif encoding == COLUMN_DOUBLE:
+            values = read_array(stream, "d", nvalues)
+        elif encoding == COLUMN_BOOL:
+            values = [bool(b) for b in stream.readRawData(nvalues)] if nvalues else []
+        elif encoding == COLUMN_STRING:
+            dictionary = [stream.readQString() for _k in range(stream.readUInt32())]
+            if interners and interners[i]:
+                dictionary = [interners[i](value) for value in dictionary]
+            values = [dictionary[k] for k in read_array(stream, "I", nvalues)]
+        elif encoding == COLUMN_VARIANT:
+            values = [stream.readQVariant() for _k in range(nvalues)]
+            if interners and interners[i]:
+                values = [interners[i](value) if value is not None else None for value in values]
+        else:
+            raise ValueError(f"Unknown column encoding {encoding}")
+
+        for j, value in zip(present, values):
+            rows[j][i] = value
+    return rows
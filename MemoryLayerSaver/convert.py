@@ -0,0 +1,537 @@
+"""Conversion of mldata files from and to GDAL vector formats (GeoPackage, FlatGeobuf...), without QGIS
+
+The mldata file is read with the pure python decoder, either standalone or from the attachments of
+a project (.qgz, or .qgs with its _attachments.zip), which may hold an mldata file per layer
+(see the manifest module). The name, geometry type and CRS of the layers are read from the project
+file when there is one. The features are streamed to the output in transactions of transaction_size
+features, so the memory footprint does not depend on the size of the layers. The layers are converted
+in parallel by a pool of processes.
+
+Requires the GDAL python bindings (osgeo).
+"""
+
+import contextlib
+import datetime
+import json
+import re
+import tempfile
+import uuid
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .decoder import DataFile
+from .encoder import (
+    FIELD_BOOL,
+    FIELD_BYTEARRAY,
+    FIELD_DATE,
+    FIELD_DATETIME,
+    FIELD_DOUBLE,
+    FIELD_INT,
+    FIELD_LIST,
+    FIELD_LONGLONG,
+    FIELD_STRING,
+    FIELD_STRINGLIST,
+    FIELD_TIME,
+    DataFileWriter,
+)
+from .manifest import MANIFEST_ATTACHMENT, Manifest
+from .mldata import DEFAULT_CHUNK_SIZE
+
+try:
+    from osgeo import gdal, ogr, osr
+except ImportError:
+    gdal = ogr = osr = None
+
+DEFAULT_TRANSACTION_SIZE = 100000
+
+# Suffix of the attachments of the mldata files (see MemoryLayerSaver.memory_layer_file)
+MLDATA_ATTACHMENT = "layers.mldata"
+
+# ISO WKB codes of the geometry types of the memory layers
+WKB_TYPES = {
+    "point": 1,
+    "linestring": 2,
+    "polygon": 3,
+    "multipoint": 4,
+    "multilinestring": 5,
+    "multipolygon": 6,
+    "geometrycollection": 7,
+    "circularstring": 8,
+    "compoundcurve": 9,
+    "curvepolygon": 10,
+    "multicurve": 11,
+    "multisurface": 12,
+}
+
+
+def check_gdal():
+    if ogr is None:
+        raise RuntimeError("The GDAL python bindings (osgeo) are required to convert mldata files")
+    ogr.UseExceptions()
+    osr.UseExceptions()
+    gdal.UseExceptions()
+
+
+class LayerInfo:
+    """Description of a memory layer read from the project file"""
+
+    def __init__(self, layer_id, name=None, geometry_type=None, crs=None):
+        self.layer_id = layer_id
+        self.name = name or layer_id
+        # Geometry type of the memory provider uri (e.g. "MultiPolygonZ", "None"), None if unknown
+        self.geometry_type = geometry_type
+        # WKT or authority id of the CRS, None if unknown
+        self.crs = crs
+
+
+def read_project_layers(xml):
+    """Return the LayerInfo of the memory layers of a project file content (layer id -> LayerInfo)"""
+    layers = {}
+    root = ET.fromstring(xml)
+    for node in root.iter("maplayer"):
+        if (node.findtext("provider") or "").strip() != "memory":
+            continue
+        layer_id = node.findtext("id")
+        if not layer_id:
+            continue
+        datasource = node.findtext("datasource") or ""
+        geometry_type = datasource.split("?", 1)[0] or None
+        crs = node.findtext("srs/spatialrefsys/wkt") or node.findtext("srs/spatialrefsys/authid") or None
+        layers[layer_id] = LayerInfo(layer_id, node.findtext("layername"), geometry_type, crs)
+    return layers
+
+
+@contextlib.contextmanager
+def open_source(source):
+    """Locate the mldata files of a source (.mldata file or project), yield their paths and the LayerInfo of the layers
+
+    The mldata attachments of the projects are extracted to a temporary directory: the single mldata
+    file, or the files of the layers listed in the manifest if the project has one file per layer.
+    """
+    source = Path(source)
+    suffix = source.suffix.lower()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if suffix == ".mldata":
+            # Legacy mode: project.qgs.mldata is beside project.qgs
+            project = source.with_suffix("")
+            layers = read_project_file(project) if project.suffix.lower() in (".qgs", ".qgz") else {}
+            yield [source], layers
+            return
+
+        if suffix == ".qgz":
+            layers = read_project_file(source)
+            files = extract_attachments(source, tmpdir)
+        elif suffix == ".qgs":
+            layers = read_project_file(source)
+            attachments = source.with_name(source.stem + "_attachments.zip")
+            files = extract_attachments(attachments, tmpdir) if attachments.exists() else []
+        else:
+            raise ValueError(f"Unsupported source {source}, expected a .mldata, .qgz or .qgs file")
+
+        if not files:
+            legacy = Path(str(source) + ".mldata")
+            if not legacy.exists():
+                raise ValueError(f"No mldata file found for {source}")
+            files = [legacy]
+        yield files, layers
+
+
+def read_project_file(project):
+    """Return the LayerInfo of the memory layers of a .qgs or .qgz project, {} if the project does not exist"""
+    if not project.exists():
+        return {}
+    if project.suffix.lower() == ".qgz":
+        with zipfile.ZipFile(project) as archive:
+            for name in archive.namelist():
+                if name.lower().endswith(".qgs"):
+                    return read_project_layers(archive.read(name))
+        return {}
+    return read_project_layers(project.read_bytes())
+
+
+def extract_attachments(archive_path, directory):
+    """Extract the mldata attachments of a project archive, return their paths ([] if there is none)"""
+    with zipfile.ZipFile(archive_path) as archive:
+        names = archive.namelist()
+        # Attached files are prefixed with a random string
+        for name in names:
+            if name.endswith(MANIFEST_ATTACHMENT):
+                layer_files = set(Manifest.from_bytes(archive.read(name)).layers.values())
+                return [Path(archive.extract(n, directory)) for n in names if n.rsplit("/", 1)[-1] in layer_files]
+        for name in names:
+            if name.endswith(MLDATA_ATTACHMENT):
+                return [Path(archive.extract(name, directory))]
+    return []
+
+
+def ogr_geometry_type(geometry_type):
+    """Return the OGR geometry type of a memory provider geometry type"""
+    if not geometry_type:
+        return ogr.wkbUnknown
+    name = geometry_type.lower()
+    if name in ("none", "nogeometry"):
+        return ogr.wkbNone
+    has_z = has_m = False
+    if name.endswith("zm"):
+        name, has_z, has_m = name[:-2], True, True
+    elif name.endswith("z"):
+        name, has_z = name[:-1], True
+    elif name.endswith("m") and name[:-1] in WKB_TYPES:
+        name, has_m = name[:-1], True
+    if name.endswith("25d"):
+        name, has_z = name[:-3], True
+    if name not in WKB_TYPES:
+        return ogr.wkbUnknown
+    return ogr.GT_SetModifier(WKB_TYPES[name], has_z, has_m)
+
+
+def spatial_reference(crs):
+    if not crs:
+        return None
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def ogr_field(definition):
+    """Return the OGR field definition of an mldata field definition, and how its values are converted"""
+    name, field_type, _typename, length, precision, _comment = definition
+    if field_type == FIELD_BOOL:
+        field = ogr.FieldDefn(name, ogr.OFTInteger)
+        field.SetSubType(ogr.OFSTBoolean)
+        return field, "int"
+    if field_type == FIELD_INT:
+        return ogr.FieldDefn(name, ogr.OFTInteger), "int"
+    if field_type in (3, FIELD_LONGLONG, 5):  # UInt, LongLong, ULongLong
+        return ogr.FieldDefn(name, ogr.OFTInteger64), "int"
+    if field_type == FIELD_DOUBLE:
+        field = ogr.FieldDefn(name, ogr.OFTReal)
+        if length > 0:
+            field.SetWidth(length)
+            field.SetPrecision(max(0, precision))
+        return field, None
+    if field_type == FIELD_STRING:
+        field = ogr.FieldDefn(name, ogr.OFTString)
+        if length > 0:
+            field.SetWidth(length)
+        return field, None
+    if field_type == FIELD_DATE:
+        return ogr.FieldDefn(name, ogr.OFTDate), "date"
+    if field_type == FIELD_TIME:
+        return ogr.FieldDefn(name, ogr.OFTTime), "time"
+    if field_type == FIELD_DATETIME:
+        return ogr.FieldDefn(name, ogr.OFTDateTime), "datetime"
+    if field_type == FIELD_BYTEARRAY:
+        return ogr.FieldDefn(name, ogr.OFTBinary), "binary"
+    # Lists, maps and other types are written as JSON
+    field = ogr.FieldDefn(name, ogr.OFTString)
+    field.SetSubType(ogr.OFSTJSON)
+    return field, "json"
+
+
+def set_field(feature, index, value, conversion):
+    if value is None:
+        feature.SetFieldNull(index)
+    elif conversion is None:
+        feature.SetField(index, value)
+    elif conversion == "int":
+        feature.SetField(index, int(value))
+    elif conversion == "date":
+        feature.SetField(index, value.year, value.month, value.day, 0, 0, 0, 0)
+    elif conversion == "time":
+        feature.SetField(index, 0, 0, 0, value.hour, value.minute, value.second + value.microsecond / 1e6, 0)
+    elif conversion == "datetime":
+        # 100: UTC, 1: local time (the naive datetimes of the decoder are in local time)
+        tzflag = 100 if value.tzinfo is not None else 1
+        second = value.second + value.microsecond / 1e6
+        feature.SetField(index, value.year, value.month, value.day, value.hour, value.minute, second, tzflag)
+    elif conversion == "binary":
+        feature.SetFieldBinaryFromHexString(index, value.hex())
+    else:
+        feature.SetField(index, json.dumps(value, default=str))
+
+
+def layer_file_name(name):
+    return re.sub(r"[^\w\-. ]", "_", name).strip() or "layer"
+
+
+def export_layer(
+    mldata, layer_id, info, output, driver_name, transaction_size=DEFAULT_TRANSACTION_SIZE, crs=None, append=False
+):
+    """Write a layer of an mldata file to a GDAL dataset, return the number of features written
+
+    The output is created again, unless append is True: the layer is then added to the existing
+    dataset (GeoPackage), replacing the layer of the same name.
+    """
+    check_gdal()
+    driver = ogr.GetDriverByName(driver_name)
+    if append and Path(output).exists():
+        dataset = ogr.Open(str(output), update=1)
+    else:
+        if Path(output).exists():
+            driver.DeleteDataSource(str(output))
+        dataset = driver.CreateDataSource(str(output))
+
+    count = 0
+    with DataFile(mldata) as data:
+        layer_data = data.layer(layer_id)
+        if layer_data is None:
+            raise ValueError(f"Layer {layer_id} is not in {mldata}")
+        srs = spatial_reference(info.crs or crs)
+        options = ["OVERWRITE=YES"] if driver_name == "GPKG" else []
+        layer = dataset.CreateLayer(info.name, srs, ogr_geometry_type(info.geometry_type), options=options)
+        conversions = []
+        for definition in layer_data.fields:
+            field, conversion = ogr_field(definition)
+            layer.CreateField(field)
+            conversions.append(conversion)
+        definition = layer.GetLayerDefn()
+
+        transactions = dataset.TestCapability(ogr.ODsCTransactions)
+        if transactions:
+            dataset.StartTransaction()
+        for attributes, wkb in layer_data.features():
+            feature = ogr.Feature(definition)
+            for i, (value, conversion) in enumerate(zip(attributes, conversions)):
+                set_field(feature, i, value, conversion)
+            if wkb is not None:
+                feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(bytes(wkb)))
+            layer.CreateFeature(feature)
+            count += 1
+            if transactions and count % transaction_size == 0:
+                dataset.CommitTransaction()
+                dataset.StartTransaction()
+        if transactions:
+            dataset.CommitTransaction()
+    dataset = None
+    return count
+
+
+def export_layers(source, output, driver_name=None, layer_ids=None, jobs=1, transaction_size=None, crs=None):
+    """Convert the memory layers of an mldata file or project to a GeoPackage or to FlatGeobuf files
+
+    The GeoPackage output is a single file, the FlatGeobuf output a directory with a file per layer
+    (or a single file if there is a single layer). Return a {layer id: feature count} dict.
+    """
+    check_gdal()
+    output = Path(output)
+    if driver_name is None:
+        driver_name = "GPKG" if output.suffix.lower() == ".gpkg" else "FlatGeobuf"
+    transaction_size = transaction_size or DEFAULT_TRANSACTION_SIZE
+
+    with open_source(source) as (files, infos):
+        # layer id -> mldata file of the layer
+        sources = {}
+        for mldata in files:
+            with DataFile(mldata) as data:
+                for layer in data.layers():
+                    sources.setdefault(layer.layer_id, mldata)
+        layer_ids = layer_ids or list(sources)
+        for layer_id in layer_ids:
+            if layer_id not in sources:
+                raise ValueError(f"Layer {layer_id} is not in {source}")
+        infos = {layer_id: infos.get(layer_id) or LayerInfo(layer_id) for layer_id in layer_ids}
+        unique_names(infos.values())
+
+        if driver_name == "GPKG" or (output.suffix.lower() == ".fgb" and len(layer_ids) == 1):
+            outputs = {layer_id: output for layer_id in layer_ids}
+        else:
+            output.mkdir(parents=True, exist_ok=True)
+            outputs = {layer_id: output / (layer_file_name(infos[layer_id].name) + ".fgb") for layer_id in layer_ids}
+
+        # SQLite does not support concurrent writers: the layers of a GeoPackage are written to
+        # temporary files by the workers, then appended to the output
+        merge = driver_name == "GPKG" and jobs > 1 and len(layer_ids) > 1
+        with tempfile.TemporaryDirectory(dir=output.parent if merge else None) as tmpdir:
+            if merge:
+                outputs = {layer_id: Path(tmpdir) / f"{i}.gpkg" for i, layer_id in enumerate(layer_ids)}
+            # The layers of a GeoPackage written sequentially are appended to the output created by the first one
+            append = driver_name == "GPKG" and not merge
+            args = [
+                (
+                    sources[layer_id],
+                    layer_id,
+                    infos[layer_id],
+                    outputs[layer_id],
+                    driver_name,
+                    transaction_size,
+                    crs,
+                    append and i > 0,
+                )
+                for i, layer_id in enumerate(layer_ids)
+            ]
+            counts = run_jobs(export_layer, args, jobs)
+            if merge:
+                # The output is created again by the first layer, the layers of a previous export are not kept
+                if output.exists():
+                    ogr.GetDriverByName("GPKG").DeleteDataSource(str(output))
+                for i, layer_id in enumerate(layer_ids):
+                    access_mode = "overwrite" if i > 0 else None
+                    gdal.VectorTranslate(str(output), str(outputs[layer_id]), format="GPKG", accessMode=access_mode)
+    return dict(zip(layer_ids, counts))
+
+
+def unique_names(infos):
+    """Make the names of the layers unique, since they name the output layers"""
+    names = set()
+    for info in infos:
+        name = info.name
+        i = 1
+        while name.lower() in names:
+            i += 1
+            name = f"{info.name}_{i}"
+        info.name = name
+        names.add(name.lower())
+
+
+def run_jobs(function, args, jobs):
+    """Call function on each tuple of arguments, in a pool of processes if jobs > 1, return the results"""
+    if jobs <= 1 or len(args) <= 1:
+        return [function(*arg) for arg in args]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(function, *arg) for arg in args]
+        return [future.result() for future in futures]
+
+
+def generate_layer_id(name):
+    """Return a layer id in the format of the ids generated by QGIS"""
+    return re.sub(r"[^\w]", "_", name) + "_" + str(uuid.uuid4()).replace("-", "_")
+
+
+def mldata_field(field):
+    """Return the mldata field definition of an OGR field definition"""
+    name = field.GetName()
+    field_type = field.GetType()
+    length, precision = field.GetWidth(), field.GetPrecision()
+    if field_type == ogr.OFTInteger:
+        if field.GetSubType() == ogr.OFSTBoolean:
+            return name, FIELD_BOOL, "boolean", 0, 0, ""
+        return name, FIELD_INT, "integer", length, 0, ""
+    if field_type == ogr.OFTInteger64:
+        return name, FIELD_LONGLONG, "int8", length, 0, ""
+    if field_type == ogr.OFTReal:
+        return name, FIELD_DOUBLE, "double", length, precision, ""
+    if field_type == ogr.OFTDate:
+        return name, FIELD_DATE, "date", 0, 0, ""
+    if field_type == ogr.OFTTime:
+        return name, FIELD_TIME, "time", 0, 0, ""
+    if field_type == ogr.OFTDateTime:
+        return name, FIELD_DATETIME, "datetime", 0, 0, ""
+    if field_type == ogr.OFTBinary:
+        return name, FIELD_BYTEARRAY, "binary", 0, 0, ""
+    if field_type == ogr.OFTStringList:
+        return name, FIELD_STRINGLIST, "stringlist", 0, 0, ""
+    list_typenames = {
+        ogr.OFTIntegerList: "integerlist",
+        ogr.OFTInteger64List: "integer64list",
+        ogr.OFTRealList: "doublelist",
+    }
+    if field_type in list_typenames:
+        return name, FIELD_LIST, list_typenames[field_type], 0, 0, ""
+    return name, FIELD_STRING, "string", length, 0, ""
+
+
+def field_value(feature, index, field_type):
+    """Return the value of a field of an OGR feature, converted to the python type expected by the encoder"""
+    if not feature.IsFieldSetAndNotNull(index):
+        return None
+    if field_type == FIELD_BOOL:
+        return bool(feature.GetFieldAsInteger(index))
+    if field_type in (FIELD_DATE, FIELD_TIME, FIELD_DATETIME):
+        year, month, day, hour, minute, second, tzflag = feature.GetFieldAsDateTime(index)
+        microsecond = round((second - int(second)) * 1e6)
+        time = datetime.time(hour, minute, int(second), min(microsecond, 999999))
+        if field_type == FIELD_TIME:
+            return time
+        date = datetime.date(year, month, day)
+        if field_type == FIELD_DATE:
+            return date
+        value = datetime.datetime.combine(date, time)
+        if tzflag >= 100:
+            # 100 is UTC, each step is a 15 minutes offset
+            value = value.replace(tzinfo=datetime.timezone(datetime.timedelta(minutes=15 * (tzflag - 100))))
+        return value
+    if field_type == FIELD_BYTEARRAY:
+        return feature.GetFieldAsBinary(index)
+    if field_type == FIELD_STRING:
+        return feature.GetFieldAsString(index)
+    return feature.GetField(index)
+
+
+def ogr_features(layer, field_types):
+    """Yield the (attributes, wkb) tuples of the features of an OGR layer"""
+    layer.ResetReading()
+    for feature in layer:
+        attributes = [field_value(feature, i, field_type) for i, field_type in enumerate(field_types)]
+        geometry = feature.GetGeometryRef()
+        # QGIS writes little endian ISO WKB
+        wkb = geometry.ExportToIsoWkb(ogr.wkbNDR) if geometry is not None and not geometry.IsEmpty() else None
+        yield attributes, wkb
+
+
+def import_layer(
+    source,
+    layer_name,
+    layer_id,
+    output,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    compression=None,
+    compact_geometry=False,
+    precision=None,
+):
+    """Write a layer of a GDAL dataset to a new mldata file, return the number of features written
+
+    If precision (number of decimals) is given, the coordinates are rounded to it and stored in the
+    compact geometry encoding, which is also used for all the geometries if compact_geometry is True.
+    """
+    check_gdal()
+    dataset = ogr.Open(str(source))
+    layer = dataset.GetLayerByName(layer_name)
+    if layer is None:
+        raise ValueError(f"Layer {layer_name} is not in {source}")
+    definition = layer.GetLayerDefn()
+    fields = [mldata_field(definition.GetFieldDefn(i)) for i in range(definition.GetFieldCount())]
+    xmin, xmax, ymin, ymax = layer.GetExtent() if layer.GetGeomType() != ogr.wkbNone else (0, 0, 0, 0)
+    extent = (xmin, ymin, xmax, ymax) if layer.GetGeomType() != ogr.wkbNone else None
+    features = ogr_features(layer, [field[1] for field in fields])
+    with DataFileWriter(output, chunk_size, compression, compact_geometry=compact_geometry) as writer:
+        entry = writer.write_layer(layer_id, fields, features, extent=extent, precision=precision)
+    return entry.feature_count
+
+
+def import_layers(sources, output, jobs=1, chunk_size=None, compression=None, compact_geometry=False, precision=None):
+    """Build an mldata file from the layers of GDAL datasets
+
+    sources is a list of (dataset path, layer names) tuples, all the layers of the dataset being
+    converted if layer names is empty. Return a list of (layer id, layer name, feature count) tuples:
+    the layer ids must be given to the memory layers of the project which should load these layers.
+    """
+    check_gdal()
+    layers = []
+    for source, names in sources:
+        dataset = ogr.Open(str(source))
+        if dataset is None:
+            raise ValueError(f"Cannot open {source}")
+        for name in names or [dataset.GetLayer(i).GetName() for i in range(dataset.GetLayerCount())]:
+            layers.append((source, name, generate_layer_id(name)))
+        dataset = None
+
+    output = Path(output)
+    with tempfile.TemporaryDirectory(dir=output.parent) as tmpdir:
+        # Each layer is encoded to its own file, then the layer records are concatenated
+        outputs = [Path(tmpdir) / f"{i}.mldata" for i in range(len(layers))]
+        args = [
+            (source, name, layer_id, path, chunk_size or DEFAULT_CHUNK_SIZE, compression, compact_geometry, precision)
+            for (source, name, layer_id), path in zip(layers, outputs)
+        ]
+        counts = run_jobs(import_layer, args, jobs)
+        with DataFileWriter(output) as writer:
+            for path in outputs:
+                with DataFile(path) as data:
+                    entries = data.index
+                for entry in entries:
+                    writer.copy_layer(path, entry)
+    return [(layer_id, name, count) for (_source, name, layer_id), count in zip(layers, counts)]
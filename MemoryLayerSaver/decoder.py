@@ -0,0 +1,622 @@
+"""Pure python decoder of mldata files, which depends neither on QGIS nor on Qt
+
+The file is memory mapped and decoded with struct. The layers and their features are decoded
+lazily, and the WKB geometries are returned as memoryview slices of the file (or of the
+decompressed chunk), without being copied. The decoder reads the same files as the Reader
+(versions 1, 2 and 3, row and columnar layers, compressed chunks, compact geometries) and returns
+the same values, converted to python types:
+
+- NULL values: None
+- integers, doubles, booleans, strings, byte arrays: int, float, bool, str, bytes
+- QDate, QTime, QDateTime: datetime.date, datetime.time, datetime.datetime. Local date times are
+  naive datetimes in the local time zone, as returned by QDateTime.toPyDateTime, the others are
+  aware datetimes in UTC
+- QStringList, QVariantList: list, QVariantMap, QVariantHash: dict
+
+Usage::
+
+    with DataFile("project.qgs.mldata") as data:
+        for layer in data.layers():
+            for attributes, wkb in layer.features():
+                ...
+
+The WKB memoryviews are only valid while the file is open.
+"""
+
+import datetime
+import mmap
+import struct
+
+from .mldata import (
+    COLUMN_BOOL,
+    COLUMN_DOUBLE,
+    COLUMN_INT64,
+    COLUMN_STRING,
+    COLUMN_VARIANT,
+    FLAG_CHECKSUM,
+    FLAG_COLUMNAR,
+    FLAG_COMPACT_GEOMETRY,
+    HEADER_SIZE,
+    INDEX_MAGIC,
+    MAGIC,
+    SUPPORTED_VERSIONS,
+    TRAILER_SIZE,
+    CorruptDataError,
+    DamagedRange,
+    LayerEntry,
+    checksum,
+    decompress,
+)
+from .geometry_codec import decode_geometries
+
+INT8 = struct.Struct(">b")
+UINT8 = struct.Struct(">B")
+INT16 = struct.Struct(">h")
+UINT16 = struct.Struct(">H")
+INT32 = struct.Struct(">i")
+UINT32 = struct.Struct(">I")
+INT64 = struct.Struct(">q")
+UINT64 = struct.Struct(">Q")
+FLOAT = struct.Struct(">f")
+DOUBLE = struct.Struct(">d")
+
+# Length of null strings and byte arrays
+NULL_LENGTH = 0xFFFFFFFF
+
+# datetime.date ordinals start at 1 for 0001-01-01, whose julian day is 1721426
+JULIAN_DAY_OFFSET = 1721425
+MSECS_PER_DAY = 86400000
+
+# QDateTimePrivate::Spec of the date times, as written by QDataStream versions older than Qt 5.2.
+# The date and the time are always stored in UTC, the local ones (-1, 0, 1) are read back in local time
+SPEC_LOCAL = -1
+SPEC_UTC = 2
+SPEC_OFFSET_FROM_UTC = 3
+SPEC_TIME_ZONE = 4
+
+# QVariant type ids, as written by QDataStream versions older than Qt 5.0
+VARIANT_INVALID = 0
+VARIANT_BOOL = 1
+VARIANT_INT = 2
+VARIANT_UINT = 3
+VARIANT_LONGLONG = 4
+VARIANT_ULONGLONG = 5
+VARIANT_DOUBLE = 6
+VARIANT_CHAR = 7
+VARIANT_MAP = 8
+VARIANT_LIST = 9
+VARIANT_STRING = 10
+VARIANT_STRINGLIST = 11
+VARIANT_BYTEARRAY = 12
+VARIANT_DATE = 14
+VARIANT_TIME = 15
+VARIANT_DATETIME = 16
+VARIANT_HASH = 28
+VARIANT_USERTYPE = 127
+# Qt 5 ids of these types are shifted by 97 in streams older than Qt 5.0
+VARIANT_LONG = 129
+VARIANT_SHORT = 130
+VARIANT_CHAR8 = 131
+VARIANT_ULONG = 132
+VARIANT_USHORT = 133
+VARIANT_UCHAR = 134
+VARIANT_FLOAT = 135
+VARIANT_SCHAR = 137
+
+
+class Stream:
+    """Cursor on a buffer, decoding the types written by a QDataStream (Qt_4_5, big endian)"""
+
+    __slots__ = ("buffer", "pos")
+
+    def __init__(self, buffer, pos=0):
+        self.buffer = memoryview(buffer)
+        self.pos = pos
+
+    def at_end(self):
+        return self.pos >= len(self.buffer)
+
+    def unpack(self, fmt):
+        try:
+            (value,) = fmt.unpack_from(self.buffer, self.pos)
+        except struct.error:
+            raise ValueError("Unexpected end of data") from None
+        self.pos += fmt.size
+        return value
+
+    def unpack_array(self, typecode, count):
+        """Read count big endian values of the given struct typecode, return a tuple"""
+        try:
+            values = struct.unpack_from(f">{count}{typecode}", self.buffer, self.pos)
+        except struct.error:
+            raise ValueError("Unexpected end of data") from None
+        self.pos += struct.calcsize(f">{count}{typecode}")
+        return values
+
+    def raw(self, size):
+        """Return the next size bytes as a memoryview, without copying them"""
+        end = self.pos + size
+        if end > len(self.buffer):
+            raise ValueError("Unexpected end of data")
+        view = self.buffer[self.pos : end]
+        self.pos = end
+        return view
+
+    def skip(self, size):
+        self.raw(size)
+
+    def int8(self):
+        return self.unpack(INT8)
+
+    def uint8(self):
+        return self.unpack(UINT8)
+
+    def bool(self):
+        return self.unpack(UINT8) != 0
+
+    def int16(self):
+        return self.unpack(INT16)
+
+    def uint16(self):
+        return self.unpack(UINT16)
+
+    def int32(self):
+        return self.unpack(INT32)
+
+    def uint32(self):
+        return self.unpack(UINT32)
+
+    def int64(self):
+        return self.unpack(INT64)
+
+    def uint64(self):
+        return self.unpack(UINT64)
+
+    def float(self):
+        return self.unpack(FLOAT)
+
+    def double(self):
+        return self.unpack(DOUBLE)
+
+    def qstring(self):
+        """Read a QString (UTF-16), null strings are read as empty strings"""
+        length = self.uint32()
+        if length == NULL_LENGTH:
+            return ""
+        return str(self.raw(length), "utf-16-be")
+
+    def qbytearray(self):
+        length = self.uint32()
+        if length == NULL_LENGTH:
+            return b""
+        return self.raw(length).tobytes()
+
+    def qdate(self):
+        return julian_day_to_date(self.uint32())
+
+    def qtime(self):
+        return msecs_to_time(self.uint32())
+
+    def qdatetime(self):
+        date = self.qdate()
+        time = self.qtime()
+        spec = self.int8()
+        if date is None:
+            return None
+        value = datetime.datetime.combine(date, time or datetime.time(), datetime.timezone.utc)
+        if spec in (SPEC_UTC, SPEC_OFFSET_FROM_UTC, SPEC_TIME_ZONE):
+            return value
+        return utc_to_local(value)
+
+    def qvariant(self):
+        """Read a QVariant, return its value converted to a python type (None for NULL values)"""
+        type_id = self.uint32()
+        is_null = self.uint8()
+        if type_id == VARIANT_INVALID:
+            # Invalid variants are followed by an empty string in streams older than Qt 5.0
+            self.qstring()
+            return None
+        if type_id == VARIANT_USERTYPE:
+            name = self.raw(self.uint32()).tobytes().rstrip(b"\0").decode(errors="replace")
+            raise ValueError(f"Unsupported QVariant user type {name}")
+        read = VARIANT_READERS.get(type_id)
+        if read is None:
+            raise ValueError(f"Unsupported QVariant type {type_id}")
+        value = read(self)
+        return None if is_null else value
+
+    def qvariant_map(self):
+        # QMap are sorted by key, but their serialization order depends on the Qt version
+        pairs = [(self.qstring(), self.qvariant()) for _i in range(self.uint32())]
+        return dict(sorted(pairs, key=lambda pair: pair[0]))
+
+    def qvariant_hash(self):
+        return {self.qstring(): self.qvariant() for _i in range(self.uint32())}
+
+    def wkb(self):
+        """Read a geometry (size and WKB), return a memoryview on the WKB or None for empty geometries"""
+        size = self.uint32()
+        return self.raw(size) if size else None
+
+
+def julian_day_to_date(julian_day):
+    # 0 is the julian day of null dates in streams older than Qt 5.0
+    ordinal = julian_day - JULIAN_DAY_OFFSET
+    if julian_day == 0 or not 1 <= ordinal <= datetime.date.max.toordinal():
+        return None
+    return datetime.date.fromordinal(ordinal)
+
+
+def utc_to_local(value):
+    """Convert an aware datetime to a naive datetime in the local time zone"""
+    try:
+        return value.astimezone().replace(tzinfo=None)
+    except (OverflowError, OSError, ValueError):
+        # Out of the range of the platform time functions, e.g. close to year 1 or 9999
+        return value.replace(tzinfo=None)
+
+
+def local_to_utc(value):
+    """Convert a naive datetime in the local time zone to an aware datetime in UTC"""
+    try:
+        return value.astimezone(datetime.timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        return value.replace(tzinfo=datetime.timezone.utc)
+
+
+def msecs_to_time(msecs):
+    if msecs >= MSECS_PER_DAY:
+        # Null time
+        return None
+    return datetime.time(msecs // 3600000, msecs // 60000 % 60, msecs // 1000 % 60, msecs % 1000 * 1000)
+
+
+VARIANT_READERS = {
+    VARIANT_BOOL: Stream.bool,
+    VARIANT_INT: Stream.int32,
+    VARIANT_UINT: Stream.uint32,
+    VARIANT_LONGLONG: Stream.int64,
+    VARIANT_ULONGLONG: Stream.uint64,
+    VARIANT_DOUBLE: Stream.double,
+    VARIANT_CHAR: lambda stream: chr(stream.uint16()),
+    VARIANT_MAP: Stream.qvariant_map,
+    VARIANT_LIST: lambda stream: [stream.qvariant() for _i in range(stream.uint32())],
+    VARIANT_STRING: Stream.qstring,
+    VARIANT_STRINGLIST: lambda stream: [stream.qstring() for _i in range(stream.uint32())],
+    VARIANT_BYTEARRAY: Stream.qbytearray,
+    VARIANT_DATE: Stream.qdate,
+    VARIANT_TIME: Stream.qtime,
+    VARIANT_DATETIME: Stream.qdatetime,
+    VARIANT_HASH: Stream.qvariant_hash,
+    VARIANT_LONG: Stream.int64,
+    VARIANT_SHORT: Stream.int16,
+    VARIANT_CHAR8: Stream.int8,
+    VARIANT_ULONG: Stream.uint64,
+    VARIANT_USHORT: Stream.uint16,
+    VARIANT_UCHAR: Stream.uint8,
+    VARIANT_FLOAT: Stream.float,
+    VARIANT_SCHAR: Stream.int8,
+}
+
+
+def decode_columns(stream, count, nfields):
+    """Read the attributes of a columnar chunk, return a list of attribute lists"""
+    rows = [[None] * nfields for _j in range(count)]
+    for i in range(nfields):
+        encoding = stream.uint8()
+        bitmap = stream.raw((count + 7) // 8)
+        present = [j for j in range(count) if not bitmap[j >> 3] & (1 << (j & 7))]
+        nvalues = len(present)
+
+        if encoding == COLUMN_INT64:
+            values = stream.unpack_array("q", nvalues)
+        elif encoding == COLUMN_DOUBLE:
+            values = stream.unpack_array("d", nvalues)
+        elif encoding == COLUMN_BOOL:
+            values = [b != 0 for b in stream.raw(nvalues)]
+        elif encoding == COLUMN_STRING:
+            dictionary = [stream.qstring() for _k in range(stream.uint32())]
+            values = [dictionary[k] for k in stream.unpack_array("I", nvalues)]
+        elif encoding == COLUMN_VARIANT:
+            values = [stream.qvariant() for _k in range(nvalues)]
+        else:
+            raise ValueError(f"Unknown column encoding {encoding}")
+
+        for j, value in zip(present, values):
+            rows[j][i] = value
+    return rows
+
+
+def read_field(stream):
+    """Read a field definition as a (name, type, typename, length, precision, comment) tuple"""
+    return stream.qstring(), stream.int16(), stream.qstring(), stream.int16(), stream.int16(), stream.qstring()
+
+
+class LayerData:
+    """Layer stored in an mldata file. Its features are only decoded when features() is iterated"""
+
+    def __init__(self, version, buffer, offset):
+        self.version = version
+        self._buffer = buffer
+        # Position of the layer record in the file
+        self.offset = offset
+        stream = Stream(buffer, offset)
+        self.layer_id = stream.qstring()
+        self.subset = stream.qstring() if version > 1 else ""
+        # List of (name, type, typename, length, precision, comment) tuples
+        self.fields = [read_field(stream) for _i in range(stream.int16())]
+        self.flags = stream.uint32() if version > 2 else 0
+        # Position of the features
+        self._start = stream.pos
+
+    def __repr__(self):
+        return f"LayerData({self.layer_id!r}, offset={self.offset}, fields={len(self.fields)})"
+
+    def features(self):
+        """Yield an (attributes, wkb) tuple for each feature
+
+        attributes is the list of the attribute values, wkb a memoryview on the WKB of the
+        geometry (bytes for the layers with compact geometries), or None if the feature has no geometry.
+        """
+        stream = Stream(self._buffer, self._start)
+        nattr = len(self.fields)
+        if self.version < 3:
+            while stream.bool():
+                attributes = [stream.qvariant() for _i in range(nattr)]
+                yield attributes, stream.wkb()
+            return
+
+        columnar = self.flags & FLAG_COLUMNAR
+        for count, payload in self.chunks(stream):
+            chunk = Stream(decompress(payload, self.flags))
+            if self.flags & FLAG_COMPACT_GEOMETRY:
+                if columnar:
+                    rows = decode_columns(chunk, count, nattr)
+                else:
+                    rows = [[chunk.qvariant() for _j in range(nattr)] for _i in range(count)]
+                yield from zip(rows, decode_geometries(chunk.raw(chunk.uint32()), count))
+            elif columnar:
+                for attributes in decode_columns(chunk, count, nattr):
+                    yield attributes, chunk.wkb()
+            else:
+                for _i in range(count):
+                    attributes = [chunk.qvariant() for _j in range(nattr)]
+                    yield attributes, chunk.wkb()
+
+    def chunks(self, stream, verify=True):
+        """Yield the feature count and the stored payload of each chunk, read from the stream
+
+        If verify is True, a CorruptDataError is raised if the checksum of a chunk is wrong.
+        """
+        while True:
+            offset = stream.pos
+            count = stream.uint32()
+            if count == 0:
+                return
+            yield count, self.payload(stream, offset, verify)
+
+    def frame(self, stream, verify=True):
+        """Read the frame of the bounding boxes: feature count, size, checksum and payload"""
+        offset = stream.pos
+        count = stream.uint32()
+        return count, self.payload(stream, offset, verify)
+
+    def payload(self, stream, offset, verify=True):
+        """Read the size, the checksum and the payload of a frame starting at offset"""
+        try:
+            size = stream.uint32()
+            expected = stream.uint32() if self.flags & FLAG_CHECKSUM else None
+            payload = stream.raw(size)
+        except ValueError:
+            raise CorruptDataError(f"Chunk at offset {offset} of layer {self.layer_id} is truncated", offset) from None
+        if verify and expected is not None and checksum(payload) != expected:
+            raise CorruptDataError(
+                f"Chunk at offset {offset} of layer {self.layer_id} is damaged (wrong checksum)", offset
+            )
+        return payload
+
+    def verify(self, end=None):
+        """Check the checksums of the chunks of the layer, without decoding them
+
+        end is the position of the end of the record, if known. The chunks following a chunk with
+        a wrong checksum are still checked, since its frame gives the position of the next one.
+        Return the number of chunks, the number of intact features, the list of DamagedRange and
+        the position of the end of the record (None if it could not be found).
+        Layers without checksums (version 1 and 2 files) are checked by decoding their features.
+        """
+        end = len(self._buffer) if end is None else min(end, len(self._buffer))
+        chunk_count = 0
+        feature_count = 0
+        damaged = []
+        if self.version < 3:
+            stream = Stream(self._buffer[:end], self._start)
+            try:
+                while stream.bool():
+                    for _i in range(len(self.fields)):
+                        stream.qvariant()
+                    stream.wkb()
+                    feature_count += 1
+            except Exception as e:
+                damaged.append(DamagedRange(self._start, end - self._start, self.layer_id, None, str(e)))
+                return chunk_count, feature_count, damaged, None
+            return chunk_count, feature_count, damaged, stream.pos
+
+        stream = Stream(self._buffer[:end], self._start)
+        offset = stream.pos
+        try:
+            while True:
+                offset = stream.pos
+                count = stream.uint32()
+                if count == 0:
+                    break
+                chunk_count += 1
+                if self.check_frame(stream):
+                    feature_count += count
+                else:
+                    damaged.append(DamagedRange(offset, stream.pos - offset, self.layer_id, count, "wrong checksum"))
+        except ValueError:
+            damaged.append(DamagedRange(offset, end - offset, self.layer_id, None, "truncated chunk"))
+            return chunk_count, feature_count, damaged, None
+        return chunk_count, feature_count, damaged, stream.pos
+
+    def check_frame(self, stream):
+        """Skip the size, the checksum and the payload of a frame, return whether the payload is intact"""
+        size = stream.uint32()
+        expected = stream.uint32() if self.flags & FLAG_CHECKSUM else None
+        payload = stream.raw(size)
+        return expected is None or checksum(payload) == expected
+
+    def _skip_chunks(self):
+        """Return a stream positioned after the chunks of a version 3 layer"""
+        stream = Stream(self._buffer, self._start)
+        for _chunk in self.chunks(stream, verify=False):
+            pass
+        return stream
+
+    def end(self):
+        """Position of the end of the layer record, found by skipping its features"""
+        if self.version > 2:
+            return self._skip_chunks().pos
+        stream = Stream(self._buffer, self._start)
+        nattr = len(self.fields)
+        while stream.bool():
+            for _i in range(nattr):
+                stream.qvariant()
+            stream.wkb()
+        return stream.pos
+
+
+class DataFile:
+    """mldata file decoded without QGIS
+
+    source is the path of the file, which is memory mapped, or a bytes-like object holding its content.
+    If recover is True, a damaged table of contents is ignored: index is None and index_error holds
+    the error, the layers can then be scanned from the start of the file.
+    """
+
+    def __init__(self, source, recover=False):
+        self._file = None
+        self._mmap = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._buffer = memoryview(source)
+            self._filename = "<buffer>"
+        else:
+            self._filename = str(source)
+            self._file = open(self._filename, "rb")
+            try:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                self._mmap = None
+            self._buffer = memoryview(self._mmap if self._mmap is not None else b"")
+
+        self.index_error = None
+        # layer id -> position of the layer record, from the table of contents or from a scan of the file
+        self._offsets = None
+        try:
+            self._version = self.read_header()
+            self._index = None
+            if self._version > 2:
+                try:
+                    self._index = self.read_index()
+                    self._offsets = {entry.layer_id: entry.offset for entry in self._index}
+                except CorruptDataError as e:
+                    if not recover:
+                        raise
+                    self.index_error = e
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._buffer = memoryview(b"")
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # WKB memoryviews are still alive, the mapping is released with them
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def index(self):
+        """Table of contents of the file (list of LayerEntry), None for version 1 and 2 files"""
+        return self._index
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    def read_header(self):
+        stream = Stream(self._buffer)
+        if len(self._buffer) < HEADER_SIZE or stream.raw(len(MAGIC)) != MAGIC:
+            raise ValueError(self._filename + " is not a valid memory layer data file")
+        version = stream.int32()
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(self._filename + " is not compatible with this version of the MemoryLayerSaver plugin")
+        return version
+
+    def read_index(self):
+        """Read the table of contents at the end of a version 3 file"""
+        size = len(self._buffer)
+        if size < HEADER_SIZE + TRAILER_SIZE:
+            raise CorruptDataError(self._filename + " is truncated", HEADER_SIZE)
+        stream = Stream(self._buffer, size - TRAILER_SIZE)
+        index_offset = stream.int64()
+        if stream.raw(len(INDEX_MAGIC)) != INDEX_MAGIC or not HEADER_SIZE <= index_offset < size:
+            raise CorruptDataError(self._filename + " has no valid table of contents", size - TRAILER_SIZE)
+        stream = Stream(self._buffer[: size - TRAILER_SIZE], index_offset)
+        index = []
+        try:
+            for _i in range(stream.uint32()):
+                entry = LayerEntry(stream.qstring())
+                entry.offset = stream.int64()
+                entry.length = stream.int64()
+                entry.feature_count = stream.int64()
+                entry.flags = stream.uint32()
+                entry.subset = stream.qstring()
+                entry.fields = [read_field(stream) for _j in range(stream.int16())]
+                entry.properties = stream.qvariant() or {}
+                index.append(entry)
+        except (ValueError, UnicodeDecodeError):
+            raise CorruptDataError(self._filename + " has a damaged table of contents", index_offset) from None
+        return index
+
+    def layers(self):
+        """Yield the layers of the file (LayerData)"""
+        if self._index is not None:
+            for entry in self._index:
+                yield LayerData(self._version, self._buffer, entry.offset)
+            return
+        pos = HEADER_SIZE
+        while pos < len(self._buffer):
+            layer = LayerData(self._version, self._buffer, pos)
+            yield layer
+            pos = layer.end()
+
+    def layer(self, layer_id):
+        """Return the layer with the given id, None if it is not in the file"""
+        if self._offsets is None:
+            # The layers of files without a table of contents are scanned once
+            self._offsets = {}
+            for layer in self.layers():
+                self._offsets.setdefault(layer.layer_id, layer.offset)
+        offset = self._offsets.get(layer_id)
+        return None if offset is None else LayerData(self._version, self._buffer, offset)
@@ -0,0 +1,462 @@
+"""Pure python encoder of mldata files, which depends neither on QGIS nor on Qt
+
+It writes version 3 files with row chunks which can be read by the Reader, from python values
+(see the decoder module for the conversion of the QVariant types):
+
+    with DataFileWriter("layers.mldata") as writer:
+        writer.write_layer(layer_id, fields, features)
+
+where fields is a list of (name, type, typename, length, precision, comment) tuples, type
+being a QMetaType id (see the FIELD_* constants), and features an iterable of (attributes, wkb)
+tuples.
+"""
+
+import datetime
+import os
+import tempfile
+
+from .decoder import (
+    DOUBLE,
+    INT8,
+    INT16,
+    INT32,
+    INT64,
+    JULIAN_DAY_OFFSET,
+    NULL_LENGTH,
+    SPEC_LOCAL,
+    SPEC_UTC,
+    UINT8,
+    UINT32,
+    VARIANT_BOOL,
+    VARIANT_BYTEARRAY,
+    VARIANT_DATE,
+    VARIANT_DATETIME,
+    VARIANT_DOUBLE,
+    VARIANT_INT,
+    VARIANT_INVALID,
+    VARIANT_LIST,
+    VARIANT_LONGLONG,
+    VARIANT_MAP,
+    VARIANT_STRING,
+    VARIANT_STRINGLIST,
+    VARIANT_TIME,
+    local_to_utc,
+)
+from .mldata import (
+    COMPRESSION_FLAGS,
+    DEFAULT_CHUNK_SIZE,
+    FLAG_CHECKSUM,
+    FLAG_COMPACT_GEOMETRY,
+    FORMAT_VERSION,
+    INDEX_MAGIC,
+    MAGIC,
+    WRITE_BUFFER_SIZE,
+    LayerEntry,
+    backup_file,
+    checksum,
+    compress,
+    copy_file_mode,
+    new_fingerprint,
+    sync_directory,
+)
+from .geometry_codec import encode_geometries
+
+# QMetaType ids of the field types supported by the memory provider
+FIELD_BOOL = 1
+FIELD_INT = 2
+FIELD_LONGLONG = 4
+FIELD_DOUBLE = 6
+FIELD_LIST = 9
+FIELD_STRING = 10
+FIELD_STRINGLIST = 11
+FIELD_BYTEARRAY = 12
+FIELD_DATE = 14
+FIELD_TIME = 15
+FIELD_DATETIME = 16
+
+INT32_MIN = -(2**31)
+INT32_MAX = 2**31 - 1
+
+
+class StreamWriter:
+    """Buffer encoding python values as a QDataStream (Qt_4_5, big endian) would"""
+
+    __slots__ = ("parts",)
+
+    def __init__(self):
+        self.parts = []
+
+    def getvalue(self):
+        return b"".join(self.parts)
+
+    def raw(self, data):
+        self.parts.append(bytes(data))
+
+    def int8(self, value):
+        self.parts.append(INT8.pack(value))
+
+    def uint8(self, value):
+        self.parts.append(UINT8.pack(value))
+
+    def int16(self, value):
+        self.parts.append(INT16.pack(value))
+
+    def int32(self, value):
+        self.parts.append(INT32.pack(value))
+
+    def uint32(self, value):
+        self.parts.append(UINT32.pack(value))
+
+    def int64(self, value):
+        self.parts.append(INT64.pack(value))
+
+    def double(self, value):
+        self.parts.append(DOUBLE.pack(value))
+
+    def qstring(self, value):
+        if value is None:
+            self.uint32(NULL_LENGTH)
+            return
+        data = value.encode("utf-16-be", "surrogatepass")
+        self.uint32(len(data))
+        self.parts.append(data)
+
+    def qbytearray(self, value):
+        self.uint32(len(value))
+        self.parts.append(bytes(value))
+
+    def qdate(self, value):
+        self.uint32(value.toordinal() + JULIAN_DAY_OFFSET)
+
+    def qtime(self, value):
+        self.uint32(((value.hour * 60 + value.minute) * 60 + value.second) * 1000 + value.microsecond // 1000)
+
+    def qdatetime(self, value):
+        """Write a datetime, naive datetimes are in local time. Qt_4_5 streams store them in UTC"""
+        if value.tzinfo is None:
+            value = local_to_utc(value)
+            spec = SPEC_LOCAL
+        else:
+            value = value.astimezone(datetime.timezone.utc)
+            spec = SPEC_UTC
+        self.qdate(value.date())
+        self.qtime(value.time())
+        self.int8(spec)
+
+    def qvariant(self, value):
+        """Write a python value as a QVariant, None is written as a NULL (invalid) variant"""
+        if value is None:
+            self.uint32(VARIANT_INVALID)
+            self.uint8(1)
+            # Invalid variants are followed by an empty string in streams older than Qt 5.0
+            self.qstring(None)
+            return
+        # bool is a subclass of int, datetime a subclass of date
+        if isinstance(value, bool):
+            self.variant_header(VARIANT_BOOL)
+            self.uint8(value)
+        elif isinstance(value, int):
+            if INT32_MIN <= value <= INT32_MAX:
+                self.variant_header(VARIANT_INT)
+                self.int32(value)
+            else:
+                self.variant_header(VARIANT_LONGLONG)
+                self.int64(value)
+        elif isinstance(value, float):
+            self.variant_header(VARIANT_DOUBLE)
+            self.double(value)
+        elif isinstance(value, str):
+            self.variant_header(VARIANT_STRING)
+            self.qstring(value)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            self.variant_header(VARIANT_BYTEARRAY)
+            self.qbytearray(value)
+        elif isinstance(value, datetime.datetime):
+            self.variant_header(VARIANT_DATETIME)
+            self.qdatetime(value)
+        elif isinstance(value, datetime.date):
+            self.variant_header(VARIANT_DATE)
+            self.qdate(value)
+        elif isinstance(value, datetime.time):
+            self.variant_header(VARIANT_TIME)
+            self.qtime(value)
+        elif isinstance(value, (dict, list, tuple)):
+            self.qvariant_container(value)
+        else:
+            raise ValueError(f"Cannot encode {type(value).__name__} values")
+
+    def qvariant_container(self, value):
+        """Write a dict as a QVariantMap, a list as a QStringList if it only holds strings, else a QVariantList"""
+        if isinstance(value, dict):
+            self.variant_header(VARIANT_MAP)
+            self.uint32(len(value))
+            for key, item in sorted(value.items(), reverse=True):
+                self.qstring(str(key))
+                self.qvariant(item)
+        elif value and all(isinstance(item, str) for item in value):
+            self.variant_header(VARIANT_STRINGLIST)
+            self.uint32(len(value))
+            for item in value:
+                self.qstring(item)
+        else:
+            self.variant_header(VARIANT_LIST)
+            self.uint32(len(value))
+            for item in value:
+                self.qvariant(item)
+
+    def typed_qvariant(self, value, field_type):
+        """Write a value as a QVariant of the type of its field, when it is compatible"""
+        if field_type == FIELD_LONGLONG and type(value) is int:
+            self.variant_header(VARIANT_LONGLONG)
+            self.int64(value)
+        elif field_type == FIELD_DOUBLE and type(value) in (int, float):
+            self.variant_header(VARIANT_DOUBLE)
+            self.double(value)
+        else:
+            self.qvariant(value)
+
+    def variant_header(self, type_id):
+        self.uint32(type_id)
+        self.uint8(0)
+
+    def field(self, definition):
+        name, field_type, typename, length, precision, comment = definition
+        self.qstring(name)
+        self.int16(field_type)
+        self.qstring(typename)
+        self.int16(length)
+        self.int16(precision)
+        self.qstring(comment)
+
+    def attributes(self, values, field_types):
+        """Write the attributes of a feature, each of them as a QVariant of the type of its field if compatible"""
+        for value, field_type in zip(values, field_types):
+            self.typed_qvariant(value, field_type)
+
+    def wkb(self, wkb):
+        if wkb is None:
+            self.uint32(0)
+        else:
+            self.uint32(len(wkb))
+            self.parts.append(bytes(wkb))
+
+
+def fingerprint_features(fingerprint, rows, geometries, field_types):
+    """Feed the canonical encoding of a chunk of features to a layer fingerprint (hash object)
+
+    rows are the python attribute values of the features (see the decoder module), and field_types
+    the QMetaType ids of their fields. The canonical encoding of a feature is its row encoding: its
+    attributes (see StreamWriter.attributes) followed by its WKB, prefixed by its size. It depends
+    neither on the chunk size, the compression or the encoding of the layer, nor on the versions of
+    Qt and python. DataFileWriter feeds its row chunks directly to the fingerprint.
+    """
+    stream = StreamWriter()
+    for values, wkb in zip(rows, geometries):
+        stream.attributes(values, field_types)
+        stream.wkb(wkb)
+    fingerprint.update(stream.getvalue())
+
+
+class DataFileWriter:
+    """Write a version 3 mldata file without QGIS
+
+    As with the Writer, the file is written to a temporary file which atomically replaces it once complete.
+    """
+
+    def __init__(
+        self,
+        filename,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compression=None,
+        compression_level=6,
+        backup=False,
+        compact_geometry=False,
+    ):
+        self._filename = str(filename)
+        self._chunk_size = max(1, int(chunk_size))
+        self._flags = FLAG_CHECKSUM | (FLAG_COMPACT_GEOMETRY if compact_geometry else 0)
+        if compression:
+            if compression not in COMPRESSION_FLAGS:
+                raise ValueError("Unknown compression " + compression)
+            self._flags |= COMPRESSION_FLAGS[compression]
+        self._compression_level = compression_level
+        # Whether the previous version of the file is kept as filename.bak
+        self._backup = backup
+        self._file = None
+        self._temp_filename = None
+        self._entries = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The file is only replaced if all the layers were successfully written
+        if exc_type is None and self._file is not None:
+            self.write_index()
+            self.commit()
+        self.close()
+
+    def open(self):
+        directory, name = os.path.split(os.path.abspath(self._filename))
+        fd, self._temp_filename = tempfile.mkstemp(prefix=name + ".", dir=directory)
+        self._file = os.fdopen(fd, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._file.write(MAGIC)
+        self._file.write(INT32.pack(FORMAT_VERSION))
+        self._entries = []
+
+    def commit(self):
+        """Flush the temporary file to disk and rename it over the mldata file"""
+        if self._file is None:
+            raise ValueError("Layer stream not open for writing")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        copy_file_mode(self._temp_filename, self._filename)
+        if self._backup:
+            backup_file(self._filename)
+        os.replace(self._temp_filename, self._filename)
+        self._temp_filename = None
+        sync_directory(self._filename)
+
+    def close(self):
+        """Close the file, the temporary file is discarded if it was not committed"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._temp_filename is not None:
+            try:
+                os.remove(self._temp_filename)
+            except OSError:
+                pass
+            self._temp_filename = None
+
+    @property
+    def entries(self):
+        return self._entries
+
+    def write_layer(self, layer_id, fields, features, subset="", extent=None, precision=None):
+        """Write a layer record from its field definitions and (attributes, wkb) features
+
+        If precision (number of decimals) is given, the geometries are written in compact blocks,
+        with their coordinates rounded to it.
+        """
+        if self._file is None:
+            raise ValueError("Layer stream not open for writing")
+        flags = (self._flags | FLAG_COMPACT_GEOMETRY) if precision is not None else self._flags
+        entry = LayerEntry(layer_id, self._file.tell(), flags=flags, subset=subset, fields=list(fields))
+        header = StreamWriter()
+        header.qstring(layer_id)
+        header.qstring(subset)
+        header.int16(len(fields))
+        for definition in fields:
+            header.field(definition)
+        header.uint32(flags)
+        self._file.write(header.getvalue())
+
+        field_types = [definition[1] for definition in fields]
+        fingerprint = new_fingerprint()
+        # With compact geometries, the chunk payload is made of the attributes, then the geometries
+        compact = (flags & FLAG_COMPACT_GEOMETRY) != 0
+        count = 0
+        chunk = StreamWriter()
+        attributes_parts = []
+        geometries = []
+        chunk_count = 0
+        for attributes, wkb in features:
+            start = len(chunk.parts)
+            chunk.attributes(attributes, field_types)
+            if compact:
+                attributes_parts += chunk.parts[start:]
+                geometries.append(wkb)
+            chunk.wkb(wkb)
+            chunk_count += 1
+            if chunk_count == self._chunk_size:
+                data = self.compact_payload(attributes_parts, geometries, precision) if compact else None
+                self.write_chunk(chunk, chunk_count, fingerprint, flags, data)
+                count += chunk_count
+                chunk = StreamWriter()
+                attributes_parts = []
+                geometries = []
+                chunk_count = 0
+        if chunk_count:
+            data = self.compact_payload(attributes_parts, geometries, precision) if compact else None
+            self.write_chunk(chunk, chunk_count, fingerprint, flags, data)
+            count += chunk_count
+        # End of the chunks
+        self._file.write(UINT32.pack(0))
+
+        entry.feature_count = count
+        entry.properties["fingerprint"] = fingerprint.hexdigest()
+        if precision is not None:
+            entry.properties["precision"] = precision
+        if extent is not None:
+            entry.properties["extent"] = [float(value) for value in extent]
+        entry.length = self._file.tell() - entry.offset
+        self._entries.append(entry)
+        return entry
+
+    @staticmethod
+    def compact_payload(attributes_parts, geometries, precision=None):
+        """Return the payload of a chunk with compact geometries"""
+        block = encode_geometries(geometries, precision)
+        return b"".join(attributes_parts) + UINT32.pack(len(block)) + block
+
+    def write_chunk(self, chunk, count, fingerprint, flags, data=None):
+        """Write a chunk, whose row encoding is fed to the fingerprint, and payload is data if given
+
+        The row encoding of the features is their canonical encoding (see fingerprint_features).
+        """
+        row_data = chunk.getvalue()
+        fingerprint.update(row_data)
+        data = compress(row_data if data is None else data, flags, self._compression_level)
+        self._file.write(UINT32.pack(count))
+        self._file.write(UINT32.pack(len(data)))
+        self._file.write(UINT32.pack(checksum(data)))
+        self._file.write(data)
+
+    def copy_layer(self, source, entry, block_size=1 << 20):
+        """Copy a layer record from another mldata file (path), given its table of contents entry"""
+        offset = self._file.tell()
+        with open(source, "rb") as f:
+            f.seek(entry.offset)
+            remaining = entry.length
+            while remaining > 0:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    raise ValueError(str(source) + " is truncated")
+                self._file.write(block)
+                remaining -= len(block)
+        self._entries.append(
+            LayerEntry(
+                entry.layer_id,
+                offset,
+                entry.length,
+                entry.feature_count,
+                entry.flags,
+                entry.subset,
+                list(entry.fields),
+                dict(entry.properties),
+            )
+        )
+
+    def write_index(self):
+        """Write the table of contents at the end of the file"""
+        index_offset = self._file.tell()
+        stream = StreamWriter()
+        stream.uint32(len(self._entries))
+        for entry in self._entries:
+            stream.qstring(entry.layer_id)
+            stream.int64(entry.offset)
+            stream.int64(entry.length)
+            stream.int64(entry.feature_count)
+            stream.uint32(entry.flags)
+            stream.qstring(entry.subset)
+            stream.int16(len(entry.fields))
+            for definition in entry.fields:
+                stream.field(definition)
+            stream.qvariant(entry.properties)
+        stream.int64(index_offset)
+        stream.raw(INDEX_MAGIC)
+        self._file.write(stream.getvalue())
@@ -0,0 +1,70 @@
+from qgis.core import QgsApplication, QgsFeedback
+from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtWidgets import QProgressDialog
+
+# Delay in milliseconds before the progress dialog shows up, so quick loads and saves do not display it
+MINIMUM_DURATION = 1500
+
+
+class ProgressFeedback(QgsFeedback):
+    """Feedback of a load or a save of the memory layers, displayed in a modal progress dialog
+
+    The Reader and the Writer report their progress and check for the cancellation between the chunks,
+    from the main thread: the dialog processes the events of the user interface when its value changes,
+    so its cancel button stays responsive. An operation made of several steps (e.g. a file per layer)
+    reports the progress of each step in its own range of the dialog, see set_step.
+    """
+
+    def __init__(self, label, parent=None, cancelable=True):
+        super().__init__()
+        self.dialog = QProgressDialog(label, self.cancel_text(), 0, 100, parent)
+        self.dialog.setWindowTitle("Memory Layer Saver")
+        self.dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        self.dialog.setMinimumDuration(MINIMUM_DURATION)
+        self.dialog.setValue(0)
+        self.dialog.canceled.connect(self.cancel)
+        self.cancelable = True
+        self.set_cancelable(cancelable)
+        # Range of the dialog (percentages) in which the progress of the current step is reported
+        self.step = (0.0, 100.0)
+        self.progressChanged.connect(self.on_progress_changed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_cancelable(self, cancelable):
+        """Show or hide the cancel button of the dialog"""
+        if cancelable == self.cancelable:
+            return
+        self.cancelable = cancelable
+        if cancelable:
+            # A new button is created, the previous one was deleted
+            self.dialog.setCancelButtonText(self.cancel_text())
+            self.dialog.canceled.connect(self.cancel)
+        else:
+            self.dialog.setCancelButton(None)
+            self.dialog.canceled.disconnect(self.cancel)
+
+    @staticmethod
+    def cancel_text():
+        return QgsApplication.translate("MemoryLayerSaver", "Cancel")
+
+    def set_step(self, start, end):
+        """Report the progress of the next step in the [start, end] range of the dialog (percentages)"""
+        self.step = (start, end)
+
+    def setProgress(self, progress):  # noqa
+        start, end = self.step
+        super().setProgress(start + (end - start) * progress / 100)
+
+    def on_progress_changed(self, progress):
+        self.dialog.setValue(int(progress))
+
+    def close(self):
+        self.progressChanged.disconnect(self.on_progress_changed)
+        self.set_cancelable(False)
+        self.dialog.close()
+        self.dialog.deleteLater()
@@ -0,0 +1,378 @@
+"""Compact encoding of the geometries of a chunk of features, which depends neither on QGIS nor on Qt
+
+The layers with the ``FLAG_COMPACT_GEOMETRY`` flag store the geometries of each chunk in a single
+block following the attributes of the chunk, instead of one WKB per feature. As in TWKB, the
+structure of the geometries is stored as unsigned varints, without the byte order and the 32 bit
+counts of WKB, and the coordinates are optionally quantized and delta encoded. The block is made of:
+
+- the coordinate encoding (uint8, see the ``GEOMETRY_*`` constants), the precision (int8),
+  the size of the structure (uint32) and the number of exceptions (uint32)
+- the structure. For each feature, a varint header:
+  0 for a feature without geometry, 1 for a geometry kept as WKB (followed by the varint size
+  of the WKB and the WKB: curves and other unsupported types), otherwise the ISO WKB type + 2,
+  followed by the number of points (linestrings), rings and points per ring (polygons) or parts
+  (multi geometries and collections, whose parts are described the same way)
+- the positions (uint32) and the values (int64) of the exceptions
+- the coordinates of all the geometries of the chunk, big endian:
+
+  - ``GEOMETRY_DOUBLE``: doubles
+  - ``GEOMETRY_INT8`` to ``GEOMETRY_INT64``: coordinates multiplied by 10^precision and rounded,
+    stored as the difference with the previous coordinate of the same dimension in the chunk.
+    The integer width is chosen per chunk to minimize its size, the differences which do not fit
+    in it (e.g. the jumps between distant features) are stored as exceptions, and 0 in their slot.
+
+The differences are packed with a single width per chunk, instead of one varint per value, so that
+they are decoded by array and itertools.accumulate rather than byte by byte in python.
+
+Usage::
+
+    block = encode_geometries(wkbs, precision=6)
+    wkbs = decode_geometries(block, len(wkbs))
+"""
+
+import math
+import struct
+import sys
+from array import array
+from collections import Counter
+from itertools import accumulate, compress, islice
+from operator import sub
+
+from .mldata import GEOMETRY_DOUBLE, GEOMETRY_INT8, GEOMETRY_INT16, GEOMETRY_INT32, GEOMETRY_INT64
+
+HEADER = struct.Struct(">BbII")
+# Quantized coordinates must be in [-INT64_LIMIT, INT64_LIMIT)
+INT64_LIMIT = float(2**63)
+# Size of a difference which does not fit the integer width of its chunk: position (uint32) and value (int64)
+EXCEPTION_SIZE = 12
+
+# Largest number of decimals of the quantized coordinates, doubles have 15 to 17 significant digits
+MAX_PRECISION = 15
+
+# Structure headers which are not geometry types
+NO_GEOMETRY = 0
+RAW_GEOMETRY = 1
+TYPE_OFFSET = 2
+
+# Simple feature types with coordinates
+POINT = 1
+LINESTRING = 2
+POLYGON = 3
+# Multi geometries and geometry collection
+COLLECTIONS = (4, 5, 6, 7)
+
+# Array typecode and width in bits of the integer encodings
+INTEGER_ENCODINGS = [
+    (GEOMETRY_INT8, "b", 8),
+    (GEOMETRY_INT16, "h", 16),
+    (GEOMETRY_INT32, "i", 32),
+    (GEOMETRY_INT64, "q", 64),
+]
+TYPECODES = {encoding: typecode for encoding, typecode, _bits in INTEGER_ENCODINGS}
+
+NATIVE_ORDER = 1 if sys.byteorder == "little" else 0
+SWAP_BYTES = sys.byteorder == "little"
+# Native WKB header: byte order and type
+WKB_HEADER = struct.Struct("=BI")
+WKB_COUNT = struct.Struct("=I")
+
+
+class UnsupportedGeometry(ValueError):
+    """Raised for the geometries which are kept as WKB"""
+
+
+def write_varint(buffer, value):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, pos):
+    """Return the varint at pos and the position following it"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def geometry_dimensions(wkb_type):
+    """Return the base type (1-7) and the number of dimensions of an ISO WKB type"""
+    base, dims = wkb_type % 1000, wkb_type // 1000
+    if dims > 3 or not POINT <= base <= 7:
+        raise UnsupportedGeometry(f"WKB type {wkb_type}")
+    return base, (2, 3, 3, 4)[dims]
+
+
+class GeometryEncoder:
+    """Accumulate the structure and the coordinates of the geometries of a chunk"""
+
+    def __init__(self):
+        self.structure = bytearray()
+        self.coordinates = array("d")
+        # [dimensions, start, end] runs of coordinates with the same number of dimensions
+        self.runs = []
+
+    def add(self, wkb):
+        if wkb is None:
+            self.structure.append(NO_GEOMETRY)
+            return
+        if not isinstance(wkb, (bytes, bytearray, memoryview)):
+            wkb = bytes(wkb)
+        mark = len(self.structure), len(self.coordinates), len(self.runs), self.runs[-1][2] if self.runs else 0
+        try:
+            self.add_part(wkb, 0)
+        except (UnsupportedGeometry, struct.error, IndexError):
+            # Curves, EWKB or invalid WKB: the geometry is kept as it is
+            del self.structure[mark[0] :]
+            del self.coordinates[mark[1] :]
+            del self.runs[mark[2] :]
+            if self.runs:
+                self.runs[-1][2] = mark[3]
+            self.structure.append(RAW_GEOMETRY)
+            write_varint(self.structure, len(wkb))
+            self.structure += wkb
+
+    def add_part(self, wkb, pos):
+        """Add the geometry (or part) starting at pos in the WKB, return the position of its end"""
+        endian = "<" if wkb[pos] == 1 else ">"
+        (wkb_type,) = struct.unpack_from(endian + "I", wkb, pos + 1)
+        pos += 5
+        base, dims = geometry_dimensions(wkb_type)
+        write_varint(self.structure, wkb_type + TYPE_OFFSET)
+        if base == POINT:
+            return self.add_points(wkb, pos, 1, dims, endian)
+        if base == LINESTRING:
+            (count,) = struct.unpack_from(endian + "I", wkb, pos)
+            write_varint(self.structure, count)
+            return self.add_points(wkb, pos + 4, count, dims, endian)
+        (count,) = struct.unpack_from(endian + "I", wkb, pos)
+        write_varint(self.structure, count)
+        pos += 4
+        for _i in range(count):
+            if base == POLYGON:
+                (points,) = struct.unpack_from(endian + "I", wkb, pos)
+                write_varint(self.structure, points)
+                pos = self.add_points(wkb, pos + 4, points, dims, endian)
+            else:
+                pos = self.add_part(wkb, pos)
+        return pos
+
+    def add_points(self, wkb, pos, count, dims, endian):
+        size = 8 * count * dims
+        if pos + size > len(wkb):
+            raise UnsupportedGeometry("truncated WKB")
+        start = len(self.coordinates)
+        if (endian == "<") == SWAP_BYTES:
+            self.coordinates.frombytes(wkb[pos : pos + size])
+        else:
+            values = array("d", wkb[pos : pos + size])
+            values.byteswap()
+            self.coordinates.extend(values)
+        end = len(self.coordinates)
+        if self.runs and self.runs[-1][0] == dims and self.runs[-1][2] == start:
+            self.runs[-1][2] = end
+        elif end > start:
+            self.runs.append([dims, start, end])
+        return pos + size
+
+    def encode(self, precision=None):
+        """Return the block of the geometries added so far"""
+        data = None
+        if precision is not None:
+            encoding, exceptions, data = self.quantize(precision)
+        if data is not None:
+            positions, exceptions = exceptions
+        else:
+            encoding, precision = GEOMETRY_DOUBLE, 0
+            positions, exceptions = array("I"), array("q")
+            data = array("d", self.coordinates)
+        parts = [HEADER.pack(encoding, precision, len(self.structure), len(positions)), self.structure]
+        for values in (positions, exceptions, data):
+            if SWAP_BYTES:
+                values.byteswap()
+            parts.append(values.tobytes())
+        return b"".join(parts)
+
+    def quantize(self, precision):
+        """Return the integer encoding, the exceptions and the array of the quantized coordinate differences
+
+        The array is None if a coordinate is not finite once scaled (NaN, infinite or too large for the
+        precision), or if the quantized coordinates or their differences do not fit in 64 bits: the block
+        then stores the doubles.
+        """
+        scale = float(10**precision)
+        deltas = []
+        previous = [0, 0, 0, 0]
+        for dims, start, end in self.runs:
+            scaled = [v * scale for v in self.coordinates[start:end]]
+            if not all(map(math.isfinite, scaled)) or not all(-INT64_LIMIT <= v < INT64_LIMIT for v in scaled):
+                return GEOMETRY_DOUBLE, None, None
+            values = list(map(round, scaled))
+            deltas += map(sub, values[:dims], previous[:dims])
+            deltas += map(sub, values[dims:], values[:-dims])
+            previous[:dims] = values[-dims:]
+        # Bit length of the differences, the sign excepted
+        lengths = list(map(int.bit_length, deltas))
+        histogram = Counter(lengths)
+        if histogram and max(histogram) >= 64:
+            return GEOMETRY_DOUBLE, None, None
+        best = None
+        for encoding, typecode, bits in INTEGER_ENCODINGS:
+            outliers = sum(count for length, count in histogram.items() if length >= bits)
+            size = len(deltas) * bits // 8 + outliers * EXCEPTION_SIZE
+            if best is None or size < best[0]:
+                best = size, encoding, typecode, bits, outliers
+        _size, encoding, typecode, bits, outliers = best
+        positions = array("I")
+        exceptions = array("q")
+        if outliers:
+            positions.extend(compress(range(len(deltas)), map(bits.__le__, lengths)))
+            for i in positions:
+                exceptions.append(deltas[i])
+                deltas[i] = 0
+        return encoding, (positions, exceptions), array(typecode, deltas)
+
+
+def round_coordinates(values, precision):
+    """Return the array of the coordinates rounded as in the blocks with the given precision, NaN being kept"""
+    scale = float(10**precision)
+    return array("d", [round(v * scale) / scale if math.isfinite(v * scale) else v for v in values])
+
+
+def encode_geometries(geometries, precision=None):
+    """Return the compact block of a chunk of geometries (WKB, None for the features without geometry)
+
+    If precision (number of decimals, may be negative) is given, the coordinates are rounded to it.
+    """
+    if precision is not None and not -MAX_PRECISION <= precision <= MAX_PRECISION:
+        raise ValueError(f"Invalid geometry precision {precision}")
+    encoder = GeometryEncoder()
+    for wkb in geometries:
+        encoder.add(wkb)
+    return encoder.encode(precision)
+
+
+class GeometryDecoder:
+    """Rebuild the WKB of the geometries of a compact block"""
+
+    def __init__(self, block):
+        self.block = memoryview(block)
+        self.encoding, self.precision, size, self.exception_count = HEADER.unpack_from(self.block)
+        self.structure = self.block[HEADER.size : HEADER.size + size]
+        self.data = self.block[HEADER.size + size :]
+        self.pos = 0
+        self.coordinate_count = 0
+        self.runs = []
+
+    def decode(self, count):
+        """Return the list of the WKB (bytes, None for the features without geometry)"""
+        # Each plan is the list of the WKB headers (bytes) and the number of coordinates (int) following them
+        plans = [self.read_plan() for _i in range(count)]
+        coordinates = self.coordinates().tobytes()
+        geometries = []
+        pos = 0
+        for plan in plans:
+            if plan is None or isinstance(plan, bytes):
+                geometries.append(plan)
+                continue
+            parts = []
+            for item in plan:
+                if isinstance(item, bytes):
+                    parts.append(item)
+                else:
+                    end = pos + 8 * item
+                    parts.append(coordinates[pos:end])
+                    pos = end
+            geometries.append(b"".join(parts))
+        return geometries
+
+    def read_plan(self):
+        header, self.pos = read_varint(self.structure, self.pos)
+        if header == NO_GEOMETRY:
+            return None
+        if header == RAW_GEOMETRY:
+            size, self.pos = read_varint(self.structure, self.pos)
+            self.pos += size
+            return bytes(self.structure[self.pos - size : self.pos])
+        plan = []
+        self.read_part(header - TYPE_OFFSET, plan)
+        return plan
+
+    def read_part(self, wkb_type, plan):
+        base, dims = geometry_dimensions(wkb_type)
+        plan.append(WKB_HEADER.pack(NATIVE_ORDER, wkb_type))
+        if base == POINT:
+            self.add_points(plan, 1, dims)
+            return
+        count, self.pos = read_varint(self.structure, self.pos)
+        plan.append(WKB_COUNT.pack(count))
+        if base == LINESTRING:
+            self.add_points(plan, count, dims)
+            return
+        for _i in range(count):
+            if base == POLYGON:
+                points, self.pos = read_varint(self.structure, self.pos)
+                plan.append(WKB_COUNT.pack(points))
+                self.add_points(plan, points, dims)
+            else:
+                part_type, self.pos = read_varint(self.structure, self.pos)
+                self.read_part(part_type - TYPE_OFFSET, plan)
+
+    def add_points(self, plan, count, dims):
+        size = count * dims
+        plan.append(size)
+        start = self.coordinate_count
+        self.coordinate_count += size
+        if self.runs and self.runs[-1][0] == dims and self.runs[-1][2] == start:
+            self.runs[-1][2] = self.coordinate_count
+        elif size:
+            self.runs.append([dims, start, self.coordinate_count])
+
+    def coordinates(self):
+        """Return the array of the coordinates of the block, in native byte order"""
+        if self.encoding == GEOMETRY_DOUBLE:
+            typecode = "d"
+        elif self.encoding in TYPECODES:
+            typecode = TYPECODES[self.encoding]
+        else:
+            raise ValueError(f"Unknown geometry encoding {self.encoding}")
+        positions = self.read_array("I", self.exception_count, 0)
+        exceptions = self.read_array("q", self.exception_count, 4 * self.exception_count)
+        deltas = self.read_array(typecode, self.coordinate_count, 12 * self.exception_count)
+        if self.encoding == GEOMETRY_DOUBLE:
+            return deltas
+        if exceptions:
+            deltas = array("q", deltas)
+            for i, delta in zip(positions, exceptions):
+                deltas[i] = delta
+        scale = float(10**self.precision)
+        values = array("d", bytes(8 * self.coordinate_count))
+        previous = [0, 0, 0, 0]
+        for dims, start, end in self.runs:
+            for k in range(dims):
+                differences = deltas[start + k : end : dims]
+                quantized = islice(accumulate(differences, initial=previous[k]), 1, None)
+                values[start + k : end : dims] = array("d", [v / scale for v in quantized])
+                previous[k] += sum(differences)
+        return values
+
+    def read_array(self, typecode, count, offset):
+        """Read count big endian values of the array typecode at offset in the coordinate data"""
+        values = array(typecode)
+        values.frombytes(self.data[offset : offset + values.itemsize * count])
+        if len(values) != count:
+            raise ValueError("Unexpected end of the geometry block")
+        if SWAP_BYTES:
+            values.byteswap()
+        return values
+
+
+def decode_geometries(block, count):
+    """Return the list of the WKB of the count geometries of a compact block, None for no geometry"""
+    return GeometryDecoder(block).decode(count)
@@ -0,0 +1,58 @@
+"""Bounded intern tables of the text attributes read from mldata files
+
+Each string read from an mldata file is a new object, and so is the QString the memory provider
+stores for it: a categorical field (status codes, class names...) repeated over millions of features
+holds millions of copies of a few values. An intern table maps each distinct value of a field to a
+single QVariant, which is given to all the features having this value. The QVariant copies stored
+by the provider then share the same string data (Qt implicit sharing).
+
+A table stops growing once it holds capacity values, so fields with unique values (names, identifiers)
+do not keep every value of the layer alive while it is read. The values already in the table are
+still shared. The tables only live while a layer is read.
+"""
+
+from qgis.PyQt.QtCore import QMetaType, QVariant
+
+# Maximum number of distinct values per field
+DEFAULT_INTERN_CAPACITY = 10000
+
+STRING_TYPE = int(QMetaType.Type.QString)
+
+
+class InternTable:
+    """Distinct values of a field, each held by a shared QVariant"""
+
+    def __init__(self, capacity=DEFAULT_INTERN_CAPACITY):
+        self.capacity = capacity
+        # value -> QVariant of the value
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def intern(self, value):
+        """Return the shared QVariant of the value, the value itself if the table is full"""
+        try:
+            return self.values[value]
+        except KeyError:
+            if len(self.values) >= self.capacity:
+                return value
+            shared = self.values[value] = QVariant(value)
+            return shared
+        except TypeError:
+            # Values which cannot be hashed (e.g. a NULL QVariant) are not shared
+            return value
+
+
+def interners(fields, nattr, capacity=DEFAULT_INTERN_CAPACITY):
+    """Return the intern function of each attribute of a layer, None for the attributes which are not text
+
+    Return None if the layer has no text field or if interning is disabled (capacity 0).
+    """
+    if capacity <= 0:
+        return None
+    functions = [
+        InternTable(capacity).intern if i < fields.count() and int(fields.at(i).type()) == STRING_TYPE else None
+        for i in range(nattr)
+    ]
+    return functions if any(functions) else None
@@ -0,0 +1,415 @@
+import os
+
+from qgis.core import QgsFeature, QgsProject
+from qgis.PyQt.QtCore import QByteArray, QDataStream, QFile, QIODevice
+
+from .reader import Reader
+from .toolbox import log, log_error
+from .writer import Writer
+
+JOURNAL_MAGIC = b"QGis.MemoryLayerJournal"
+JOURNAL_VERSION = 1
+
+# Record types
+RECORD_CHECKPOINT = 0
+RECORD_FEATURES_ADDED = 1
+RECORD_FEATURES_REMOVED = 2
+RECORD_ATTRIBUTE_VALUES_CHANGED = 3
+RECORD_GEOMETRIES_CHANGED = 4
+RECORD_ATTRIBUTES_ADDED = 5
+RECORD_ATTRIBUTES_DELETED = 6
+
+# The journal is folded into a full save when it grows beyond this fraction of the mldata file
+COMPACTION_RATIO = 0.5
+# ... unless it is smaller than this size
+COMPACTION_MIN_SIZE = 1 << 20
+
+
+class Journal:
+    """Append-only journal of the edits committed on the memory layers since the last full save
+
+    The journal file starts with JOURNAL_MAGIC, JOURNAL_VERSION (uint32) and its identifier
+    (QString), which is also stored in the table of contents of the mldata file it applies to.
+    It is followed by records made of their type (uint8), the layer id (QString), the size of
+    their payload (uint32) and the payload. The records are appended as soon as the edits are
+    committed, a checkpoint record is appended when the project is saved: the records after
+    the last checkpoint are edits which were not saved, they are only replayed on request
+    (e.g. to recover from a crash).
+
+    Feature ids change when the layers are reloaded, so the records identify the features
+    with references: the features stored in the mldata file by their 1-based position in
+    the layer (which is their feature id once loaded), the features added by the journal
+    by negative numbers (-1 for the first feature added to the layer, -2 for the second...).
+    """
+
+    def __init__(self):
+        self.filepath = None
+        self.journal_id = None
+        # layer id -> {feature id: reference} for the features whose reference is not their id
+        self._refs = {}
+        # layer id -> number of features added by the journal
+        self._added = {}
+        # layer id -> expected field definitions and subset string
+        self._fields = {}
+        self._subsets = {}
+        # Layers with records since the last full save
+        self.modified_layers = set()
+        # Size of the journal file at the last checkpoint
+        self.saved_size = 0
+
+    @property
+    def active(self):
+        return self.filepath is not None
+
+    def stop(self):
+        """Stop recording the edits"""
+        self.filepath = None
+        self.journal_id = None
+        self._refs.clear()
+        self._added.clear()
+        self._fields.clear()
+        self._subsets.clear()
+        self.modified_layers.clear()
+        self.saved_size = 0
+
+    def start(self, filepath, journal_id, layers):
+        """Start a new, empty journal after a full save of the layers"""
+        self.stop()
+        file = QFile(filepath)
+        if not file.open(QIODevice.OpenModeFlag.WriteOnly):
+            log_error("Cannot open " + filepath)
+            return
+        ds = QDataStream(file)
+        ds.setVersion(QDataStream.Version.Qt_4_5)
+        ds.writeRawData(JOURNAL_MAGIC)
+        ds.writeUInt32(JOURNAL_VERSION)
+        ds.writeQString(journal_id)
+        file.close()
+
+        self.filepath = filepath
+        self.saved_size = QFile(filepath).size()
+        self.journal_id = journal_id
+        for layer in layers:
+            dp = layer.dataProvider()
+            self._fields[layer.id()] = [Writer.field_definition(fld) for fld in dp.fields()]
+            self._subsets[layer.id()] = layer.subsetString()
+            # The layers are written in feature id order, so the position of a feature is its rank
+            refs = {}
+            for rank, fid in enumerate(sorted(dp.allFeatureIds()), 1):
+                if fid != rank:
+                    refs[fid] = rank
+            self._refs[layer.id()] = refs
+            self._added[layer.id()] = 0
+
+    @staticmethod
+    def read_journal_id(filepath):
+        """Return the identifier of a journal file, None if it is not a valid journal"""
+        file = QFile(filepath)
+        if not file.open(QIODevice.OpenModeFlag.ReadOnly):
+            return None
+        ds = QDataStream(file)
+        ds.setVersion(QDataStream.Version.Qt_4_5)
+        if ds.readRawData(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC or ds.readUInt32() != JOURNAL_VERSION:
+            return None
+        journal_id = ds.readQString()
+        file.close()
+        return journal_id
+
+    def scan(self, filepath):
+        """Read the records of a journal file
+
+        Return the list of (type, layer id, payload) records, and a (record count, file position)
+        tuple locating the last checkpoint.
+        """
+        file = QFile(filepath)
+        if not file.open(QIODevice.OpenModeFlag.ReadOnly):
+            raise ValueError("Cannot open " + filepath)
+        ds = QDataStream(file)
+        ds.setVersion(QDataStream.Version.Qt_4_5)
+        ds.readRawData(len(JOURNAL_MAGIC))
+        ds.readUInt32()  # version
+        ds.readQString()  # journal id
+        records = []
+        checkpoint = (0, file.pos())
+        while not ds.atEnd():
+            record_type = ds.readUInt8()
+            layer_id = ds.readQString()
+            size = ds.readUInt32()
+            payload = ds.readRawData(size) if size else b""
+            if ds.status() != QDataStream.Status.Ok or len(payload or b"") != size:
+                # Truncated record: the application was interrupted while writing it
+                break
+            records.append((record_type, layer_id, payload))
+            if record_type == RECORD_CHECKPOINT:
+                checkpoint = (len(records), file.pos())
+        file.close()
+        return records, checkpoint
+
+    def open(self, filepath, entries, layers, records, record_count, saved_size):
+        """Replay the first record_count records on the freshly loaded layers and resume recording
+
+        saved_size is the position of the last checkpoint in the journal file.
+        """
+        self.stop()
+        layers_by_id = {layer.id(): layer for layer in layers}
+        for entry in entries:
+            self._fields[entry.layer_id] = list(entry.fields)
+            self._subsets[entry.layer_id] = entry.subset
+            self._added[entry.layer_id] = 0
+        # layer id -> {reference: feature id} for the features added by the journal
+        added_fids = {layer_id: {} for layer_id in self._added}
+        replayed = 0
+        for record_type, layer_id, payload in records[:record_count]:
+            layer = layers_by_id.get(layer_id)
+            if record_type == RECORD_CHECKPOINT or layer is None or layer_id not in self._added:
+                continue
+            self.replay_record(record_type, layer, payload, added_fids[layer_id])
+            self.modified_layers.add(layer_id)
+            replayed += 1
+        if replayed:
+            log(f"Replayed {replayed} journal records from {filepath}")
+
+        for layer_id, fids in added_fids.items():
+            self._refs[layer_id] = {fid: ref for ref, fid in fids.items()}
+        self.filepath = filepath
+        self.journal_id = self.read_journal_id(filepath)
+        self.saved_size = saved_size
+
+    def replay_record(self, record_type, layer, payload, added_fids):
+        stream = QDataStream(QByteArray(payload))
+        stream.setVersion(QDataStream.Version.Qt_4_5)
+        dp = layer.dataProvider()
+        layer_id = layer.id()
+
+        def fid(ref):
+            return added_fids.get(ref, -1) if ref < 0 else ref
+
+        if record_type == RECORD_FEATURES_ADDED:
+            fields = dp.fields()
+            features = []
+            for _i in range(stream.readUInt32()):
+                feat = QgsFeature(fields)
+                for i in range(stream.readInt16()):
+                    value = stream.readQVariant()
+                    if value is not None:
+                        feat[i] = value
+                Reader.read_geometry(stream, feat)
+                features.append(feat)
+            _ok, features = dp.addFeatures(features)
+            for feat in features:
+                self._added[layer_id] += 1
+                added_fids[-self._added[layer_id]] = feat.id()
+        elif record_type == RECORD_FEATURES_REMOVED:
+            dp.deleteFeatures([fid(stream.readInt64()) for _i in range(stream.readUInt32())])
+        elif record_type == RECORD_ATTRIBUTE_VALUES_CHANGED:
+            changes = {}
+            for _i in range(stream.readUInt32()):
+                ref = stream.readInt64()
+                changes[fid(ref)] = {stream.readInt16(): stream.readQVariant() for _j in range(stream.readInt16())}
+            dp.changeAttributeValues(changes)
+        elif record_type == RECORD_GEOMETRIES_CHANGED:
+            changes = {}
+            for _i in range(stream.readUInt32()):
+                ref = stream.readInt64()
+                feat = QgsFeature()
+                Reader.read_geometry(stream, feat)
+                changes[fid(ref)] = feat.geometry()
+            dp.changeGeometryValues(changes)
+        elif record_type == RECORD_ATTRIBUTES_ADDED:
+            definitions = [self.read_field(stream) for _i in range(stream.readInt16())]
+            dp.addAttributes([Reader.create_field(*definition) for definition in definitions])
+            self._fields[layer_id].extend(definitions)
+        elif record_type == RECORD_ATTRIBUTES_DELETED:
+            indexes = [stream.readInt16() for _i in range(stream.readInt16())]
+            dp.deleteAttributes(indexes)
+            self.delete_fields(layer_id, indexes)
+        else:
+            log_error(f"Unknown journal record {record_type}")
+            return
+        layer.updateFields()
+        layer.updateExtents()
+
+    @staticmethod
+    def read_field(stream):
+        return (
+            stream.readQString(),
+            stream.readInt16(),
+            stream.readQString(),
+            stream.readInt16(),
+            stream.readInt16(),
+            stream.readQString(),
+        )
+
+    @staticmethod
+    def write_field(stream, definition):
+        name, field_type, typename, length, precision, comment = definition
+        stream.writeQString(name)
+        stream.writeInt16(field_type)
+        stream.writeQString(typename)
+        stream.writeInt16(length)
+        stream.writeInt16(precision)
+        stream.writeQString(comment)
+
+    def delete_fields(self, layer_id, indexes):
+        for index in sorted(indexes, reverse=True):
+            if 0 <= index < len(self._fields[layer_id]):
+                del self._fields[layer_id][index]
+
+    @staticmethod
+    def truncate(filepath, position):
+        """Drop the records after position (e.g. the unsaved edits the user chose not to recover)"""
+        os.truncate(filepath, position)
+
+    def size(self):
+        return QFile(self.filepath).size() if self.active else 0
+
+    def needs_compaction(self, mldata_filepath):
+        return self.size() > max(COMPACTION_MIN_SIZE, COMPACTION_RATIO * QFile(mldata_filepath).size())
+
+    def can_checkpoint(self, filepath, layers):
+        """Whether the journal fully describes the changes made to the layers since the last full save"""
+        if not self.active or filepath != self.filepath:
+            return False
+        if {layer.id() for layer in layers} != set(self._fields):
+            return False
+        for layer in layers:
+            if layer.subsetString() != self._subsets[layer.id()]:
+                return False
+            fields = [Writer.field_definition(fld) for fld in layer.dataProvider().fields()]
+            if fields != self._fields[layer.id()]:
+                return False
+        return True
+
+    def checkpoint(self):
+        """Mark the records written so far as saved"""
+        self.append(RECORD_CHECKPOINT, "", None, sync=True)
+        self.saved_size = self.size()
+
+    def discard_unsaved(self):
+        """Drop the records written since the last checkpoint (the project is closed without being saved)"""
+        if self.active and self.size() > self.saved_size:
+            self.truncate(self.filepath, self.saved_size)
+
+    def append(self, record_type, layer_id, write_payload, sync=False):
+        payload = QByteArray()
+        if write_payload is not None:
+            stream = QDataStream(payload, QIODevice.OpenModeFlag.WriteOnly)
+            stream.setVersion(QDataStream.Version.Qt_4_5)
+            write_payload(stream)
+            del stream
+        file = QFile(self.filepath)
+        if not file.open(QIODevice.OpenModeFlag.Append):
+            log_error("Cannot open " + self.filepath)
+            self.stop()
+            return
+        ds = QDataStream(file)
+        ds.setVersion(QDataStream.Version.Qt_4_5)
+        ds.writeUInt8(record_type)
+        ds.writeQString(layer_id)
+        data = payload.data()
+        ds.writeUInt32(len(data))
+        ds.writeRawData(data)
+        file.flush()
+        if sync:
+            os.fsync(file.handle())
+        file.close()
+        if layer_id:
+            self.modified_layers.add(layer_id)
+
+    def ref(self, layer_id, fid):
+        return self._refs[layer_id].get(fid, fid)
+
+    def is_recorded(self, layer_id):
+        return self.active and layer_id in self._refs
+
+    def on_features_added(self, layer_id, features):
+        if not self.is_recorded(layer_id):
+            return
+        layer = QgsProject.instance().mapLayer(layer_id)
+        names = [fld.name() for fld in layer.dataProvider().fields()]
+
+        def write_payload(stream):
+            stream.writeUInt32(len(features))
+            for feat in features:
+                stream.writeInt16(len(names))
+                for name in names:
+                    try:
+                        stream.writeQVariant(feat[name])
+                    except KeyError:
+                        stream.writeQVariant(None)
+                geom = feat.geometry()
+                Writer.write_geometry(stream, geom.asWkb() if geom else None)
+
+        self.append(RECORD_FEATURES_ADDED, layer_id, write_payload)
+        for feat in features:
+            self._added[layer_id] += 1
+            self._refs[layer_id][feat.id()] = -self._added[layer_id]
+
+    def on_features_removed(self, layer_id, fids):
+        if not self.is_recorded(layer_id):
+            return
+        refs = [self.ref(layer_id, fid) for fid in fids]
+
+        def write_payload(stream):
+            stream.writeUInt32(len(refs))
+            for ref in refs:
+                stream.writeInt64(ref)
+
+        self.append(RECORD_FEATURES_REMOVED, layer_id, write_payload)
+        for fid in fids:
+            self._refs[layer_id].pop(fid, None)
+
+    def on_attribute_values_changed(self, layer_id, changes):
+        if not self.is_recorded(layer_id):
+            return
+        nfields = len(self._fields[layer_id])
+
+        def write_payload(stream):
+            stream.writeUInt32(len(changes))
+            for fid, values in changes.items():
+                # Ignore the joined and virtual fields, which are not stored in the provider
+                values = {index: value for index, value in values.items() if index < nfields}
+                stream.writeInt64(self.ref(layer_id, fid))
+                stream.writeInt16(len(values))
+                for index, value in values.items():
+                    stream.writeInt16(index)
+                    stream.writeQVariant(value)
+
+        self.append(RECORD_ATTRIBUTE_VALUES_CHANGED, layer_id, write_payload)
+
+    def on_geometries_changed(self, layer_id, changes):
+        if not self.is_recorded(layer_id):
+            return
+
+        def write_payload(stream):
+            stream.writeUInt32(len(changes))
+            for fid, geom in changes.items():
+                stream.writeInt64(self.ref(layer_id, fid))
+                Writer.write_geometry(stream, geom.asWkb() if geom else None)
+
+        self.append(RECORD_GEOMETRIES_CHANGED, layer_id, write_payload)
+
+    def on_attributes_added(self, layer_id, fields):
+        if not self.is_recorded(layer_id):
+            return
+        definitions = [Writer.field_definition(fld) for fld in fields]
+
+        def write_payload(stream):
+            stream.writeInt16(len(definitions))
+            for definition in definitions:
+                self.write_field(stream, definition)
+
+        self.append(RECORD_ATTRIBUTES_ADDED, layer_id, write_payload)
+        self._fields[layer_id].extend(definitions)
+
+    def on_attributes_deleted(self, layer_id, indexes):
+        if not self.is_recorded(layer_id):
+            return
+
+        def write_payload(stream):
+            stream.writeInt16(len(indexes))
+            for index in indexes:
+                stream.writeInt16(index)
+
+        self.append(RECORD_ATTRIBUTES_DELETED, layer_id, write_payload)
+        self.delete_fields(layer_id, indexes)
@@ -51,8 +51,12 @@ class LayerConnector(QObject):
             for layer in QgsProject.instance().mapLayers().values():
                 self.disconnect_layer(layer)
         else:
+            # mapLayers() copies the whole registry of the project, so the layers are looked up one by one
+            project = QgsProject.instance()
             for layer_id in layer_ids:
-                self.disconnect_layer(QgsProject.instance().mapLayers().get(layer_id))
+                layer = project.mapLayer(layer_id)
+                if layer is not None:
+                    self.disconnect_layer(layer)
 
     def connect_layer(self, layer):
         """This method should be overridden by the child class"""
@@ -0,0 +1,217 @@
+from functools import partial
+
+from qgis.core import QgsApplication, QgsProject, QgsRectangle, QgsVectorLayer
+from qgis.gui import QgsLayerTreeViewIndicator
+from qgis.PyQt.QtCore import QObject
+from qgis.utils import iface
+
+from .reader import DEFAULT_BATCH_SIZE, Reader
+from .toolbox import log, log_error
+
+
+def layer_nodes(root):
+    """Return the layer tree nodes of the layers (layer id -> QgsLayerTreeLayer)
+
+    A single traversal of the tree, findLayer walks it again for each layer.
+    """
+    return {node.layerId(): node for node in root.findLayers()}
+
+
+def referenced_layer_ids(project):
+    """Return the ids of the layers whose features are read by other layers: relations and joins"""
+    layer_ids = set()
+    for relation in project.relationManager().relations().values():
+        layer_ids.add(relation.referencedLayerId())
+        layer_ids.add(relation.referencingLayerId())
+    for layer in project.mapLayers().values():
+        if isinstance(layer, QgsVectorLayer):
+            layer_ids.update(join.joinLayerId() for join in layer.vectorJoins())
+    return layer_ids
+
+
+class LazyLoader(QObject):
+    """Defer the loading of the features of memory layers until they are needed
+
+    The layers are registered with their fields, subset string and extent, read from the
+    table of contents of their mldata file. Their features are read the first time the layer
+    is made visible, becomes the current layer, is edited or gets a new subset string.
+    The layers may be read from different files (one attached file per layer).
+
+    The layers in a relation or joined to another layer are always loaded, as their features are
+    read through the other layers. The other pending layers look empty to the expressions, the
+    processing algorithms and featureCount: they are flagged in the layer tree with their stored
+    feature count, and the indicator loads them when it is clicked.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__()
+        self.batch_size = batch_size
+        # layer id -> (layer, table of contents entry, mldata file the layer is read from)
+        self.pending = {}
+        # layer id -> LayerStats of the layers loaded on demand
+        self.stats = {}
+        # layer id -> QgsLayerTreeViewIndicator of the pending layers
+        self.indicators = {}
+        if iface:
+            iface.currentLayerChanged.connect(self.on_current_layer_changed)
+
+    def unload(self):
+        self.clear()
+        if iface:
+            iface.currentLayerChanged.disconnect(self.on_current_layer_changed)
+
+    def has_pending_layers(self):
+        return bool(self.pending)
+
+    def is_pending(self, layer):
+        return layer.id() in self.pending
+
+    def feature_count(self, layer):
+        """Number of features stored in the mldata file for a pending layer"""
+        return self.pending[layer.id()][1].feature_count
+
+    def filepath(self, layer):
+        """mldata file a pending layer is read from"""
+        return self.pending[layer.id()][2]
+
+    def move(self, layer, filepath):
+        """Read a pending layer from another mldata file, to which its record was copied"""
+        _layer, entry, _filepath = self.pending[layer.id()]
+        self.pending[layer.id()] = (layer, entry, filepath)
+
+    def pending_layers(self):
+        return [layer for layer, _entry, _filepath in self.pending.values()]
+
+    def register_layers(self, reader, layers):
+        """Register the layers without reading their features. The visible layers are loaded immediately"""
+        project = QgsProject.instance()
+        root = project.layerTreeRoot()
+        nodes = layer_nodes(root)
+        referenced = referenced_layer_ids(project)
+        for layer in layers:
+            entry = reader.entry(layer.id())
+            if entry is None:
+                continue
+            node = nodes.get(layer.id())
+            if node is None or node.isVisible() or layer.id() in referenced:
+                reader.read_indexed_layer(layer)
+                continue
+
+            log(f"Deferring the loading of layer {layer.id()} ({entry.feature_count} features)")
+            reader.prepare_layer(layer, entry.fields)
+            layer.setSubsetString(entry.subset)
+            layer.updateFields()
+            if "extent" in entry.properties:
+                layer.setExtent(QgsRectangle(*entry.properties["extent"]))
+            if not self.pending:
+                root.visibilityChanged.connect(self.on_visibility_changed)
+                project.relationManager().changed.connect(self.on_references_changed)
+                project.layersAdded.connect(self.on_references_changed)
+            self.pending[layer.id()] = (layer, entry, reader.filename)
+            layer.beforeEditingStarted.connect(self.on_layer_needed)
+            layer.subsetStringChanged.connect(self.on_layer_needed)
+            self.add_indicator(layer, node, entry.feature_count)
+
+    def load(self, layer):
+        """Read the features of a pending layer"""
+        if not self.is_pending(layer):
+            return
+        filepath = self.filepath(layer)
+        self.disconnect_layer(layer)
+        # The subset string may have been changed by the user since the layer was registered
+        subset = layer.subsetString()
+        try:
+            with Reader(filepath, self.batch_size) as reader:
+                reader.read_indexed_layer(layer)
+                self.stats.update(reader.stats)
+        except ValueError as e:
+            log_error(f"Error while loading layer {layer.id()}: {e}")
+        if layer.subsetString() != subset:
+            layer.setSubsetString(subset)
+        layer.triggerRepaint()
+
+    def load_all(self):
+        for layer in self.pending_layers():
+            self.load(layer)
+
+    def discard(self, layer):
+        """Forget a pending layer (e.g. when it is removed from the project)"""
+        if self.is_pending(layer):
+            self.disconnect_layer(layer)
+
+    def clear(self):
+        for layer in self.pending_layers():
+            self.disconnect_layer(layer)
+        self.stats.clear()
+
+    def disconnect_layer(self, layer):
+        self.pending.pop(layer.id(), None)
+        self.remove_indicator(layer.id())
+        try:
+            layer.beforeEditingStarted.disconnect(self.on_layer_needed)
+            layer.subsetStringChanged.disconnect(self.on_layer_needed)
+        except (RuntimeError, TypeError):
+            pass
+        if not self.pending:
+            project = QgsProject.instance()
+            try:
+                project.layerTreeRoot().visibilityChanged.disconnect(self.on_visibility_changed)
+                project.relationManager().changed.disconnect(self.on_references_changed)
+                project.layersAdded.disconnect(self.on_references_changed)
+            except TypeError:
+                pass
+
+    def add_indicator(self, layer, node, feature_count):
+        """Flag a pending layer in the layer tree with its stored feature count"""
+        view = iface.layerTreeView() if iface else None
+        if view is None:
+            return
+        indicator = QgsLayerTreeViewIndicator(view)
+        indicator.setIcon(QgsApplication.getThemeIcon("mActionRefresh.svg"))
+        indicator.setToolTip(
+            self.tr(
+                "The {0} features of this memory layer are not loaded yet, until then the expressions and the "
+                "processing algorithms see it empty. It is loaded when it is shown, selected, edited or filtered. "
+                "Click to load it now."
+            ).format(feature_count)
+        )
+        indicator.clicked.connect(partial(self.on_indicator_clicked, layer.id()))
+        view.addIndicator(node, indicator)
+        self.indicators[layer.id()] = indicator
+
+    def remove_indicator(self, layer_id):
+        indicator = self.indicators.pop(layer_id, None)
+        node = QgsProject.instance().layerTreeRoot().findLayer(layer_id)
+        if indicator is None or node is None:
+            return
+        try:
+            iface.layerTreeView().removeIndicator(node, indicator)
+        except RuntimeError:
+            # The layer tree view was already deleted
+            pass
+
+    def on_visibility_changed(self, _node):
+        # The visibility of a group affects all its layers, so every pending layer is checked
+        nodes = layer_nodes(QgsProject.instance().layerTreeRoot())
+        for layer in self.pending_layers():
+            node = nodes.get(layer.id())
+            if node is not None and node.isVisible():
+                self.load(layer)
+
+    def on_layer_needed(self):
+        self.load(self.sender())
+
+    def on_references_changed(self, _layers=None):
+        # A relation or a join may now read the features of a pending layer
+        referenced = referenced_layer_ids(QgsProject.instance())
+        for layer in self.pending_layers():
+            if layer.id() in referenced:
+                self.load(layer)
+
+    def on_indicator_clicked(self, layer_id, _index):
+        if layer_id in self.pending:
+            self.load(self.pending[layer_id][0])
+
+    def on_current_layer_changed(self, layer):
+        if layer is not None and self.is_pending(layer):
+            self.load(layer)
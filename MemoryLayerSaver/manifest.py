@@ -0,0 +1,87 @@
+"""Manifest of the memory layers stored in one attached file per layer, which depends neither on QGIS nor on Qt
+
+In this storage mode (see Settings.layer_files), each memory layer is stored in its own mldata file
+attached to the project, so only the files of the modified layers are written again when the project
+is saved. The manifest, attached to the project too, is a small JSON document listing them:
+
+    {"format": "MemoryLayerSaver manifest", "version": 1, "layers": {"<layer id>": "<file name>", ...}}
+
+The file names are the names of the attached files without their directory, since QGIS extracts
+the attached files to a temporary directory when the project is opened.
+"""
+
+import json
+import os
+import re
+import tempfile
+
+from .mldata import copy_file_mode, sync_directory
+
+MANIFEST_FORMAT = "MemoryLayerSaver manifest"
+MANIFEST_VERSION = 1
+
+# Suffixes of the attachments of the manifest and of the layer files (QGIS prefixes them with a random string)
+MANIFEST_ATTACHMENT = "layers.manifest"
+LAYER_ATTACHMENT = ".layer.mldata"
+
+
+def layer_file_name(layer_id):
+    """Name of the attached file of a layer
+
+    It never ends with layers.mldata, the name of the attachment of the single mldata file.
+    """
+    return re.sub(r"[^\w.-]", "_", layer_id) + LAYER_ATTACHMENT
+
+
+class Manifest:
+    """List of the attached files of the memory layers"""
+
+    def __init__(self, layers=None):
+        # layer id -> name of the attached file of the layer
+        self.layers = dict(layers or {})
+
+    def __repr__(self):
+        return f"Manifest({self.layers!r})"
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    @classmethod
+    def from_bytes(cls, data):
+        try:
+            document = json.loads(data)
+        except ValueError as e:
+            raise ValueError(f"Invalid memory layer manifest: {e}") from e
+        if not isinstance(document, dict) or document.get("format") != MANIFEST_FORMAT:
+            raise ValueError("Not a memory layer manifest")
+        if document.get("version") != MANIFEST_VERSION:
+            raise ValueError("The memory layer manifest is not compatible with this version of the plugin")
+        layers = document.get("layers")
+        if not isinstance(layers, dict) or not all(isinstance(name, str) for name in layers.values()):
+            raise ValueError("Invalid memory layer manifest: wrong list of layers")
+        return cls(layers)
+
+    def to_bytes(self):
+        document = {"format": MANIFEST_FORMAT, "version": MANIFEST_VERSION, "layers": self.layers}
+        return json.dumps(document, indent=1, sort_keys=True).encode("utf-8")
+
+    def write(self, filename):
+        """Write the manifest to a temporary file, flushed to disk and renamed over the manifest"""
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp_filename = tempfile.mkstemp(prefix=os.path.basename(filename) + ".", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.to_bytes())
+                f.flush()
+                os.fsync(f.fileno())
+            copy_file_mode(temp_filename, filename)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+            raise
+        sync_directory(filename)
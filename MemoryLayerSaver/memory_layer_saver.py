@@ -1,28 +1,66 @@
 import configparser
 import sys
+import uuid
+from functools import partial
 from pathlib import Path
 
-from qgis.core import QgsApplication, QgsProject
-from qgis.PyQt.QtCore import QFile
+from qgis.core import QgsApplication, QgsMapLayer, QgsProject
+from qgis.gui import QgsLayerTreeViewIndicator
+from qgis.PyQt.QtCore import QFile, QTimer
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QMessageBox, QStyle, QWidget
 from qgis.utils import iface
 
+from MemoryLayerSaver.autosave import Autosave
+from MemoryLayerSaver.feedback import ProgressFeedback
+from MemoryLayerSaver.journal import Journal
 from MemoryLayerSaver.layer_connector import LayerConnector
+from MemoryLayerSaver.lazy_loader import LazyLoader
+from MemoryLayerSaver.manifest import MANIFEST_ATTACHMENT, Manifest, layer_file_name
+from MemoryLayerSaver.mldata import CanceledError, CorruptDataError
 from MemoryLayerSaver.reader import Reader
+from MemoryLayerSaver.sampling import Sample
+from MemoryLayerSaver.save_task import SaveTask
 from MemoryLayerSaver.settings import Settings
 from MemoryLayerSaver.settings_dialog import SettingsDialog
-from MemoryLayerSaver.toolbox import log
-from MemoryLayerSaver.writer import Writer
+from MemoryLayerSaver.stats import COPY
+from MemoryLayerSaver.toolbox import log, log_error
+from MemoryLayerSaver.writer import LayerSnapshot, Writer
 
 DIR_PLUGIN_ROOT: Path = Path(__file__).parent
+# Project entry (scope, key) of the id of the save which wrote the mldata file
+SAVE_ID_ENTRY = ("MemoryLayerSaver", "saveId")
 
 
 class MemoryLayerSaver(LayerConnector):
     def __init__(self):
-        super().__init__()
+        super().__init__(delay_connect=True)
+        # Ids of the layers whose data changed since the last save
+        self.modified_layers = set()
+        # Pending background save
+        self.save_task = None
+        self.lazy_loader = LazyLoader()
+        self.journal = Journal()
+        # layer id -> LayerStats of the last save and the last load
+        self.save_stats = {}
+        self.load_stats = {}
+        # layer id -> (layer, mldata file) of the layers previewed or whose loading was canceled, to be read again
+        self.partial_layers = {}
+        # layer id -> QgsLayerTreeViewIndicator flagging a partial layer in the layer tree
+        self.partial_indicators = {}
+        # Ids of the layers loaded with a sample of their features by the last load (preview mode)
+        self.previewed_layers = set()
+        # layer id -> layer of the memory layers saved with the project, maintained as the layers are added,
+        # removed or changed, so they are not looked for among all the layers of the project
+        self.saved_layers = {}
+        # Checkpoints of the layers modified since the project was saved
+        self.autosave = Autosave(self.is_complete_layer)
+        self.attach()
+
         proj = QgsProject.instance()
         self.has_modified_layers = proj.isDirty()
+        if not self.has_modified_layers:
+            self.modified_layers.clear()
 
         proj.readProject.connect(self.load_data)
         proj.writeProject.connect(self.save_data)
@@ -44,6 +82,13 @@ class MemoryLayerSaver(LayerConnector):
         self.info_action.setObjectName("memory_layer_saver_info")
         self.info_action.triggered.connect(self.show_info)
 
+        self.complete_action = self.menu.addAction(self.tr("Load the partial memory layers completely"))
+        self.complete_action.setObjectName("memory_layer_saver_complete")
+        self.complete_action.setToolTip(
+            self.tr("Load all the features of the memory layers previewed or whose loading was canceled")
+        )
+        self.complete_action.triggered.connect(self.load_partial_layers)
+
         self.settings_action = self.menu.addAction(
             QgsApplication.getThemeIcon("mActionOptions.svg"), self.tr("Settings")
         )
@@ -59,6 +104,12 @@ class MemoryLayerSaver(LayerConnector):
         return QgsApplication.translate("MemoryLayerSaver", message, *args, **kwargs)
 
     def unload(self):
+        self.wait_for_save_task()
+        self.autosave.stop()
+        # Layers must not stay empty once the plugin is unloaded
+        self.lazy_loader.load_all()
+        self.lazy_loader.unload()
+        self.complete_partial_layers(cancelable=False)
         iface.pluginMenu().removeAction(self.menu.menuAction())
         self.detach()
         proj = QgsProject.instance()
@@ -72,61 +123,602 @@ class MemoryLayerSaver(LayerConnector):
     def on_cleared(self):
         """Called when the project is cleared (new project)"""
         self.has_modified_layers = False
+        self.modified_layers.clear()
+        self.lazy_loader.clear()
+        self.clear_partial_layers()
+        self.save_stats = {}
+        self.load_stats = {}
+        # The edits which were not saved must not be replayed when the project is reopened
+        self.journal.discard_unsaved()
+        self.journal.stop()
+        # The layers which were not saved are discarded with the project
+        self.autosave.clear()
 
     def connect_layer(self, layer):
+        if layer.type() == QgsMapLayer.LayerType.VectorLayer:
+            # A layer becomes a saved memory layer, or stops being one, when its data source
+            # or its custom properties change
+            layer.dataSourceChanged.connect(self.on_layer_changed)
+            layer.customPropertyChanged.connect(self.on_layer_changed)
         if Settings.is_saved_layer(layer):
-            layer.committedAttributesDeleted.connect(self.set_project_dirty)
-            layer.committedAttributesAdded.connect(self.set_project_dirty)
-            layer.committedFeaturesRemoved.connect(self.set_project_dirty)
-            layer.committedFeaturesAdded.connect(self.set_project_dirty)
-            layer.committedAttributeValuesChanges.connect(self.set_project_dirty)
-            layer.committedGeometriesChanges.connect(self.set_project_dirty)
-            layer.dataSourceChanged.connect(self.on_data_source_changed)
-            # Connect layer will be called when a layer is added to the project
-            # So we set the has_modified_layers flag to ensure the mldata file will be
-            # updated when the project is saved
-            self.has_modified_layers = True
+            self.register_layer(layer)
 
     def disconnect_layer(self, layer):
+        self.unregister_layer(layer)
         try:
-            layer.committedAttributesDeleted.disconnect(self.set_project_dirty)
-            layer.committedAttributesAdded.disconnect(self.set_project_dirty)
-            layer.committedFeaturesRemoved.disconnect(self.set_project_dirty)
-            layer.committedFeaturesAdded.disconnect(self.set_project_dirty)
-            layer.committedAttributeValuesChanges.disconnect(self.set_project_dirty)
-            layer.committedGeometriesChanges.disconnect(self.set_project_dirty)
-            layer.dataSourceChanged.disconnect(self.on_data_source_changed)
-            # Disconnect layer will be called when a layer is removed from the project
-            # So we set the has_modified_layers flag to ensure the mldata file will be
-            # updated when the project is saved
-            self.has_modified_layers = True
+            layer.dataSourceChanged.disconnect(self.on_layer_changed)
+            layer.customPropertyChanged.disconnect(self.on_layer_changed)
         except (AttributeError, TypeError):  # layer was not previously connected
             pass
 
-    def load_data(self):
-        """Load the memory layers from the .mldata file"""
+    def register_layer(self, layer):
+        """Add a memory layer to the registry of the saved layers and track its edits"""
+        self.saved_layers[layer.id()] = layer
+        layer.committedAttributesDeleted.connect(self.set_project_dirty)
+        layer.committedAttributesAdded.connect(self.set_project_dirty)
+        layer.committedFeaturesRemoved.connect(self.set_project_dirty)
+        layer.committedFeaturesAdded.connect(self.set_project_dirty)
+        layer.committedAttributeValuesChanges.connect(self.set_project_dirty)
+        layer.committedGeometriesChanges.connect(self.set_project_dirty)
+        layer.committedAttributesDeleted.connect(self.journal.on_attributes_deleted)
+        layer.committedAttributesAdded.connect(self.journal.on_attributes_added)
+        layer.committedFeaturesRemoved.connect(self.journal.on_features_removed)
+        layer.committedFeaturesAdded.connect(self.journal.on_features_added)
+        layer.committedAttributeValuesChanges.connect(self.journal.on_attribute_values_changed)
+        layer.committedGeometriesChanges.connect(self.journal.on_geometries_changed)
+        # A layer is registered when it is added to the project, or becomes a saved memory layer
+        # So we set the has_modified_layers flag to ensure the mldata file will be
+        # updated when the project is saved
+        self.has_modified_layers = True
+        self.modified_layers.add(layer.id())
+
+    def unregister_layer(self, layer):
+        """Remove a layer from the registry of the saved layers, if it is in it"""
+        if self.saved_layers.pop(layer.id(), None) is None:
+            return
+        self.lazy_loader.discard(layer)
+        self.discard_partial_layer(layer.id())
+        self.autosave.discard(layer.id())
+        layer.committedAttributesDeleted.disconnect(self.set_project_dirty)
+        layer.committedAttributesAdded.disconnect(self.set_project_dirty)
+        layer.committedFeaturesRemoved.disconnect(self.set_project_dirty)
+        layer.committedFeaturesAdded.disconnect(self.set_project_dirty)
+        layer.committedAttributeValuesChanges.disconnect(self.set_project_dirty)
+        layer.committedGeometriesChanges.disconnect(self.set_project_dirty)
+        layer.committedAttributesDeleted.disconnect(self.journal.on_attributes_deleted)
+        layer.committedAttributesAdded.disconnect(self.journal.on_attributes_added)
+        layer.committedFeaturesRemoved.disconnect(self.journal.on_features_removed)
+        layer.committedFeaturesAdded.disconnect(self.journal.on_features_added)
+        layer.committedAttributeValuesChanges.disconnect(self.journal.on_attribute_values_changed)
+        layer.committedGeometriesChanges.disconnect(self.journal.on_geometries_changed)
+        # A layer is unregistered when it is removed from the project, or is no longer saved
+        # So we set the has_modified_layers flag to ensure the mldata file will be
+        # updated when the project is saved
+        self.has_modified_layers = True
+        self.modified_layers.discard(layer.id())
+
+    def load_data(self, _doc=None):
+        """Load the memory layers from the .mldata file, or from their own files"""
+        self.wait_for_save_task()
         filepath = self.memory_layer_file()
-        file = QFile(filepath)
-        if file.exists():
+        manifest_filepath = self.manifest_file()
+        recovered, replayed, damaged = False, set(), set()
+        stale = False
+        self.load_stats = {}
+        self.previewed_layers = set()
+        if manifest_filepath:
+            damaged = self.read_layer_files(manifest_filepath)
+        elif QFile(filepath).exists():
             layers = list(self.memory_layers())
             log(f"Loading memory layers from {filepath} ({len(layers)} layers)")
+            stale = self.is_stale_file(filepath)
             if layers:
                 try:
-                    with Reader(filepath) as reader:
-                        reader.read_layers(layers)
+                    recovered, replayed = self.read_layers(filepath, layers)
+                except CorruptDataError as e:
+                    damaged = self.recover_layers(filepath, layers, e)
+                except CanceledError:
+                    self.show_load_canceled()
                 except BaseException:
                     QMessageBox.information(
                         iface.mainWindow(), self.tr("Error reloading memory layers"), str(sys.exc_info()[1])
                     )
 
-        self.has_modified_layers = False
+        # The recovered edits are not saved yet
+        self.has_modified_layers = recovered or bool(damaged)
+        self.modified_layers.clear()
+        # The records of the damaged layers must not be copied when the project is saved
+        self.modified_layers.update(damaged)
+        if not self.journal.active:
+            # The layers which were replayed differ from the mldata file
+            self.modified_layers.update(replayed)
+        if self.previewed_layers & set(self.partial_layers):
+            self.show_preview()
+        self.recover_checkpoint(stale)
+
+    def read_layers(self, filepath, layers, feedback=None):
+        """Read the layers from the mldata file, or register them in the lazy loader, and replay the journal
+
+        Return whether unsaved edits were recovered from the journal, and the ids of the layers replayed.
+        The progress is displayed in a dialog (feedback, created if not given) which lets the user cancel
+        the loading: the layers which were not completely read are then flagged as partial, and a
+        CanceledError is raised.
+        """
+        if feedback is None:
+            with ProgressFeedback(self.tr("Loading memory layers..."), iface.mainWindow()) as feedback:
+                return self.read_layers(filepath, layers, feedback)
+
+        with Reader(filepath, Settings.batch_size(), feedback=feedback) as reader:
+            journal = self.scan_journal(reader)
+            has_records = bool(journal and journal[1])
+            # The journal identifies the saved features by their position, which is their feature id only while
+            # the layers are never truncated and read again: the records are replayed on freshly loaded layers,
+            # and an edit journal kept open must not follow previewed or partial layers
+            load_completely = has_records or (bool(journal) and Settings.edit_journal())
+            feedback.set_cancelable(not load_completely)
+            samples = self.preview_samples(reader, layers) if not load_completely else {}
+            try:
+                if Settings.lazy_loading() and reader.index is not None and not has_records:
+                    if samples:
+                        # The previewed layers are read right away, they are small
+                        reader.read_layers([layer for layer in layers if layer.id() in samples], samples=samples)
+                    self.lazy_loader.batch_size = Settings.batch_size()
+                    self.lazy_loader.register_layers(reader, [layer for layer in layers if layer.id() not in samples])
+                else:
+                    reader.read_layers(layers, Settings.load_threads(), samples)
+                # The previewed layers are never saved truncated
+                self.set_partial_layers(filepath, [layer for layer in layers if layer.id() in reader.sampled])
+                self.previewed_layers |= reader.sampled
+            except CanceledError:
+                self.set_partial_layers(
+                    filepath,
+                    [
+                        layer
+                        for layer in layers
+                        if layer.id() not in reader.stats and not self.lazy_loader.is_pending(layer)
+                    ],
+                )
+                raise
+            finally:
+                self.load_stats.update(reader.stats)
+            if not journal:
+                return False, set()
+            recovered, replayed = self.replay_journal(reader, layers, *journal)
+        return recovered, replayed
+
+    def read_layer_files(self, manifest_filepath):
+        """Read the memory layers from their own attached files, listed in the manifest
+
+        Return the ids of the layers which must be written again, since their file is damaged.
+        """
+        try:
+            files = self.layer_files(Manifest.read(manifest_filepath))
+        except (OSError, ValueError) as e:
+            QMessageBox.information(iface.mainWindow(), self.tr("Error reloading memory layers"), str(e))
+            return set()
+        # Only the files of the layers of the project are opened
+        layers = [layer for layer in self.memory_layers() if layer.id() in files]
+        log(f"Loading memory layers from {len(layers)} layer files")
+        sizes = [QFile(files[layer.id()]).size() for layer in layers]
+        total = max(1, sum(sizes))
+        done = 0
+        damaged = set()
+        with ProgressFeedback(self.tr("Loading memory layers..."), iface.mainWindow()) as feedback:
+            for i, (layer, size) in enumerate(zip(layers, sizes)):
+                filepath = files[layer.id()]
+                # Each file has a share of the progress dialog proportional to its size
+                feedback.set_step(100 * done / total, 100 * (done + size) / total)
+                done += size
+                try:
+                    self.read_layers(filepath, [layer], feedback)
+                except CorruptDataError as e:
+                    damaged |= self.recover_layers(filepath, [layer], e)
+                except CanceledError:
+                    # The layers which were not read yet are partial too
+                    for other in layers[i + 1 :]:
+                        self.set_partial_layers(files[other.id()], [other])
+                    self.show_load_canceled()
+                    break
+                except BaseException:
+                    QMessageBox.information(
+                        iface.mainWindow(), self.tr("Error reloading memory layers"), str(sys.exc_info()[1])
+                    )
+        return damaged
+
+    def show_preview(self):
+        previewed = self.previewed_layers & set(self.partial_layers)
+        log(f"{len(previewed)} memory layers are previewed")
+        iface.messageBar().pushInfo(
+            "Memory Layer Saver",
+            self.tr(
+                "{0} memory layers are previewed with a sample of their features. They are loaded "
+                "completely before being edited or saved, or from the plugin menu."
+            ).format(len(previewed)),
+        )
+
+    def show_load_canceled(self):
+        log(f"Loading memory layers was canceled, {len(self.partial_layers)} layers are partial")
+        iface.messageBar().pushWarning(
+            "Memory Layer Saver",
+            self.tr(
+                "Loading the memory layers was canceled, {0} layers are incomplete. "
+                "They are loaded completely before being edited or saved."
+            ).format(len(self.partial_layers)),
+        )
+
+    def preview_samples(self, reader, layers):
+        """Return the samples of the layers loaded in preview mode (layer id -> Sample)
+
+        A layer is previewed if it has more features in the mldata file than its preview size,
+        see Settings.layer_preview_features. Files without table of contents are loaded completely.
+        """
+        if reader.index is None:
+            return {}
+        samples = {}
+        for layer in layers:
+            entry = reader.entry(layer.id())
+            max_features = Settings.layer_preview_features(layer)
+            if entry is not None and 0 < max_features < entry.feature_count:
+                samples[layer.id()] = Sample(
+                    max_features, Settings.preview_sampling(), entry.feature_count, entry.properties.get("extent")
+                )
+        return samples
+
+    def set_partial_layers(self, filepath, layers):
+        """Flag the layers which are not loaded completely (preview or canceled loading)
+
+        They are read again before being edited, filtered or saved, unless their record can be copied
+        from the file they were read from (see partial_layers_to_complete).
+        """
+        for layer in layers:
+            if layer.id() not in self.partial_layers:
+                self.partial_layers[layer.id()] = (layer, filepath)
+                layer.beforeEditingStarted.connect(self.on_partial_layer_edited)
+                layer.subsetStringChanged.connect(self.on_partial_layer_edited)
+                self.add_partial_indicator(layer)
+
+    def discard_partial_layer(self, layer_id):
+        layer, _filepath = self.partial_layers.pop(layer_id, (None, None))
+        if layer is None:
+            return
+        self.remove_partial_indicator(layer_id)
+        try:
+            layer.beforeEditingStarted.disconnect(self.on_partial_layer_edited)
+            layer.subsetStringChanged.disconnect(self.on_partial_layer_edited)
+        except (RuntimeError, TypeError):
+            pass
+
+    def clear_partial_layers(self):
+        for layer_id in list(self.partial_layers):
+            self.discard_partial_layer(layer_id)
+
+    def add_partial_indicator(self, layer):
+        """Flag a partial layer in the layer tree, clicking the indicator loads the layer completely"""
+        view = iface.layerTreeView()
+        node = QgsProject.instance().layerTreeRoot().findLayer(layer.id())
+        if view is None or node is None:
+            return
+        indicator = QgsLayerTreeViewIndicator(view)
+        indicator.setIcon(QgsApplication.getThemeIcon("mIconWarning.svg"))
+        indicator.setToolTip(
+            self.tr(
+                "Only {0} features of this memory layer are loaded. Click to load it completely, "
+                "it is also loaded completely before being edited or saved."
+            ).format(layer.dataProvider().featureCount())
+        )
+        indicator.clicked.connect(lambda _index, layer_id=layer.id(): self.complete_partial_layers(True, {layer_id}))
+        view.addIndicator(node, indicator)
+        self.partial_indicators[layer.id()] = indicator
+
+    def remove_partial_indicator(self, layer_id):
+        indicator = self.partial_indicators.pop(layer_id, None)
+        node = QgsProject.instance().layerTreeRoot().findLayer(layer_id)
+        if indicator is None or node is None:
+            return
+        try:
+            iface.layerTreeView().removeIndicator(node, indicator)
+        except RuntimeError:
+            # The layer tree view was already deleted
+            pass
 
-    def save_data(self):
-        """Write the layers to the .mldata file"""
+    def load_partial_layers(self):
+        """Load completely the memory layers which are previewed or whose loading was canceled"""
+        if not self.partial_layers:
+            iface.messageBar().pushInfo("Memory Layer Saver", self.tr("All the memory layers are loaded completely"))
+            return
+        self.complete_partial_layers()
+
+    def partial_layers_to_complete(self, previous_filepaths):
+        """Return the ids of the partial layers which must be loaded completely before the layers are saved
+
+        The record of a partial layer is copied when the file it was read from is written again
+        (previous_filepaths: layer id -> previous version of the file the layer is written to),
+        as long as it is still up to date. Otherwise the layer is loaded completely first, so it is
+        never saved truncated.
+        """
+        layer_ids = set()
+        # mldata file -> Reader, None if the file cannot be read
+        readers = {}
+        try:
+            for layer_id, (layer, filepath) in self.partial_layers.items():
+                if layer_id in self.modified_layers or previous_filepaths.get(layer_id) != filepath:
+                    layer_ids.add(layer_id)
+                    continue
+                if filepath not in readers:
+                    readers[filepath] = Reader.try_open(filepath)
+                if Writer.reusable_entry(layer, readers[filepath], set()) is None:
+                    layer_ids.add(layer_id)
+        finally:
+            for reader in readers.values():
+                if reader is not None:
+                    reader.close()
+        return layer_ids
+
+    def complete_partial_layers(self, cancelable=True, layer_ids=None):
+        """Read again the partial layers (all of them or the given ids), so they are never edited or saved truncated
+
+        Return False if the loading is canceled again or fails, the layers are then still partial.
+        """
+        if layer_ids is None:
+            layer_ids = set(self.partial_layers)
+        # mldata file -> partial layers read from it
+        files = {}
+        for layer_id in layer_ids:
+            if layer_id not in self.partial_layers:
+                continue
+            layer, filepath = self.partial_layers[layer_id]
+            files.setdefault(filepath, []).append(layer)
+            self.discard_partial_layer(layer_id)
+        if not files:
+            return True
+        with ProgressFeedback(self.tr("Loading memory layers..."), iface.mainWindow(), cancelable) as feedback:
+            for i, (filepath, layers) in enumerate(files.items()):
+                feedback.set_step(100 * i / len(files), 100 * (i + 1) / len(files))
+                if not self.complete_layers(filepath, layers, feedback):
+                    # The layers of the remaining files are still partial
+                    for other_filepath, other_layers in list(files.items())[i + 1 :]:
+                        self.set_partial_layers(other_filepath, other_layers)
+                    return False
+        return True
+
+    def complete_layers(self, filepath, layers, feedback):
+        """Truncate the partial layers and read them again from the mldata file, return False on failure"""
+        log(f"Loading the partial memory layers from {filepath} ({len(layers)} layers)")
+        # The subset strings may have been changed by the user since the layers were read
+        subsets = {layer.id(): layer.subsetString() for layer in layers}
+        if self.journal.active:
+            # The layers read again no longer have the feature ids the journal refers to, the next save is a full one
+            self.journal.stop()
+        reader = None
+        try:
+            for layer in layers:
+                layer.dataProvider().truncate()
+            with Reader(filepath, Settings.batch_size(), feedback=feedback) as reader:
+                reader.read_layers(layers, Settings.load_threads())
+        except BaseException as e:
+            # Without a reader, none of the layers was read
+            read = reader.stats if reader is not None else {}
+            self.set_partial_layers(filepath, [layer for layer in layers if layer.id() not in read])
+            if not isinstance(e, CanceledError):
+                QMessageBox.information(iface.mainWindow(), self.tr("Error reloading memory layers"), str(e))
+            return False
+        finally:
+            if reader is not None:
+                self.load_stats.update(reader.stats)
+        for layer in layers:
+            if layer.subsetString() != subsets[layer.id()]:
+                layer.setSubsetString(subsets[layer.id()])
+            layer.triggerRepaint()
+        return True
+
+    def on_partial_layer_edited(self):
+        # The edits of a partial layer would be lost when it is read again: it is completed first.
+        # So is a partial layer given another subset string, whose record could no longer be copied
+        layer = self.sender()
+        if layer is not None and layer.id() in self.partial_layers:
+            self.complete_partial_layers(False, {layer.id()})
+
+    def recover_layers(self, filepath, layers, error):
+        """Offer to load the intact layers and chunks of a damaged mldata file
+
+        Return the ids of the layers which must be written again, since their record is damaged.
+        """
+        answer = QMessageBox.question(
+            iface.mainWindow(),
+            self.tr("Damaged memory layer data"),
+            self.tr(
+                "The memory layer data is damaged:\n{0}\n\n"
+                "Do you want to load its intact layers and chunks? "
+                "The damaged features will be lost when the project is saved."
+            ).format(error),
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            return set()
+
+        # The layers are read again from scratch, and the journal no longer applies to them
+        for layer in layers:
+            self.lazy_loader.discard(layer)
+            self.discard_partial_layer(layer.id())
+        self.journal.stop()
+        try:
+            for layer in layers:
+                layer.dataProvider().truncate()
+            with Reader(filepath, Settings.batch_size(), recover=True) as reader:
+                reader.read_layers(layers)
+                self.load_stats.update(reader.stats)
+                damaged = reader.damaged
+        except BaseException:
+            QMessageBox.information(
+                iface.mainWindow(), self.tr("Error reloading memory layers"), str(sys.exc_info()[1])
+            )
+            return set()
+
+        lines = [str(damaged_range) for damaged_range in damaged[:10]]
+        if len(damaged) > len(lines):
+            lines.append("...")
+        QMessageBox.warning(
+            iface.mainWindow(),
+            self.tr("Damaged memory layer data"),
+            self.tr("The following parts of the memory layer data could not be read:\n{0}").format("\n".join(lines)),
+        )
+        layer_ids = {damaged_range.layer_id for damaged_range in damaged}
+        if None in layer_ids:
+            # The layers of the unreadable parts of the file are unknown
+            return {layer.id() for layer in layers}
+        return layer_ids
+
+    def is_stale_file(self, filepath):
+        """Return whether the mldata file was not written by the save of the project
+
+        That is the case when the project was saved but not the mldata file, e.g. when QGIS
+        stopped during a background save. The files without save id are not checked.
+        """
+        save_id = self.project_save_id()
+        previous = Reader.try_open(filepath)
+        if previous is None:
+            return False
+        try:
+            save_ids = {entry.properties.get("save") for entry in previous.index or []}
+        finally:
+            previous.close()
+        if not save_id or not save_ids or None in save_ids or save_ids == {save_id}:
+            return False
+        log_error(f"{filepath} was not written by the last save of the project")
+        return True
+
+    def show_stale_file(self):
+        iface.messageBar().pushWarning(
+            "Memory Layer Saver",
+            self.tr(
+                "The memory layers were not completely saved with the project, "
+                "their previously saved version is loaded."
+            ),
+        )
+
+    def recover_checkpoint(self, stale=False):
+        """Offer to load the layers from the autosave checkpoint, if it is newer than the project file
+
+        If the mldata file is stale (see is_stale_file), the checkpoint is offered whatever its age:
+        it holds the layers which were modified before the project was saved.
+        """
+        filepath = Autosave.recoverable_file(check_age=not stale)
+        if not filepath:
+            if stale:
+                self.show_stale_file()
+            return
+        try:
+            with Reader(filepath, Settings.batch_size()) as reader:
+                layers = [layer for layer in self.memory_layers() if reader.entry(layer.id()) is not None]
+        except BaseException:
+            log_error(f"Unreadable autosave checkpoint {filepath}: {sys.exc_info()[1]}")
+            return
+        if not layers:
+            QFile.remove(filepath)
+            return
+        if stale:
+            message = self.tr(
+                "The memory layers were not completely saved with the project. {0} memory layers were "
+                "autosaved before it was saved:\n{1}\n\n"
+                "Do you want to recover them? Otherwise their previously saved version is kept."
+            )
+        else:
+            message = self.tr(
+                "{0} memory layers were autosaved after the project was last saved:\n{1}\n\n"
+                "Do you want to recover them? Otherwise the autosaved edits are discarded."
+            )
+        answer = QMessageBox.question(
+            iface.mainWindow(),
+            self.tr("Autosaved memory layers"),
+            message.format(len(layers), "\n".join(layer.name() for layer in layers[:10])),
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            QFile.remove(filepath)
+            return
+
+        # The layers are read again from scratch, and the journal no longer applies to them
+        for layer in layers:
+            self.lazy_loader.discard(layer)
+            self.discard_partial_layer(layer.id())
+        self.journal.stop()
+        log(f"Recovering {len(layers)} memory layers from {filepath}")
+        try:
+            for layer in layers:
+                layer.dataProvider().truncate()
+            with ProgressFeedback(self.tr("Loading memory layers..."), iface.mainWindow(), False) as feedback:
+                with Reader(filepath, Settings.batch_size(), feedback=feedback) as reader:
+                    reader.read_layers(layers, Settings.load_threads())
+                    self.load_stats.update(reader.stats)
+        except BaseException:
+            QMessageBox.information(
+                iface.mainWindow(), self.tr("Error reloading memory layers"), str(sys.exc_info()[1])
+            )
+            return
+
+        layer_ids = {layer.id() for layer in layers}
+        self.has_modified_layers = True
+        self.modified_layers |= layer_ids
+        # The next checkpoints start from the recovered one
+        self.autosave.resume(filepath, layer_ids)
+        # QGIS marks the project as clean once it is read
+        QTimer.singleShot(0, partial(QgsProject.instance().setDirty, True))
+
+    def scan_journal(self, reader):
+        """Return the path, the records and the last checkpoint of the journal of the mldata file
+
+        None if there is no journal, or if it does not apply to the current mldata file.
+        """
+        self.journal.stop()
+        filepath = self.journal_file()
+        if not filepath or not QFile.exists(filepath) or not reader.index:
+            return None
+        journal_id = Journal.read_journal_id(filepath)
+        if not journal_id or any(entry.properties.get("journal") != journal_id for entry in reader.index):
+            log(f"Ignoring the journal {filepath}, it does not match the mldata file")
+            return None
+        records, checkpoint = self.journal.scan(filepath)
+        return filepath, records, checkpoint
+
+    def replay_journal(self, reader, layers, filepath, records, checkpoint):
+        """Replay the saved edits of the journal, and the unsaved ones if the user wants to recover them
+
+        Return whether unsaved edits were recovered, and the ids of the layers which were replayed.
+        """
+        count, saved_size = checkpoint
+        recovered = False
+        if len(records) > count:
+            answer = QMessageBox.question(
+                iface.mainWindow(),
+                self.tr("Recover memory layer edits"),
+                self.tr(
+                    "{0} memory layer edits were committed after the project was last saved. "
+                    "Do you want to recover them?"
+                ).format(len(records) - count),
+            )
+            if answer == QMessageBox.StandardButton.Yes:
+                count = len(records)
+                recovered = True
+            else:
+                Journal.truncate(filepath, saved_size)
+        self.journal.open(filepath, reader.index, layers, records, count, saved_size)
+        replayed = set(self.journal.modified_layers)
+        if not Settings.edit_journal():
+            self.journal.stop()
+        return recovered, replayed
+
+    def save_data(self, doc=None):
+        """Write the layers to the .mldata file, or to their own files
+
+        doc is the QDomDocument of the project being written, which receives the id of the save.
+        """
+        self.wait_for_save_task()
+        if Settings.layer_files() and not Settings.legacy_mode():
+            self.save_layer_files()
+            return
 
         # Check if the mldata file exists and if any memory layer has been modified
         filepath = self.memory_layer_file(fallback_to_legacy=False)
         if filepath and Path(filepath).exists() and not self.has_modified_layers:
+            self.autosave.clear()
             return
 
         # If mldata file do not exist in the attached files, create it
@@ -134,17 +726,328 @@ class MemoryLayerSaver(LayerConnector):
             QgsProject.instance().createAttachedFile("layers.mldata")
 
         filepath = self.memory_layer_file()
+        for layer in self.lazy_loader.pending_layers():
+            if self.lazy_loader.filepath(layer) != filepath:
+                # The pending layers can only be copied from the previous version of the mldata file
+                self.lazy_loader.load(layer)
+        # The partial layers must not be saved truncated
+        if not self.complete_partial_layers(
+            layer_ids=self.partial_layers_to_complete(dict.fromkeys(self.partial_layers, filepath))
+        ):
+            self.on_save_canceled(filepath)
+            return
         layers = list(self.memory_layers())
+
+        if Settings.edit_journal() and Path(filepath).exists():
+            # Only the checkpoint is written when the journal holds all the changes since the last full save
+            if self.journal.can_checkpoint(self.journal_file(), layers) and not self.journal.needs_compaction(filepath):
+                log(f"Saving memory layers to the journal {self.journal.filepath}")
+                self.journal.checkpoint()
+                self.has_modified_layers = False
+                self.modified_layers.clear()
+                self.autosave.clear()
+                return
+        # The layers replayed from the journal differ from the mldata file
+        self.modified_layers |= self.journal.modified_layers
+
         log(f"Saving memory layers to {filepath} ({len(layers)} layers)")
-        if layers:
-            with Writer(filepath) as writer:
-                writer.write_layers(layers)
+        try:
+            if layers:
+                self.write_memory_layer_file(filepath, layers, doc)
+        except CanceledError:
+            # The previous file, and its journal, are untouched
+            self.on_save_canceled(filepath)
+            return
+        if not layers or not Settings.edit_journal():
+            self.remove_journal()
+        # The layers were stored in one file per layer before
+        self.remove_layer_files()
 
         self.has_modified_layers = False
+        self.modified_layers.clear()
+        if not self.save_task:
+            self.autosave.clear()
+
+    def write_memory_layer_file(self, filepath, layers, doc=None):
+        """Write the layers to the .mldata file, and store the id of the save in the project
+
+        The id is only changed when the file is written again, or when the background save starts.
+        Raise a CanceledError if the user cancels the save.
+        """
+        save_id = uuid.uuid4().hex
+        # Embedded mldata files must be complete when QGIS packs the attachments,
+        # right after this slot returns, hence they are always saved synchronously
+        if Settings.background_save() and Settings.legacy_mode() and not Settings.edit_journal():
+            self.start_save_task(filepath, layers, save_id)
+        else:
+            # The journal must start from the file written here, hence a synchronous save
+            journal_id = uuid.uuid4().hex if Settings.edit_journal() else None
+            stats = self.write_layers(filepath, layers, journal_id, save_id=save_id)
+            if journal_id:
+                self.journal.start(self.journal_file(create=True), journal_id, layers)
+            if stats is None:
+                # The file was not written again, it still matches the project
+                return
+            self.save_stats = stats
+        self.set_project_save_id(save_id, doc)
+
+    def project_save_id(self):
+        """Return the id of the save which wrote the mldata file of the project, "" if unknown"""
+        return QgsProject.instance().readEntry(*SAVE_ID_ENTRY, "")[0]
+
+    def set_project_save_id(self, save_id, doc=None):
+        """Store the id of the save in the project, and in doc, the project being written, if given"""
+        QgsProject.instance().writeEntry(*SAVE_ID_ENTRY, save_id)
+        if doc is None:
+            return
+        # The properties of the project were already written to doc when writeProject is emitted
+        element = doc.documentElement()
+        for name in ("properties", *SAVE_ID_ENTRY):
+            child = element.firstChildElement(name)
+            if child.isNull():
+                child = element.appendChild(doc.createElement(name)).toElement()
+            element = child
+        element.setAttribute("type", "QString")
+        while element.hasChildNodes():
+            element.removeChild(element.firstChild())
+        element.appendChild(doc.createTextNode(save_id))
+
+    def save_layer_files(self):
+        """Write each memory layer to its own attached file, listed in the manifest
+
+        Only the files of the modified layers are written again. The layers of a single layers.mldata
+        attachment are copied to their own files, then the single file is removed. The edits are not
+        journaled in this storage mode.
+        """
+        manifest_filepath = self.manifest_file()
+        if manifest_filepath and not self.has_modified_layers:
+            self.autosave.clear()
+            return
+
+        files = self.manifest_layer_files(manifest_filepath)
+        # Single mldata file the layers are moved from, if any
+        single_filepath = self.memory_layer_file(fallback_to_legacy=False)
+        # The partial layers must not be saved truncated
+        previous_filepaths = {layer_id: single_filepath or files.get(layer_id) for layer_id in self.partial_layers}
+        if not self.complete_partial_layers(layer_ids=self.partial_layers_to_complete(previous_filepaths)):
+            self.on_save_canceled(manifest_filepath)
+            return
+        layers = list(self.memory_layers())
+        log(f"Saving memory layers to layer files ({len(layers)} layers)")
+        try:
+            stats = self.write_layer_files(layers, files, single_filepath)
+        except CanceledError:
+            self.on_save_canceled(manifest_filepath)
+            return
+        self.update_manifest(layers, files, manifest_filepath, single_filepath)
+        self.remove_journal()
+
+        self.save_stats = stats
+        self.has_modified_layers = False
+        self.modified_layers.clear()
+        self.autosave.clear()
+
+    def manifest_layer_files(self, manifest_filepath):
+        """Return the files of the layers listed in the manifest (layer id -> path), if any"""
+        manifest = Manifest()
+        if manifest_filepath:
+            try:
+                manifest = Manifest.read(manifest_filepath)
+            except (OSError, ValueError) as e:
+                log_error(f"Error while reading the manifest {manifest_filepath}, all the layers are written: {e}")
+        return self.layer_files(manifest)
+
+    def write_layer_files(self, layers, files, single_filepath):
+        """Write each layer to its file, the files of the new layers are attached to the project and added to files
+
+        The records of the unmodified layers are copied from single_filepath, if given, or from their file.
+        Return the statistics of the layers written. If the user cancels, the files created are removed
+        and a CanceledError is raised: the files written so far replaced the previous version of their layers.
+        """
+        project = QgsProject.instance()
+        stats = {}
+        created = []
+        # (layer, file) of the pending and partial layers whose record was copied to their file
+        moved = []
+        try:
+            with ProgressFeedback(self.tr("Saving memory layers..."), iface.mainWindow()) as feedback:
+                for i, layer in enumerate(layers):
+                    filepath = files.get(layer.id())
+                    if filepath is None:
+                        filepath = project.createAttachedFile(layer_file_name(layer.id()))
+                        created.append(filepath)
+                    previous_filepath = single_filepath or filepath
+                    if self.lazy_loader.is_pending(layer) and self.lazy_loader.filepath(layer) != previous_filepath:
+                        self.lazy_loader.load(layer)
+                    feedback.set_step(100 * i / len(layers), 100 * (i + 1) / len(layers))
+                    stats.update(self.write_layers(filepath, [layer], None, previous_filepath, feedback) or {})
+                    if self.lazy_loader.is_pending(layer) or layer.id() in self.partial_layers:
+                        moved.append((layer, filepath))
+                    files[layer.id()] = filepath
+        except CanceledError:
+            # The manifest is unchanged
+            for filepath in created:
+                project.removeAttachedFile(filepath)
+            raise
+
+        # The pending and partial layers are read from their file from now on
+        for layer, filepath in moved:
+            if self.lazy_loader.is_pending(layer):
+                self.lazy_loader.move(layer, filepath)
+            if layer.id() in self.partial_layers:
+                self.partial_layers[layer.id()] = (layer, filepath)
+        return stats
+
+    def update_manifest(self, layers, files, manifest_filepath, single_filepath):
+        """List the files of the layers in the manifest, and remove the files which are no longer used
+
+        Those are the files of the layers removed from the project and the single mldata file the layers
+        were moved from, if any.
+        """
+        project = QgsProject.instance()
+        layer_ids = {layer.id() for layer in layers}
+        for layer_id, filepath in files.items():
+            if layer_id not in layer_ids:
+                project.removeAttachedFile(filepath)
+        manifest = Manifest({layer.id(): Path(files[layer.id()]).name for layer in layers})
+        manifest.write(manifest_filepath or self.manifest_file(create=True))
+        if single_filepath:
+            log(f"The memory layers were moved from {single_filepath} to layer files")
+            project.removeAttachedFile(single_filepath)
+
+    def remove_journal(self):
+        self.journal.stop()
+        journal_filepath = self.journal_file()
+        if journal_filepath and Settings.legacy_mode():
+            QFile.remove(journal_filepath)
+        elif journal_filepath:
+            QgsProject.instance().removeAttachedFile(journal_filepath)
+
+    def remove_layer_files(self):
+        """Remove the manifest and the layer files, once the layers are saved in a single mldata file"""
+        manifest_filepath = self.manifest_file()
+        if not manifest_filepath:
+            return
+        try:
+            files = self.layer_files(Manifest.read(manifest_filepath))
+        except (OSError, ValueError):
+            files = {}
+        project = QgsProject.instance()
+        for filepath in files.values():
+            project.removeAttachedFile(filepath)
+        project.removeAttachedFile(manifest_filepath)
+
+    def write_layers(self, filepath, layers, journal_id=None, previous_filepath=None, feedback=None, save_id=None):
+        """Write the layers to the .mldata file, reusing the unchanged layers of the previous file
+
+        The Writer replaces the file atomically, the unchanged layers are copied from the
+        previous version of the file, which stays in place until the new one is complete,
+        or from previous_filepath if given. The progress is displayed in a dialog (feedback,
+        created if not given) which lets the user cancel the save, raising a CanceledError.
+        save_id is stored in the table of contents of the file (see set_project_save_id).
+        Return the statistics of the layers written, None if the file was not written again.
+        """
+        if feedback is None:
+            with ProgressFeedback(self.tr("Saving memory layers..."), iface.mainWindow()) as feedback:
+                return self.write_layers(filepath, layers, journal_id, previous_filepath, feedback, save_id)
+
+        # None for missing, unreadable or legacy files, all the layers will then be written again
+        previous = Reader.try_open(previous_filepath or filepath)
+        try:
+            # The features of each layer are read through a single source
+            snapshots = LayerSnapshot.of_layers(layers, previous, self.modified_layers)
+            if previous is not None:
+                index = previous.index or []
+                # The file must match the project to be kept, it is written again with the new save id otherwise
+                project_save_id = self.project_save_id() if save_id else None
+                if (
+                    journal_id is None
+                    and not any(snapshot.has_features for snapshot in snapshots)
+                    and [entry.layer_id for entry in index] == [layer.id() for layer in layers]
+                    and not any("journal" in entry.properties for entry in index)
+                    and all(entry.properties.get("save") == project_save_id for entry in index)
+                ):
+                    log(f"The memory layers are unchanged, {filepath} is not written again")
+                    return None
+
+            # The temporary file is discarded if the user cancels the save
+            with Writer(
+                filepath, journal_id=journal_id, feedback=feedback, save_id=save_id, **Settings.writer_options()
+            ) as writer:
+                # The modified layers which still have the contents of the previous file (e.g. undone edits)
+                # are copied from it once their fingerprint is computed
+                writer.write_layers(snapshots, previous, self.modified_layers)
+                # The previous file must be closed before it is replaced
+                if previous:
+                    previous.close()
+            return dict(writer.stats)
+        finally:
+            if previous:
+                previous.close()
+
+    def on_save_canceled(self, filepath):
+        """The layers stay flagged as modified, so they are written on the next save"""
+        log(f"Saving memory layers to {filepath} was canceled, the file is unchanged")
+        iface.messageBar().pushWarning(
+            "Memory Layer Saver",
+            self.tr("Saving the memory layers was canceled, their previously saved version is kept."),
+        )
+        # QGIS marks the project as clean once this slot returns
+        QTimer.singleShot(0, partial(QgsProject.instance().setDirty, True))
+
+    def start_save_task(self, filepath, layers, save_id=None):
+        """Snapshot the layers and write them to the .mldata file in a background task
+
+        The project is written before the task completes: until then, the file and the project
+        have different save ids, and the checkpoint is kept (see is_stale_file).
+        """
+        # Only the features of the layers which cannot be copied from the previous file are snapshotted
+        previous = Reader.try_open(filepath)
+        try:
+            snapshots = LayerSnapshot.of_layers(layers, previous, self.modified_layers)
+        finally:
+            if previous:
+                previous.close()
+
+        task = SaveTask(filepath, snapshots, self.modified_layers, {**Settings.writer_options(), "save_id": save_id})
+        task.taskCompleted.connect(partial(self.on_save_task_finished, task, True))
+        task.taskTerminated.connect(partial(self.on_save_task_finished, task, False))
+        self.save_task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def on_save_task_finished(self, task, success):
+        if success:
+            self.save_stats = dict(task.stats)
+            # The checkpoint is only removed once the layers are in the mldata file
+            self.autosave.clear()
+        else:
+            # The mldata file still holds the previous version of the layers:
+            # flag them again so they are written on the next save
+            self.has_modified_layers = True
+            self.modified_layers.update(task.modified_layers)
+            QgsProject.instance().setDirty(True)
+        if self.save_task is task:
+            self.save_task = None
+
+    def wait_for_save_task(self):
+        """Block until the pending background save, if any, is finished"""
+        if self.save_task is None:
+            return
+        try:
+            # 0: no timeout
+            self.save_task.waitForFinished(0)
+        except RuntimeError:
+            # The task was already deleted by the task manager
+            pass
+        self.save_task = None
 
     def memory_layers(self):
-        """Return a list of all memory layers in the project"""
-        return [layer for layer in QgsProject.instance().mapLayers().values() if Settings.is_saved_layer(layer)]
+        """Return a list of all memory layers in the project
+
+        They come from the registry of the saved layers, in the order of QgsProject.mapLayers (sorted by id),
+        which is the order of the layers in the mldata file.
+        """
+        return [self.saved_layers[layer_id] for layer_id in sorted(self.saved_layers)]
 
     def legacy_memory_layer_file(self):
         """Returns the path to the legacy .mldata file"""
@@ -170,28 +1073,114 @@ class MemoryLayerSaver(LayerConnector):
         if fallback_to_legacy:
             return self.legacy_memory_layer_file()
 
+    def manifest_file(self, create=False):
+        """Returns the path to the manifest of the layer files, "" if the layers are not stored in one file per layer"""
+        if not QgsProject.instance().fileName() or Settings.legacy_mode():
+            return ""
+
+        for attachment in QgsProject.instance().attachedFiles():
+            if attachment.endswith(MANIFEST_ATTACHMENT):
+                return attachment
+        if create:
+            return QgsProject.instance().createAttachedFile(MANIFEST_ATTACHMENT)
+        return ""
+
+    def layer_files(self, manifest):
+        """Return the paths of the attached files of the layers listed in the manifest (layer id -> path)"""
+        attachments = {Path(attachment).name: attachment for attachment in QgsProject.instance().attachedFiles()}
+        return {layer_id: attachments[name] for layer_id, name in manifest.layers.items() if name in attachments}
+
+    def journal_file(self, create=False):
+        """Returns the path to the edit journal of the .mldata file"""
+        if not QgsProject.instance().fileName():
+            return ""
+
+        if Settings.legacy_mode():
+            return self.legacy_memory_layer_file() + ".journal"
+
+        for attachment in QgsProject.instance().attachedFiles():
+            if attachment.endswith("layers.mldata.journal"):
+                return attachment
+        if create:
+            return QgsProject.instance().createAttachedFile("layers.mldata.journal")
+        return ""
+
+    def is_complete_layer(self, layer):
+        """Whether all the features of a memory layer are loaded"""
+        return layer.id() not in self.partial_layers and not self.lazy_loader.is_pending(layer)
+
     def set_project_dirty(self):
         """Set project as dirty when a memory layer is modified"""
         self.has_modified_layers = True
+        layer = self.sender()
+        if layer is not None:
+            self.modified_layers.add(layer.id())
+            self.autosave.schedule(layer.id())
         QgsProject.instance().setDirty(True)
 
-    def on_data_source_changed(self):
-        # If a temporary layer is made permanent, its data source will change
-        # At this point, the layer is no longer a memory layer, so we disconnect from it
+    def on_layer_changed(self):
+        # If a temporary layer is made permanent, its data source will change and it is no longer
+        # a memory layer. A layer is also saved or not according to its SaveMemoryProvider property
         layer = self.sender()
-        if not Settings.is_saved_layer(layer):
-            self.disconnect_layer(layer)
+        if layer is None:
+            return
+        is_saved = Settings.is_saved_layer(layer)
+        if is_saved and layer.id() not in self.saved_layers:
+            self.register_layer(layer)
+        elif not is_saved and layer.id() in self.saved_layers:
+            self.unregister_layer(layer)
+
+    def statistics(self):
+        """Return the timing statistics of the last save and load of the memory layers
+
+        {"save": {layer id: statistics}, "load": {layer id: statistics}}, see LayerStats.as_dict
+        for the content of the statistics. Layers loaded on demand are included once loaded.
+        """
+        load_stats = {**self.load_stats, **self.lazy_loader.stats}
+        return {
+            "save": {layer_id: stats.as_dict() for layer_id, stats in self.save_stats.items()},
+            "load": {layer_id: stats.as_dict() for layer_id, stats in load_stats.items()},
+        }
+
+    def format_stats(self, stats):
+        return self.tr("{0:.2f} s, {1:.2f} MB, {2:.0f} features/s (attributes {3:.2f} s, geometries {4:.2f} s)").format(
+            stats["elapsed"], stats["bytes"] / 1e6, stats["throughput"], stats["attribute_time"], stats["geometry_time"]
+        )
 
     def show_info(self):
         """Display some information about the memory layers"""
-        layer_info = [(layer.name(), layer.featureCount()) for layer in self.memory_layers()]
+        statistics = self.statistics()
+        layer_info = [
+            (
+                layer.name(),
+                self.lazy_loader.feature_count(layer) if self.lazy_loader.is_pending(layer) else layer.featureCount(),
+                statistics["save"].get(layer.id()),
+                statistics["load"].get(layer.id()),
+                layer.id() in self.partial_layers,
+            )
+            for layer in self.memory_layers()
+        ]
         if layer_info:
             message = self.tr("The following memory layers will be saved with this project:")
             message += "<br>"
-            message += "<br>".join(
-                self.tr("- <b>{0}</b> ({1} features)", "Layer name and number of features", n=count).format(name, count)
-                for name, count in layer_info
-            )
+            lines = []
+            for name, count, save_stats, load_stats, is_partial in layer_info:
+                line = self.tr("- <b>{0}</b> ({1} features)", "Layer name and number of features", n=count).format(
+                    name, count
+                )
+                if is_partial:
+                    line += "<br>&nbsp;&nbsp;" + self.tr("Partially loaded (preview or canceled loading)")
+                if save_stats is not None:
+                    if save_stats["operation"] == COPY:
+                        line += "<br>&nbsp;&nbsp;" + self.tr("Last save: unchanged, copied in {0:.2f} s").format(
+                            save_stats["elapsed"]
+                        )
+                    else:
+                        line += "<br>&nbsp;&nbsp;" + self.tr("Last save: {0}").format(self.format_stats(save_stats))
+                if load_stats is not None:
+                    line += "<br>&nbsp;&nbsp;" + self.tr("Last load: {0}").format(self.format_stats(load_stats))
+                lines.append(line)
+            message += "<br>".join(lines)
         else:
             message = self.tr("This project contains no memory layers to be saved")
         QMessageBox.information(iface.mainWindow(), "Memory Layer Saver", message)
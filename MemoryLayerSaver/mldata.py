@@ -0,0 +1,245 @@
+"""Constants and structures of the mldata file format.
+
+An mldata file starts with the ``QGis.MemoryLayerData`` magic followed by the
+format version (uint32). Everything is serialized with a QDataStream (Qt_4_5, big endian).
+
+Version 1 and 2 files are a plain sequence of layers, each of them made of the layer id,
+the subset string (version 2 only), the field definitions and the features, every feature
+being prefixed by a ``True`` boolean and the list terminated by ``False``.
+
+Version 3 files store, for each layer:
+
+- the layer id, the subset string and the field definitions (same as version 2)
+- the layer flags (uint32), see the ``FLAG_*`` constants
+- the features, grouped in chunks. Each chunk is prefixed by its feature count (uint32)
+  and its size in bytes (uint32), the list of chunks is terminated by a zero feature count.
+  The chunk payload is optionally compressed. If the layer has the ``FLAG_CHECKSUM`` flag,
+  the size is followed by the CRC-32 (uint32) of the stored payload, so damaged chunks
+  can be detected, and skipped, without decoding them.
+
+If the layer has the ``FLAG_COMPACT_GEOMETRY`` flag, the features of a chunk only hold their attributes
+(row by row or column by column), and are followed by the geometries of the chunk: the size of the
+block (uint32) and the block, described in the geometry_codec module.
+
+The layers are followed by a table of contents (see :class:`LayerEntry`) and a trailer
+made of the offset of the table of contents (int64) and the ``INDEX_MAGIC``, so the
+reader can seek directly to the layers it needs.
+
+The ``fingerprint`` property of an entry is a hash of the canonical encoding of the attribute values
+and the WKB geometries of the features of the layer (see encoder.fingerprint_features), computed while
+they are written. It is the same for the files written with QGIS and without it. A modified layer
+whose contents still have the fingerprint of its previous record keeps that record, which is copied
+from the previous file.
+
+The ``save`` property of the entries identifies the save which wrote the file. It is also stored in
+the project (``MemoryLayerSaver/saveId`` entry), so a file which was not written with the project
+(e.g. an unfinished background save) is detected when the project is loaded.
+"""
+
+import hashlib
+import lzma
+import os
+import shutil
+import zlib
+
+MAGIC = b"QGis.MemoryLayerData"
+INDEX_MAGIC = b"MLDI"
+
+# Version written by the Writer
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (1, 2, 3)
+
+# Layer flags
+# The attributes of each chunk are stored column by column (see the columnar module)
+FLAG_COLUMNAR = 0x1
+# The chunk payloads are compressed with zlib or lzma
+FLAG_ZLIB = 0x2
+FLAG_LZMA = 0x4
+# The chunk payloads are prefixed by their CRC-32
+FLAG_CHECKSUM = 0x10
+# The geometries of each chunk are stored in a compact block (see the geometry_codec module)
+FLAG_COMPACT_GEOMETRY = 0x20
+# All the layer flags, the other bits are never set in a layer header
+KNOWN_FLAGS = FLAG_COLUMNAR | FLAG_ZLIB | FLAG_LZMA | FLAG_CHECKSUM | FLAG_COMPACT_GEOMETRY
+
+COMPRESSION_FLAGS = {"zlib": FLAG_ZLIB, "lzma": FLAG_LZMA}
+
+# Column encodings of the columnar layers (see the columnar module)
+COLUMN_VARIANT = 0
+COLUMN_INT64 = 1
+COLUMN_DOUBLE = 2
+COLUMN_BOOL = 3
+COLUMN_STRING = 4
+
+# Coordinate encodings of the compact geometry blocks (see the geometry_codec module)
+GEOMETRY_DOUBLE = 0
+GEOMETRY_INT8 = 1
+GEOMETRY_INT16 = 2
+GEOMETRY_INT32 = 3
+GEOMETRY_INT64 = 4
+
+# Maximum number of features stored in a chunk
+DEFAULT_CHUNK_SIZE = 10000
+
+# Suffix of the previous version of an mldata file, optionally kept when it is replaced
+BACKUP_SUFFIX = ".bak"
+# Size of the write buffer of the files written without Qt
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Size in bytes of the content fingerprints
+FINGERPRINT_SIZE = 16
+
+# Size of the magic and the version
+HEADER_SIZE = len(MAGIC) + 4
+# Size of the index offset and the index magic
+TRAILER_SIZE = 8 + len(INDEX_MAGIC)
+
+
+def compress(data, flags, level):
+    """Compress a chunk payload according to the layer flags"""
+    if flags & FLAG_ZLIB:
+        return zlib.compress(data, level)
+    if flags & FLAG_LZMA:
+        return lzma.compress(data, preset=level)
+    return data
+
+
+def checksum(data):
+    """CRC-32 of a chunk payload, as stored before it"""
+    return zlib.crc32(data)
+
+
+def new_fingerprint():
+    """Return the hash object of a layer fingerprint, to be fed with the contents of its features"""
+    return hashlib.blake2b(digest_size=FINGERPRINT_SIZE)
+
+
+def decompress(data, flags):
+    """Decompress a chunk payload according to the layer flags"""
+    if flags & FLAG_ZLIB:
+        return zlib.decompress(data)
+    if flags & FLAG_LZMA:
+        return lzma.decompress(data)
+    return data
+
+
+def backup_file(filename):
+    """Keep the current version of a file which is about to be replaced as filename.bak
+
+    The backup is a hard link when the file system supports them, so no data is copied.
+    """
+    if not os.path.exists(filename):
+        return
+    backup = filename + BACKUP_SUFFIX
+    try:
+        os.remove(backup)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(filename, backup)
+    except OSError:
+        shutil.copy2(filename, backup)
+
+
+def is_layer_header(layer_id, flags):
+    """Whether a layer id and flags read from a version 3 file can start a layer record
+
+    Used to tell the last layer record from the remains of a lost table of contents, when the layers
+    are scanned from the start of the file.
+    """
+    if not layer_id or not layer_id.isprintable():
+        return False
+    return not flags & ~KNOWN_FLAGS and flags & (FLAG_ZLIB | FLAG_LZMA) != FLAG_ZLIB | FLAG_LZMA
+
+
+def copy_file_mode(temp_filename, filename):
+    """Give a temporary file created by mkstemp (mode 0600) the mode of the file it replaces
+
+    A new file gets the default mode of the files created by the process (0666 minus the umask).
+    """
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    try:
+        os.chmod(temp_filename, mode)
+    except OSError:
+        pass
+
+
+def sync_directory(filename):
+    """Flush the directory entry of a file which was just renamed, where it is supported (POSIX)"""
+    if os.name != "posix":
+        return
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CorruptDataError(ValueError):
+    """Raised when an mldata file is damaged: wrong checksum, truncated chunk or table of contents"""
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        # Position of the damaged data in the file, if known
+        self.offset = offset
+
+
+class CanceledError(Exception):
+    """Raised by the Reader and the Writer when the user cancels their feedback"""
+
+
+class DamagedRange:
+    """Range of bytes of an mldata file which could not be read"""
+
+    def __init__(self, offset, length, layer_id=None, feature_count=None, reason=""):
+        self.offset = offset
+        self.length = length
+        # Layer the range belongs to, None if it is unknown
+        self.layer_id = layer_id
+        # Number of features lost, None if it is unknown
+        self.feature_count = feature_count
+        self.reason = reason
+
+    def __repr__(self):
+        return f"DamagedRange({self.offset}, {self.length}, {self.layer_id!r}, {self.feature_count}, {self.reason!r})"
+
+    def __str__(self):
+        details = self.reason
+        if self.feature_count is None:
+            details += ", features lost"
+        elif self.feature_count:
+            details += f", {self.feature_count} features lost"
+        return f"{self.layer_id or 'unknown layer'}: bytes {self.offset}-{self.offset + self.length} ({details})"
+
+
+class LayerEntry:
+    """Entry of the table of contents of a version 3 mldata file"""
+
+    def __init__(self, layer_id, offset=0, length=0, feature_count=0, flags=0, subset="", fields=None, properties=None):
+        self.layer_id = layer_id
+        # Position of the layer record (starting with the layer id) in the file
+        self.offset = offset
+        # Size of the layer record in bytes
+        self.length = length
+        self.feature_count = feature_count
+        self.flags = flags
+        self.subset = subset
+        # List of (name, type, typename, length, precision, comment) tuples
+        self.fields = fields or []
+        # Additional information on the layer, stored as a QVariantMap
+        self.properties = properties or {}
+
+    def __repr__(self):
+        return (
+            f"LayerEntry({self.layer_id!r}, offset={self.offset}, length={self.length}, features={self.feature_count})"
+        )
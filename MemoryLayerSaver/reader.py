@@ -1,15 +1,83 @@
-from qgis.core import QgsFeature, QgsField, QgsGeometry
-from qgis.PyQt.QtCore import QDataStream, QFile, QIODevice, QMetaType
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
+from qgis.core import QgsFeature, QgsField, QgsFields, QgsGeometry, QgsRectangle
+from qgis.PyQt.QtCore import QByteArray, QDataStream, QFile, QIODevice, QMetaType
+
+from .columnar import decode_columns
+from .geometry_codec import decode_geometries
+from .interning import DEFAULT_INTERN_CAPACITY, interners
+from .mldata import (
+    FLAG_CHECKSUM,
+    FLAG_COLUMNAR,
+    FLAG_COMPACT_GEOMETRY,
+    HEADER_SIZE,
+    INDEX_MAGIC,
+    MAGIC,
+    SUPPORTED_VERSIONS,
+    TRAILER_SIZE,
+    CanceledError,
+    CorruptDataError,
+    DamagedRange,
+    LayerEntry,
+    checksum,
+    decompress,
+    is_layer_header,
+)
+from .stats import READ, LayerStats
 from .toolbox import log
 
+DEFAULT_BATCH_SIZE = 10000
+
+# Messages sent by the decoding threads to the reading thread (see decode_layer)
+LAYER_HEADER = 0
+LAYER_FEATURES = 1
+LAYER_END = 2
+LAYER_ERROR = 3
+# Maximum number of batches of features waiting to be inserted, per decoding thread
+QUEUED_BATCHES = 2
+# Interval at which the threads check the cancellation while they wait for each other, in seconds
+POLL_INTERVAL = 0.1
+
 
 class Reader:
-    def __init__(self, filename):
+    def __init__(
+        self,
+        filename,
+        batch_size=DEFAULT_BATCH_SIZE,
+        recover=False,
+        feedback=None,
+        intern_capacity=DEFAULT_INTERN_CAPACITY,
+    ):
         self._filename = filename
+        self._batch_size = max(1, int(batch_size))
+        # In recovery mode, the damaged chunks and layers are skipped instead of raising a CorruptDataError
+        self._recover = recover
+        # List of DamagedRange skipped in recovery mode
+        self._damaged = []
+        # Id of the layer being read, for the damage reports
+        self._layer_id = None
+        # QgsFeedback (or any object with its isCanceled and setProgress methods), checked between the chunks
+        self._feedback = feedback
+        # Maximum number of distinct text values shared per field while a layer is read, 0 to disable, see interning
+        self._intern_capacity = intern_capacity
+        # Number of bytes to read and already read, for the progress reported to the feedback
+        self._progress_total = 0
+        self._progress_done = 0
         self._file = None
         self._dstream = None
         self._version = None
+        self._index = None
+        # CorruptDataError of the table of contents of a version 3 file read in recovery mode
+        self._index_error = None
+        # layer id -> LayerEntry of the table of contents
+        self._entries = {}
+        # layer id -> LayerStats of the layers read
+        self._stats = {}
+        # Ids of the layers read as a sample of their features (preview mode)
+        self._sampled = set()
 
     def __enter__(self):
         self.open()
@@ -18,20 +86,44 @@ class Reader:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
-    def open(self):
+    def open(self, read_index=True):
         self._file = QFile(self._filename)
         if not self._file.open(QIODevice.OpenModeFlag.ReadOnly):
             raise ValueError("Cannot open " + self._filename)
         self._dstream = QDataStream(self._file)
         self._dstream.setVersion(QDataStream.Version.Qt_4_5)
-        for c in b"QGis.MemoryLayerData":
+        for c in MAGIC:
             ct = self._dstream.readUInt8()
             if ct != c:
                 raise ValueError(self._filename + " is not a valid memory layer data file")
         version = self._dstream.readInt32()
-        if version not in (1, 2):
+        if version not in SUPPORTED_VERSIONS:
             raise ValueError(self._filename + " is not compatible with this version of the MemoryLayerSaver plugin")
         self._version = version
+        self._progress_total = self._file.size() - HEADER_SIZE
+        if version > 2 and read_index:
+            try:
+                self._index = self.read_index()
+                self._entries = {entry.layer_id: entry for entry in self._index}
+            except CorruptDataError as e:
+                if not self._recover:
+                    raise
+                # The layers are scanned from the start of the file, the lost range is reported once
+                # the scan reaches the end of the last layer record
+                log(f"Recovering the layers of {self._filename}: {e}")
+                self._index_error = e
+                self._file.seek(HEADER_SIZE)
+
+    @classmethod
+    def try_open(cls, filename, batch_size=DEFAULT_BATCH_SIZE):
+        """Return a reader opened on the file, None if the file is missing or invalid"""
+        reader = cls(filename, batch_size)
+        try:
+            reader.open()
+        except ValueError:
+            reader.close()
+            return None
+        return reader
 
     def close(self):
         try:
@@ -42,78 +134,663 @@ class Reader:
         self._dstream = None
         self._file = None
 
-    def read_layers(self, layers):
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def index(self):
+        """Table of contents of the file (list of LayerEntry), None for version 1 and 2 files"""
+        return self._index
+
+    @property
+    def stats(self):
+        """Timing statistics of the layers read so far (layer id -> LayerStats)"""
+        return self._stats
+
+    @property
+    def damaged(self):
+        """Ranges of the file which were skipped in recovery mode (list of DamagedRange)"""
+        return self._damaged
+
+    @property
+    def sampled(self):
+        """Ids of the layers read as a sample of their features, they are not in stats"""
+        return self._sampled
+
+    def check_canceled(self):
+        """Raise a CanceledError if the feedback was canceled"""
+        if self._feedback is not None and self._feedback.isCanceled():
+            raise CanceledError(f"Reading {self._filename} was canceled")
+
+    def advance(self, size):
+        """Add size bytes to the data read, and report the progress to the feedback"""
+        self._progress_done += size
+        if self._feedback is not None and self._progress_total > 0:
+            self._feedback.setProgress(min(100.0, 100.0 * self._progress_done / self._progress_total))
+
+    def read_index(self):
+        """Read the table of contents at the end of a version 3 file"""
+        ds = self._dstream
+        size = self._file.size()
+        if size < HEADER_SIZE + TRAILER_SIZE:
+            raise CorruptDataError(self._filename + " is truncated", HEADER_SIZE)
+        self._file.seek(size - TRAILER_SIZE)
+        index_offset = ds.readInt64()
+        if ds.readRawData(len(INDEX_MAGIC)) != INDEX_MAGIC or not HEADER_SIZE <= index_offset < size:
+            raise CorruptDataError(self._filename + " has no valid table of contents", size - TRAILER_SIZE)
+        self._file.seek(index_offset)
+        index = []
+        for _i in range(ds.readUInt32()):
+            entry = LayerEntry(ds.readQString())
+            entry.offset = ds.readInt64()
+            entry.length = ds.readInt64()
+            entry.feature_count = ds.readInt64()
+            entry.flags = ds.readUInt32()
+            entry.subset = ds.readQString()
+            entry.fields = [self.read_field() for _j in range(ds.readInt16())]
+            entry.properties = ds.readQVariant() or {}
+            index.append(entry)
+        if ds.status() != QDataStream.Status.Ok or self._file.pos() > size - TRAILER_SIZE:
+            raise CorruptDataError(self._filename + " has a damaged table of contents", index_offset)
+        self._file.seek(HEADER_SIZE)
+        return index
+
+    def entry(self, layer_id):
+        """Return the table of contents entry of a layer, None if the layer is not in the file"""
+        return self._entries.get(layer_id)
+
+    def read_raw(self, entry, block_size=1 << 20):
+        """Yield the raw bytes of a layer record, by blocks of block_size bytes"""
+        self._file.seek(entry.offset)
+        remaining = entry.length
+        while remaining > 0:
+            block = self._dstream.readRawData(min(block_size, remaining))
+            if not block:
+                raise ValueError(self._filename + " is truncated")
+            remaining -= len(block)
+            yield block
+
+    def read_layers(self, layers, max_workers=1, samples=None):
+        """Read the layers stored in the file into the given memory layers
+
+        If max_workers is greater than 1, the layers are decoded in parallel by a pool of threads.
+        If the feedback is canceled, a CanceledError is raised between two chunks: the layers read
+        so far are complete (see stats), the layer being read keeps the features inserted so far,
+        and the remaining layers are left untouched.
+        samples (layer id -> Sample) selects the layers read as a sample of their features, first
+        (see read_sampled_layer and sampled). They are read completely from files without table of contents.
+        """
         if not self._dstream:
             raise ValueError("Layer stream not open for reading")
-        ds = self._dstream
+        layers_by_id = {layer.id(): layer for layer in layers}
+        if samples and self._index is not None:
+            self.read_sampled_layers(layers, samples)
+        if max_workers > 1 and len(layers) - len(self._sampled) > 1:
+            self.read_layers_parallel(layers_by_id, max_workers)
+        elif self._index is not None:
+            self.read_indexed_layers(layers_by_id)
+        else:
+            self.read_scanned_layers(layers_by_id)
 
-        while True:
-            if ds.atEnd():
-                return
+    def read_sampled_layers(self, layers, samples):
+        """Read the layers selected by samples (layer id -> Sample) as a sample of their features"""
+        layer_ids = {layer.id() for layer in layers}
+        self._progress_total = sum(entry.length for entry in self._index if entry.layer_id in layer_ids)
+        for layer in layers:
+            if layer.id() in samples and self.entry(layer.id()) is not None:
+                self.read_sampled_layer(layer, samples[layer.id()])
+
+    def read_indexed_layers(self, layers_by_id):
+        """Read the layers which were not sampled, seeking directly to them with the table of contents"""
+        # The progress of the layers already sampled is kept
+        self._progress_total = self._progress_done + sum(
+            entry.length
+            for entry in self._index
+            if entry.layer_id in layers_by_id and entry.layer_id not in self._sampled
+        )
+        for entry in self._index:
+            layer = layers_by_id.get(entry.layer_id)
+            if layer is None:
+                log(f"Unknown layer {entry.layer_id} in project. Skipping.")
+                continue
+            if entry.layer_id in self._sampled:
+                continue
+            self._file.seek(entry.offset)
+            self._dstream.readQString()  # layer id
+            self.read_recoverable_layer(layer, entry.offset + entry.length)
+
+    def read_scanned_layers(self, layers_by_id):
+        """Read the layers of a file without table of contents (or whose table of contents is lost) in sequence"""
+        ds = self._dstream
+        while not ds.atEnd():
+            offset = self._file.pos()
             layer_id = ds.readQString()
-            for layer in layers:
-                if layer.id() == layer_id:
-                    break
-            else:
-                log(f"Unknown layer {layer_id} in project. Skipping.")
-                layer = None
+            if self._index_error is not None and not self.is_layer_record(layer_id):
+                # The remains of the table of contents follow the last layer record
+                self._file.seek(offset)
+                break
+            layer = layers_by_id.get(layer_id)
             if layer is None:
+                log(f"Unknown layer {layer_id} in project. Skipping.")
                 self.skip_layer()
             else:
-                self.read_layer(layer)
+                self.read_recoverable_layer(layer)
+            if self._version < 3:
+                # Version 3 layers report their progress chunk by chunk
+                self.advance(self._file.pos() - offset)
+            if self._recover and ds.status() != QDataStream.Status.Ok:
+                # Without table of contents, nothing can be read after an unreadable record
+                size = self._file.size()
+                self._damaged.append(DamagedRange(offset, size - offset, None, None, "unreadable layer record"))
+                return
+        if self._index_error is not None:
+            offset = self._file.pos()
+            size = self._file.size()
+            self._damaged.append(DamagedRange(offset, size - offset, None, 0, f"index lost: {self._index_error}"))
+
+    def is_layer_record(self, layer_id):
+        """Whether the layer id just read starts a layer record (version 3), the position is left after it"""
+        pos = self._file.pos()
+        _ss, _definitions, flags = self.read_header()
+        valid = self._dstream.status() == QDataStream.Status.Ok and is_layer_header(layer_id, flags)
+        self._dstream.resetStatus()
+        self._file.seek(pos)
+        return valid
+
+    def read_recoverable_layer(self, layer, end=None):
+        """Read a layer, in recovery mode the layer is kept with its intact chunks if its record is damaged
+
+        end is the position of the end of the layer record, if known.
+        """
+        offset = self._file.pos()
+        try:
+            self.read_layer(layer)
+        except CorruptDataError as e:
+            if not self._recover:
+                raise
+            log(f"Layer {layer.id()} is damaged: {e}")
+            start = e.offset if e.offset is not None else offset
+            end = end if end is not None else self._file.size()
+            self._damaged.append(DamagedRange(start, end - start, layer.id(), None, str(e)))
+            layer.updateFields()
+            layer.updateExtents()
+
+    def read_indexed_layer(self, layer):
+        """Read a single layer of a version 3 file, using the table of contents"""
+        entry = self.entry(layer.id())
+        if entry is None:
+            raise ValueError("Memory layer " + layer.id() + " is not stored in " + self._filename)
+        self._file.seek(entry.offset)
+        self._dstream.readQString()  # layer id
+        self.read_layer(layer)
+
+    def read_sampled_layer(self, layer, sample):
+        """Read a sample of the features of a layer (see Sample), using the table of contents
+
+        Only the chunks selected by the sample are decoded, the others are skipped, and the chunks
+        after the sample are not read. The layer gets the extent of all its features, and its spatial
+        index is not restored.
+        """
+        entry = self.entry(layer.id())
+        if entry is None:
+            raise ValueError("Memory layer " + layer.id() + " is not stored in " + self._filename)
+        log(f"Reading a sample of layer {layer.id()} ({sample.max_features} of {entry.feature_count} features)")
+        self._layer_id = layer.id()
+        self._file.seek(entry.offset)
+        self._dstream.readQString()  # layer id
+        ss, definitions, flags = self.read_header()
+        fields = self.prepare_layer(layer, definitions)
+        features = self.read_features(fields, len(definitions), flags, select=sample.select_chunk)
+        try:
+            self.add_features(layer, sample.features(features))
+        finally:
+            self.finish_layer(layer, ss)
+            if "extent" in entry.properties:
+                layer.setExtent(QgsRectangle(*entry.properties["extent"]))
+        self._sampled.add(layer.id())
+        # The chunks after the sample count as read
+        self.advance(entry.offset + entry.length - self._file.pos())
+
+    def read_layers_parallel(self, layers_by_id, max_workers):
+        """Decode the layers in worker threads, only the insertion in the providers is done by this thread
+
+        The features are streamed by batches through a bounded queue (see decode_layer) and inserted as
+        they arrive, so only a few batches per worker are held in memory. The queue is polled, so the
+        cancellation is checked while the workers decode, and the workers are stopped when this thread fails.
+        """
+        entries = []
+        for entry in self._index if self._index is not None else self.scan():
+            if entry.layer_id in self._sampled:
+                continue
+            if entry.layer_id in layers_by_id:
+                entries.append(entry)
+            else:
+                log(f"Unknown layer {entry.layer_id} in project. Skipping.")
+        self._progress_total = self._progress_done + sum(entry.length for entry in entries)
+        entries_by_id = {entry.layer_id: entry for entry in entries}
+
+        messages = queue.Queue(maxsize=max_workers * QUEUED_BATCHES)
+        stop = threading.Event()
+        # layer id -> [subset string, feature ids (None without bounding boxes), LayerStats of the insertion,
+        # bytes reported to the progress] of the layers being inserted
+        inserting = {}
+        remaining = len(entries)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for entry in entries:
+                executor.submit(self.decode_layer, entry, messages, stop)
+            try:
+                while remaining:
+                    try:
+                        layer_id, message, payload = messages.get(timeout=POLL_INTERVAL)
+                    except queue.Empty:
+                        self.check_canceled()
+                        continue
+                    layer = layers_by_id[layer_id]
+                    entry = entries_by_id[layer_id]
+                    if message == LAYER_HEADER:
+                        ss, definitions, flags = payload
+                        log("Reading layer " + layer_id)
+                        self.prepare_layer(layer, definitions)
+                        inserting[layer_id] = [ss, LayerStats(layer_id, READ), 0]
+                    elif message == LAYER_FEATURES:
+                        batch, size = payload
+                        state = inserting[layer_id]
+                        self.add_features(layer, batch, state[1])
+                        state[2] += size
+                        self.advance(size)
+                    elif message == LAYER_END:
+                        remaining -= 1
+                        stats, damaged = payload
+                        ss, inserted, size = inserting.pop(layer_id)
+                        self._damaged.extend(damaged)
+                        self.finish_layer(layer, ss)
+                        self.advance(entry.length - size)
+                        # The layer was inserted while it was decoded, the elapsed time is measured by the worker
+                        stats.provider_time += inserted.provider_time
+                        self._stats[layer_id] = stats
+                        log(f"Layer {layer_id} read: {stats}")
+                    else:
+                        remaining -= 1
+                        error, damaged = payload
+                        if not isinstance(error, CorruptDataError) or not self._recover:
+                            raise error
+                        # The layer keeps the features of its intact chunks
+                        log(f"Layer {layer_id} is damaged: {error}")
+                        start = error.offset if error.offset is not None else entry.offset
+                        end = entry.offset + entry.length
+                        self._damaged.extend(damaged)
+                        self._damaged.append(DamagedRange(start, end - start, layer_id, None, str(error)))
+                        state = inserting.pop(layer_id, None)
+                        if state is not None:
+                            self.finish_layer(layer, state[0])
+                        self.advance(entry.length - (state[2] if state is not None else 0))
+            finally:
+                stop.set()
+                # A canceled layer keeps the features inserted so far
+                for layer_id, state in inserting.items():
+                    self.finish_layer(layers_by_id[layer_id], state[0])
+
+    def scan(self):
+        """Locate the layers of a version 1 or 2 file, return a LayerEntry for each of them"""
+        ds = self._dstream
+        self._file.seek(HEADER_SIZE)
+        entries = []
+        while not ds.atEnd():
+            offset = self._file.pos()
+            layer_id = ds.readQString()
+            self.skip_layer()
+            entries.append(LayerEntry(layer_id, offset, self._file.pos() - offset))
+        return entries
+
+    def decode_layer(self, entry, messages, stop):
+        """Decode a layer with a dedicated reader, so it can be called from a worker thread
+
+        The layer is sent to the reading thread through the messages queue, as (layer id, message, payload)
+        tuples: LAYER_HEADER with the subset string, the field definitions and the flags of the layer,
+        LAYER_FEATURES with each batch of features and the number of bytes decoded for it, LAYER_END with the
+        statistics of the decoding and the damaged ranges skipped in recovery mode, or LAYER_ERROR with the
+        exception raised by the decoding and the damaged ranges skipped before it.
+        The queue is bounded: the decoding waits for the features to be inserted, and stops once stop
+        (threading.Event) is set.
+        """
+        stats = LayerStats(entry.layer_id, READ)
+        reader = Reader(self._filename, self._batch_size, self._recover, self._feedback, self._intern_capacity)
+        try:
+            reader.open(read_index=False)
+            reader._layer_id = entry.layer_id
+            # The worker only checks for the cancellation, the progress is reported by the main reader
+            reader._progress_total = 0
+            reader._file.seek(entry.offset)
+            reader._dstream.readQString()  # layer id
+            ss, definitions, flags = reader.read_header()
+            self.send(messages, stop, (entry.layer_id, LAYER_HEADER, (ss, definitions, flags)))
+            fields = QgsFields()
+            for definition in definitions:
+                fields.append(self.create_field(*definition))
+            position = reader._file.pos()
+            batch = []
+            try:
+                for feat in reader.read_features(fields, len(definitions), flags, stats):
+                    batch.append(feat)
+                    if len(batch) >= self._batch_size:
+                        stats.feature_count += len(batch)
+                        size = reader._file.pos() - position
+                        self.send(messages, stop, (entry.layer_id, LAYER_FEATURES, (batch, size)))
+                        position = reader._file.pos()
+                        batch = []
+            except CorruptDataError:
+                # The features of the intact chunks are kept in recovery mode
+                if self._recover and batch:
+                    self.send(messages, stop, (entry.layer_id, LAYER_FEATURES, (batch, 0)))
+                raise
+            if batch:
+                stats.feature_count += len(batch)
+                size = reader._file.pos() - position
+                self.send(messages, stop, (entry.layer_id, LAYER_FEATURES, (batch, size)))
+            stats.bytes = reader._file.pos() - entry.offset
+            stats.stop()
+            self.send(messages, stop, (entry.layer_id, LAYER_END, (stats, reader.damaged)))
+        except BaseException as e:
+            if not stop.is_set():
+                self.send(messages, stop, (entry.layer_id, LAYER_ERROR, (e, reader.damaged)))
+        finally:
+            reader.close()
+
+    @staticmethod
+    def send(messages, stop, message):
+        """Put a message of decode_layer in the queue, waiting for room until stop is set"""
+        while not stop.is_set():
+            try:
+                messages.put(message, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+        raise CanceledError("The reading of the layers was stopped")
 
     def read_layer(self, layer):
         log("Reading layer " + layer.id())
+        self._layer_id = layer.id()
+        stats = LayerStats(layer.id(), READ)
+        offset = self._file.pos()
+        ss, definitions, flags = self.read_header()
+        fields = self.prepare_layer(layer, definitions)
+        try:
+            self.add_features(layer, self.read_features(fields, len(definitions), flags, stats), stats)
+        except CanceledError:
+            # The layer keeps the features inserted so far
+            self.finish_layer(layer, ss)
+            raise
+        self.finish_layer(layer, ss)
+        stats.bytes = self._file.pos() - offset
+        stats.stop()
+        self._stats[layer.id()] = stats
+        log(f"Layer {layer.id()} read: {stats}")
+
+    def read_header(self):
+        """Read the subset string, the field definitions and the flags of the current layer"""
         ds = self._dstream
-        dp = layer.dataProvider()
-        if dp.featureCount() > 0:
-            raise ValueError("Memory layer " + id + " is already loaded")
-        attr = dp.attributeIndexes()
-        dp.deleteAttributes(attr)
         ss = ""
         if self._version > 1:
             ss = ds.readQString()
         nattr = ds.readInt16()
-        attr = list(range(nattr))
-        for _i in attr:
-            name = ds.readQString()
-            qtype = ds.readInt16()
-            typename = ds.readQString()
-            length = ds.readInt16()
-            precision = ds.readInt16()
-            comment = ds.readQString()
+        definitions = [self.read_field() for _i in range(nattr)]
+        flags = 0
+        if self._version > 2:
+            flags = ds.readUInt32()
+        return ss, definitions, flags
 
-            try:
-                field_type = QMetaType.Type(qtype)
-            except (TypeError, ValueError):
-                # Fallback en cas d'échec
-                field_type = QMetaType.Type.UnknownType
-                log(f"Unable to convert type {qtype} for field {name}, using UnknownType")
+    def prepare_layer(self, layer, definitions):
+        """Replace the fields of an empty memory layer, return the new fields"""
+        dp = layer.dataProvider()
+        if dp.featureCount() > 0:
+            raise ValueError("Memory layer " + layer.id() + " is already loaded")
+        attr = dp.attributeIndexes()
+        dp.deleteAttributes(attr)
+        dp.addAttributes([self.create_field(*definition) for definition in definitions])
+        return dp.fields()
 
-            fld = QgsField(name, field_type, typename, int(length), int(precision), comment)
-            dp.addAttributes([fld])
+    def add_features(self, layer, features, stats=None):
+        """Insert the features in the provider of the layer by batches
 
-        nullgeom = QgsGeometry()
-        fields = dp.fields()
-        while ds.readBool():
-            feat = QgsFeature(fields)
-            for i in attr:
-                value = ds.readQVariant()
-                if value is not None:
-                    feat[i] = value
+        The cancellation of the feedback is checked before each batch.
+        """
+        dp = layer.dataProvider()
+        count = 0
+        provider_time = 0.0
+        # Features are inserted by batches: a single addFeatures call per batch is much
+        # faster than one call per feature, while keeping the memory footprint bounded
+        batch = []
+        try:
+            for feat in features:
+                batch.append(feat)
+                if len(batch) >= self._batch_size:
+                    self.check_canceled()
+                    start = perf_counter()
+                    dp.addFeatures(batch)
+                    provider_time += perf_counter() - start
+                    count += len(batch)
+                    batch = []
+        except CorruptDataError:
+            # The features of the intact chunks are kept in recovery mode
+            if self._recover and batch:
+                dp.addFeatures(batch)
+            raise
+        if batch:
+            self.check_canceled()
+            start = perf_counter()
+            dp.addFeatures(batch)
+            provider_time += perf_counter() - start
+            count += len(batch)
+        if stats is not None:
+            stats.feature_count += count
+            stats.provider_time += provider_time
 
-            wkb_size = ds.readUInt32()
-            if wkb_size == 0:
-                feat.setGeometry(nullgeom)
-            else:
-                geom = QgsGeometry()
-                geom.fromWkb(ds.readRawData(wkb_size))
-                feat.setGeometry(geom)
-            dp.addFeatures([feat])
+    @staticmethod
+    def finish_layer(layer, ss):
         layer.setSubsetString(ss)
         layer.updateFields()
         layer.updateExtents()
 
+    def read_field(self):
+        """Read a field definition as a (name, type, typename, length, precision, comment) tuple"""
+        ds = self._dstream
+        name = ds.readQString()
+        qtype = ds.readInt16()
+        typename = ds.readQString()
+        length = ds.readInt16()
+        precision = ds.readInt16()
+        comment = ds.readQString()
+        return name, qtype, typename, length, precision, comment
+
+    @staticmethod
+    def create_field(name, qtype, typename, length, precision, comment):
+        try:
+            field_type = QMetaType.Type(qtype)
+        except (TypeError, ValueError):
+            # Fallback en cas d'échec
+            field_type = QMetaType.Type.UnknownType
+            log(f"Unable to convert type {qtype} for field {name}, using UnknownType")
+
+        return QgsField(name, field_type, typename, int(length), int(precision), comment)
+
+    def read_features(self, fields, nattr, flags=0, stats=None, select=None):
+        """Yield the features of the current layer
+
+        The time spent decoding the attributes and the geometries is added to stats (LayerStats), if given.
+        The repeated values of the text fields are shared through intern tables, see interning.
+        select is called with the feature count of each chunk, the chunks for which it returns False are
+        skipped (version 3 files only).
+        """
+        ds = self._dstream
+        if stats is None:
+            stats = LayerStats(None, READ)
+        intern = interners(fields, nattr, self._intern_capacity)
+        if self._version < 3:
+            while ds.readBool():
+                yield self.read_timed_feature(ds, fields, nattr, stats, intern)
+            return
+
+        for stream, count in self.read_chunks(flags, select):
+            if flags & FLAG_COMPACT_GEOMETRY:
+                yield from self.read_compact_chunk(stream, count, fields, nattr, flags, stats, intern)
+            elif flags & FLAG_COLUMNAR:
+                yield from self.read_columnar_chunk(stream, count, fields, nattr, stats, intern)
+            else:
+                for _i in range(count):
+                    yield self.read_timed_feature(stream, fields, nattr, stats, intern)
+
+    def read_columnar_chunk(self, stream, count, fields, nattr, stats, intern=None):
+        """Yield the features of a chunk whose attributes are stored column by column"""
+        start = perf_counter()
+        rows = decode_columns(stream, count, nattr, intern)
+        stats.attribute_time += perf_counter() - start
+        for row in rows:
+            feat = self.columnar_feature(fields, nattr, row)
+            start = perf_counter()
+            self.read_geometry(stream, feat)
+            stats.geometry_time += perf_counter() - start
+            yield feat
+
+    def read_compact_chunk(self, stream, count, fields, nattr, flags, stats, intern=None):
+        """Yield the features of a chunk whose geometries are stored in a compact block after the attributes"""
+        start = perf_counter()
+        if flags & FLAG_COLUMNAR:
+            rows = decode_columns(stream, count, nattr, intern)
+            features = [self.columnar_feature(fields, nattr, row) for row in rows]
+        else:
+            features = []
+            for _i in range(count):
+                feat = QgsFeature(fields)
+                self.read_attributes(stream, feat, nattr, intern)
+                features.append(feat)
+        middle = perf_counter()
+        for feat, wkb in zip(features, decode_geometries(stream.readRawData(stream.readUInt32()), count)):
+            if wkb is not None:
+                geom = QgsGeometry()
+                geom.fromWkb(wkb)
+                feat.setGeometry(geom)
+        stats.attribute_time += middle - start
+        stats.geometry_time += perf_counter() - middle
+        yield from features
+
+    @staticmethod
+    def columnar_feature(fields, nattr, row):
+        """Return a feature with the attributes decoded from a columnar chunk"""
+        feat = QgsFeature(fields)
+        if nattr == fields.count():
+            feat.setAttributes(row)
+        else:
+            for i, value in enumerate(row):
+                if value is not None:
+                    feat[i] = value
+        return feat
+
+    def read_chunks(self, flags=0, select=None):
+        """Yield a (stream, feature count) tuple for each chunk of the current layer
+
+        The chunks with a wrong checksum raise a CorruptDataError, they are skipped in recovery mode.
+        The chunks for which select(feature count) returns False are skipped without being decompressed.
+        The cancellation of the feedback is checked before each chunk.
+        """
+        ds = self._dstream
+        while True:
+            self.check_canceled()
+            offset = self._file.pos()
+            count = ds.readUInt32()
+            if ds.status() != QDataStream.Status.Ok:
+                raise CorruptDataError(f"{self._filename} is truncated at offset {offset}", offset)
+            if count == 0:
+                return
+            if select is not None and not select(count):
+                self.skip_payload(offset, flags)
+                self.advance(self._file.pos() - offset)
+                continue
+            data = self.read_payload(offset, count, flags)
+            self.advance(self._file.pos() - offset)
+            if data is None:
+                continue
+            stream = QDataStream(QByteArray(decompress(data, flags)))
+            stream.setVersion(QDataStream.Version.Qt_4_5)
+            yield stream, count
+
+    def read_payload(self, offset, count, flags):
+        """Read the size, the checksum and the payload of the frame starting at offset
+
+        Return the payload, None if its checksum is wrong in recovery mode.
+        """
+        ds = self._dstream
+        size = ds.readUInt32()
+        expected = ds.readUInt32() if flags & FLAG_CHECKSUM else None
+        if ds.status() != QDataStream.Status.Ok or self._file.pos() + size > self._file.size():
+            raise CorruptDataError(f"{self._filename}: the chunk at offset {offset} is truncated", offset)
+        data = ds.readRawData(size)
+        if expected is not None and checksum(data) != expected:
+            message = f"{self._filename}: the chunk at offset {offset} is damaged (wrong checksum)"
+            if not self._recover:
+                raise CorruptDataError(message, offset)
+            log(message)
+            self._damaged.append(
+                DamagedRange(offset, self._file.pos() - offset, self._layer_id, count, "wrong checksum")
+            )
+            return None
+        return data
+
+    def skip_payload(self, offset, flags):
+        """Skip the size, the checksum and the payload of the frame starting at offset"""
+        ds = self._dstream
+        size = ds.readUInt32()
+        if flags & FLAG_CHECKSUM:
+            ds.readUInt32()
+        if ds.status() != QDataStream.Status.Ok or self._file.pos() + size > self._file.size():
+            raise CorruptDataError(f"{self._filename}: the chunk at offset {offset} is truncated", offset)
+        self._file.seek(self._file.pos() + size)
+
+    @staticmethod
+    def read_feature(stream, fields, nattr):
+        feat = QgsFeature(fields)
+        Reader.read_attributes(stream, feat, nattr)
+        Reader.read_geometry(stream, feat)
+        return feat
+
+    @staticmethod
+    def read_timed_feature(stream, fields, nattr, stats, intern=None):
+        """Same as read_feature, adding the time spent on attributes and geometry to stats"""
+        feat = QgsFeature(fields)
+        start = perf_counter()
+        Reader.read_attributes(stream, feat, nattr, intern)
+        middle = perf_counter()
+        Reader.read_geometry(stream, feat)
+        stats.attribute_time += middle - start
+        stats.geometry_time += perf_counter() - middle
+        return feat
+
+    @staticmethod
+    def read_attributes(stream, feat, nattr, intern=None):
+        """Read the attributes of a feature, intern is the intern function of each attribute (see interning)"""
+        if intern is None:
+            for i in range(nattr):
+                value = stream.readQVariant()
+                if value is not None:
+                    feat[i] = value
+            return
+        for i, intern_value in enumerate(intern):
+            value = stream.readQVariant()
+            if value is not None:
+                feat[i] = intern_value(value) if intern_value is not None else value
+
+    @staticmethod
+    def read_geometry(stream, feat):
+        wkb_size = stream.readUInt32()
+        if wkb_size:
+            geom = QgsGeometry()
+            geom.fromWkb(stream.readRawData(wkb_size))
+            feat.setGeometry(geom)
+
     def skip_layer(self):
         ds = self._dstream
         if self._version > 1:
@@ -121,12 +798,15 @@ class Reader:
         nattr = ds.readInt16()
         attr = list(range(nattr))
         for _i in attr:
-            ds.readQString()  # name
-            ds.readInt16()  # type
-            ds.readQString()  # typename
-            ds.readInt16()  # length
-            ds.readInt16()  # precision
-            ds.readQString()  # comment
+            self.read_field()
+        if self._version > 2:
+            # Chunks can be skipped without decoding them
+            flags = ds.readUInt32()
+            # Size of the checksum following the size of the chunks
+            checksum_size = 4 if flags & FLAG_CHECKSUM else 0
+            while ds.readUInt32():
+                ds.skipRawData(ds.readUInt32() + checksum_size)
+            return
         while ds.readBool():
             for _i in attr:
                 ds.readQVariant()
@@ -0,0 +1,83 @@
+"""Bounded samples of the features of the layers loaded in preview mode
+
+A layer previewed (see Settings.preview_features) is loaded with a sample of its features only,
+read by Reader.read_layers from the table of contents of its mldata file:
+
+- ``FIRST``: the first features of the layer. The chunks after the sample are not read.
+- ``THINNED``: features spread over the whole layer. The chunks are read at regular intervals, about
+  OVERSAMPLING times the sample size in total, the others are skipped without being decoded. Their
+  features are thinned on a grid over the extent of the layer: one feature per cell first, then the
+  remaining features in the order of the file if the sample is not full.
+"""
+
+import math
+from itertools import islice
+
+FIRST = "first"
+THINNED = "thinned"
+SAMPLING_METHODS = (FIRST, THINNED)
+
+# Number of features decoded per feature of a thinned sample
+OVERSAMPLING = 4
+
+
+class Sample:
+    """Selection of the chunks and the features of a layer read in preview mode
+
+    feature_count and extent (xmin, ymin, xmax, ymax) are the ones of the whole layer, as stored in the
+    table of contents. A sample is used to read a single layer.
+    """
+
+    def __init__(self, max_features, method=FIRST, feature_count=0, extent=None):
+        self.max_features = max(1, int(max_features))
+        self.method = method if method in SAMPLING_METHODS else FIRST
+        self.feature_count = feature_count
+        self.extent = extent
+        # Number of features of the chunks seen so far, and position of the next chunk to read
+        self._position = 0
+        self._next_read = 0
+
+    def __repr__(self):
+        return f"Sample({self.max_features}, {self.method!r})"
+
+    def select_chunk(self, count):
+        """Return whether the next chunk, holding count features, must be decoded"""
+        position = self._position
+        self._position += count
+        if self.method == FIRST:
+            return True
+        if position < self._next_read:
+            return False
+        stride = max(1.0, self.feature_count / (OVERSAMPLING * self.max_features))
+        self._next_read = position + count * stride
+        return True
+
+    def features(self, features):
+        """Yield the features of the sample, out of the features decoded from the selected chunks"""
+        if self.method == FIRST or not self.extent:
+            yield from islice(features, self.max_features)
+            return
+
+        xmin, ymin, xmax, ymax = self.extent
+        side = math.ceil(math.sqrt(self.max_features))
+        width = (xmax - xmin) / side or 1.0
+        height = (ymax - ymin) / side or 1.0
+        occupied = set()
+        # Features of the occupied cells, taken once all the chunks are read if the sample is not full
+        deferred = []
+        kept = 0
+        for feat in features:
+            geom = feat.geometry()
+            if not geom.isNull():
+                center = geom.boundingBox().center()
+                cell = (int((center.x() - xmin) / width), int((center.y() - ymin) / height))
+                if cell in occupied:
+                    if len(deferred) < self.max_features - kept:
+                        deferred.append(feat)
+                    continue
+                occupied.add(cell)
+            yield feat
+            kept += 1
+            if kept >= self.max_features:
+                return
+        yield from deferred[: self.max_features - kept]
@@ -0,0 +1,59 @@
+from qgis.core import QgsApplication, QgsTask
+
+from .mldata import CanceledError
+from .reader import Reader
+from .toolbox import log, log_error
+from .writer import Writer
+
+
+class SaveTask(QgsTask):
+    """Write snapshots of the memory layers to the mldata file in a background thread
+
+    The layers are written to a temporary file which replaces the mldata file once complete,
+    so the mldata file always holds either the previous or the new version of the layers.
+    """
+
+    def __init__(self, filepath, snapshots, modified_layers, writer_options=None):
+        super().__init__(QgsApplication.translate("MemoryLayerSaver", "Saving memory layers"), QgsTask.Flag.CanCancel)
+        self.filepath = filepath
+        self.snapshots = snapshots
+        self.modified_layers = set(modified_layers)
+        # Keyword arguments of the Writer, read from the settings on the main thread
+        self.writer_options = writer_options or {}
+        self.error = None
+        # layer id -> LayerStats of the layers written
+        self.stats = {}
+
+    def run(self):
+        previous = Reader.try_open(self.filepath)
+        try:
+            # The Writer streams to a temporary file, which only replaces the mldata file once complete.
+            # The task is its feedback: it reports the progress and stops between two chunks once canceled
+            with Writer(self.filepath, feedback=self, **self.writer_options) as writer:
+                writer.write_layers(self.snapshots, previous, self.modified_layers)
+                # The previous file must be closed before it is replaced
+                if previous:
+                    previous.close()
+                self.stats = writer.stats
+        except CanceledError:
+            # The temporary file was discarded
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            if previous:
+                previous.close()
+
+        if self.error is not None or self.isCanceled():
+            return False
+        # Release the feature sources as soon as possible
+        self.snapshots = []
+        return True
+
+    def finished(self, result):
+        if result:
+            log(f"Memory layers saved to {self.filepath}")
+        elif self.error is not None:
+            log_error(f"Error while saving memory layers to {self.filepath}: {self.error}")
+        else:
+            log(f"Saving memory layers to {self.filepath} was canceled")
@@ -1,15 +1,55 @@
 from qgis.core import Qgis, QgsMapLayer, QgsSettings
 
+from .geometry_codec import MAX_PRECISION
+from .reader import DEFAULT_BATCH_SIZE
+from .sampling import FIRST, SAMPLING_METHODS
+
 # Used by QGIS to prompt user to save memory layers on exit.
 ASK_TO_SAVE_MEMORY_LAYER_KEY = "askToSaveMemoryLayers"
 # Used by MLS to save the original value of ASK_TO_SAVE_MEMORY_LAYER_KEY.
 BACKUP_KEY = "MemoryLayerSaver/memoryLayerSaveSetting"
 # Can be used to disable saving on a per-layer basis.
 SAVE_LAYER_KEY = "SaveMemoryProvider"
+# Can be used to round the coordinates of the geometries of a layer to a number of decimals
+# when they are saved, they are then stored in the compact geometry encoding.
+GEOMETRY_PRECISION_KEY = "GeometryPrecision"
+# Can be used to load a layer as a sample of this number of features (preview mode), or completely (0),
+# whatever the global preview setting.
+PREVIEW_FEATURES_KEY = "PreviewFeatures"
 # Wheter the mldata is embedded in the attachment.zip(qgs)/the project file (qgz)
 # or stored in a separate .mldata file (legacy). This can be changed from
 # the settings dialog, to export a project that can be opened in older QGIS versions (< 3.22).
 MLDATA_EMBEDDED = "MemoryLayerSaver/mldataEmbedded"
+# Whether each memory layer is stored in its own attached file, listed in a manifest (embedded mode only),
+# instead of a single layers.mldata attachment.
+LAYER_FILES = "MemoryLayerSaver/layerFiles"
+# Number of features decoded before being inserted in the data provider in a single call.
+BATCH_SIZE = "MemoryLayerSaver/batchSize"
+# Number of threads used to decode the layers when loading a project.
+LOAD_THREADS = "MemoryLayerSaver/loadThreads"
+# Whether the attributes are stored column by column, with typed encodings.
+COLUMNAR_ENCODING = "MemoryLayerSaver/columnarEncoding"
+# Whether the geometries are stored in the compact encoding (varint structure, without WKB headers).
+COMPACT_GEOMETRY = "MemoryLayerSaver/compactGeometry"
+# Codec used to compress the chunks of features ("", "zlib" or "lzma") and its level (0-9).
+COMPRESSION = "MemoryLayerSaver/compression"
+COMPRESSION_LEVEL = "MemoryLayerSaver/compressionLevel"
+# Whether the features of hidden layers are only loaded when they are needed.
+LAZY_LOADING = "MemoryLayerSaver/lazyLoading"
+# Whether the separate .mldata file (legacy mode) is written by a background task.
+BACKGROUND_SAVE = "MemoryLayerSaver/backgroundSave"
+# Whether the committed edits are appended to a journal beside the mldata file, instead of rewriting it.
+EDIT_JOURNAL = "MemoryLayerSaver/editJournal"
+# Whether the previous version of the separate .mldata file (legacy mode) is kept as .mldata.bak.
+KEEP_BACKUP = "MemoryLayerSaver/keepBackup"
+# Number of features loaded from the layers which have more features (preview mode), 0 to load them all.
+PREVIEW_FEATURES = "MemoryLayerSaver/previewFeatures"
+# How the features of the previewed layers are sampled ("first" or "thinned", see sampling).
+PREVIEW_SAMPLING = "MemoryLayerSaver/previewSampling"
+# Whether the layers modified since the project was saved are checkpointed beside the project file (see autosave).
+AUTOSAVE = "MemoryLayerSaver/autosave"
+# Number of seconds without committed edits after which a checkpoint is written.
+AUTOSAVE_DELAY = "MemoryLayerSaver/autosaveDelay"
 
 
 class Settings:
@@ -44,6 +84,154 @@ class Settings:
     def set_mldata_embedded(cls, value):
         cls.get_settings().setValue(MLDATA_EMBEDDED, value)
 
+    @classmethod
+    def layer_files(cls):
+        """Whether the memory layers are stored in one attached file per layer, outside of the legacy mode"""
+        return cls.get_settings().value(LAYER_FILES, False, bool)
+
+    @classmethod
+    def set_layer_files(cls, value):
+        cls.get_settings().setValue(LAYER_FILES, value)
+
+    @classmethod
+    def batch_size(cls):
+        """Number of features inserted at once when reading a layer"""
+        return max(1, cls.get_settings().value(BATCH_SIZE, DEFAULT_BATCH_SIZE, int))
+
+    @classmethod
+    def set_batch_size(cls, value):
+        cls.get_settings().setValue(BATCH_SIZE, int(value))
+
+    @classmethod
+    def load_threads(cls):
+        """Number of threads decoding the layers on load (1: sequential loading)"""
+        return max(1, cls.get_settings().value(LOAD_THREADS, 1, int))
+
+    @classmethod
+    def set_load_threads(cls, value):
+        cls.get_settings().setValue(LOAD_THREADS, int(value))
+
+    @classmethod
+    def columnar_encoding(cls):
+        return cls.get_settings().value(COLUMNAR_ENCODING, False, bool)
+
+    @classmethod
+    def set_columnar_encoding(cls, value):
+        cls.get_settings().setValue(COLUMNAR_ENCODING, value)
+
+    @classmethod
+    def compact_geometry(cls):
+        return cls.get_settings().value(COMPACT_GEOMETRY, False, bool)
+
+    @classmethod
+    def set_compact_geometry(cls, value):
+        cls.get_settings().setValue(COMPACT_GEOMETRY, value)
+
+    @classmethod
+    def compression(cls):
+        return cls.get_settings().value(COMPRESSION, "", str)
+
+    @classmethod
+    def set_compression(cls, value):
+        cls.get_settings().setValue(COMPRESSION, value or "")
+
+    @classmethod
+    def compression_level(cls):
+        return min(9, max(0, cls.get_settings().value(COMPRESSION_LEVEL, 6, int)))
+
+    @classmethod
+    def set_compression_level(cls, value):
+        cls.get_settings().setValue(COMPRESSION_LEVEL, int(value))
+
+    @classmethod
+    def writer_options(cls):
+        """Keyword arguments of the Writer, according to the settings"""
+        return {
+            "chunk_size": cls.batch_size(),
+            "columnar": cls.columnar_encoding(),
+            "compression": cls.compression() or None,
+            "compression_level": cls.compression_level(),
+            "compact_geometry": cls.compact_geometry(),
+            # The attached files are packed in the project, which keeps its own backup
+            "backup": cls.keep_backup() and cls.legacy_mode(),
+        }
+
+    @classmethod
+    def lazy_loading(cls):
+        return cls.get_settings().value(LAZY_LOADING, False, bool)
+
+    @classmethod
+    def set_lazy_loading(cls, value):
+        cls.get_settings().setValue(LAZY_LOADING, value)
+
+    @classmethod
+    def background_save(cls):
+        return cls.get_settings().value(BACKGROUND_SAVE, False, bool)
+
+    @classmethod
+    def set_background_save(cls, value):
+        cls.get_settings().setValue(BACKGROUND_SAVE, value)
+
+    @classmethod
+    def edit_journal(cls):
+        return cls.get_settings().value(EDIT_JOURNAL, False, bool)
+
+    @classmethod
+    def set_edit_journal(cls, value):
+        cls.get_settings().setValue(EDIT_JOURNAL, value)
+
+    @classmethod
+    def keep_backup(cls):
+        return cls.get_settings().value(KEEP_BACKUP, False, bool)
+
+    @classmethod
+    def set_keep_backup(cls, value):
+        cls.get_settings().setValue(KEEP_BACKUP, value)
+
+    @classmethod
+    def preview_features(cls):
+        return max(0, cls.get_settings().value(PREVIEW_FEATURES, 0, int))
+
+    @classmethod
+    def set_preview_features(cls, value):
+        cls.get_settings().setValue(PREVIEW_FEATURES, max(0, int(value)))
+
+    @classmethod
+    def preview_sampling(cls):
+        value = cls.get_settings().value(PREVIEW_SAMPLING, FIRST, str)
+        return value if value in SAMPLING_METHODS else FIRST
+
+    @classmethod
+    def set_preview_sampling(cls, value):
+        cls.get_settings().setValue(PREVIEW_SAMPLING, value)
+
+    @classmethod
+    def autosave(cls):
+        return cls.get_settings().value(AUTOSAVE, False, bool)
+
+    @classmethod
+    def set_autosave(cls, value):
+        cls.get_settings().setValue(AUTOSAVE, value)
+
+    @classmethod
+    def autosave_delay(cls):
+        return max(1, cls.get_settings().value(AUTOSAVE_DELAY, 30, int))
+
+    @classmethod
+    def set_autosave_delay(cls, value):
+        cls.get_settings().setValue(AUTOSAVE_DELAY, max(1, int(value)))
+
+    @classmethod
+    def layer_preview_features(cls, layer):
+        """Number of features loaded from the layer if it has more (preview mode), 0 to load it completely"""
+        value = layer.customProperty(PREVIEW_FEATURES_KEY, None)
+        if value in (None, ""):
+            return cls.preview_features()
+        try:
+            return max(0, int(value))
+        except (TypeError, ValueError):
+            return cls.preview_features()
+
     @classmethod
     def legacy_mode(cls):
         """Whether to use the legacy .mldata file format"""
@@ -57,3 +245,15 @@ class Settings:
         if data_provider is None or data_provider.name() != "memory":
             return False
         return layer.customProperty(SAVE_LAYER_KEY, True) in [True, "true", "True"]
+
+    @staticmethod
+    def geometry_precision(layer):
+        """Number of decimals the coordinates of the layer are rounded to when it is saved, None to keep them"""
+        value = layer.customProperty(GEOMETRY_PRECISION_KEY, None)
+        if value in (None, ""):
+            return None
+        try:
+            precision = int(value)
+        except (TypeError, ValueError):
+            return None
+        return precision if -MAX_PRECISION <= precision <= MAX_PRECISION else None
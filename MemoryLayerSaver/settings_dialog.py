@@ -1,5 +1,16 @@
-from qgis.PyQt.QtWidgets import QCheckBox, QDialog, QDialogButtonBox, QVBoxLayout
+import os
 
+from qgis.PyQt.QtWidgets import (
+    QCheckBox,
+    QComboBox,
+    QDialog,
+    QDialogButtonBox,
+    QFormLayout,
+    QSpinBox,
+    QVBoxLayout,
+)
+
+from .sampling import FIRST, THINNED
 from .settings import Settings
 
 
@@ -19,14 +30,196 @@ class SettingsDialog(QDialog):
             )
         )
 
+        self.layer_files_checkbox = QCheckBox(self.tr("One attached file per layer"), self)
+        self.layer_files_checkbox.setChecked(Settings.layer_files())
+        self.layer_files_checkbox.setToolTip(
+            self.tr(
+                "If checked, each memory layer is stored in its own file embedded in the project, so only "
+                "the files of the modified layers are written again when the project is saved. "
+                "The edits are then not journaled."
+            )
+        )
+
+        self.background_checkbox = QCheckBox(self.tr("Save in background"), self)
+        self.background_checkbox.setChecked(Settings.background_save())
+        self.background_checkbox.setToolTip(
+            self.tr(
+                "If checked, the separate .mldata file is written by a background task so that QGIS remains "
+                "responsive while saving large layers. Embedded mldata files are always saved immediately, "
+                "since they must be complete when the project file is written."
+            )
+        )
+
+        self.backup_checkbox = QCheckBox(self.tr("Keep a backup of the mldata file"), self)
+        self.backup_checkbox.setChecked(Settings.keep_backup())
+        self.backup_checkbox.setToolTip(
+            self.tr(
+                "If checked, the previous version of the separate .mldata file is kept as .mldata.bak "
+                "each time it is replaced."
+            )
+        )
+
+        self.columnar_checkbox = QCheckBox(self.tr("Columnar attribute encoding"), self)
+        self.columnar_checkbox.setChecked(Settings.columnar_encoding())
+        self.columnar_checkbox.setToolTip(
+            self.tr(
+                "If checked, the attributes are stored field by field with compact typed encodings "
+                "(integers, doubles, dictionary-encoded strings), which makes the mldata file smaller "
+                "and faster to load for layers with many attributes."
+            )
+        )
+
+        self.compact_geometry_checkbox = QCheckBox(self.tr("Compact geometry encoding"), self)
+        self.compact_geometry_checkbox.setChecked(Settings.compact_geometry())
+        self.compact_geometry_checkbox.setToolTip(
+            self.tr(
+                "If checked, the geometries of each chunk are stored without the WKB headers, which makes "
+                "point layers smaller. The coordinates of a layer can also be rounded, and delta encoded, "
+                "by setting its GeometryPrecision custom property to a number of decimals."
+            )
+        )
+
+        self.lazy_checkbox = QCheckBox(self.tr("Load hidden layers on demand"), self)
+        self.lazy_checkbox.setChecked(Settings.lazy_loading())
+        self.lazy_checkbox.setToolTip(
+            self.tr(
+                "If checked, the features of the memory layers hidden in the layer tree are only loaded "
+                "when the layer is made visible, selected, edited or filtered. The layers in a relation or "
+                "joined to another layer are always loaded. Until then, the expressions and the processing "
+                "algorithms see the hidden layers empty."
+            )
+        )
+
+        self.journal_checkbox = QCheckBox(self.tr("Journal the edits"), self)
+        self.journal_checkbox.setChecked(Settings.edit_journal())
+        self.journal_checkbox.setToolTip(
+            self.tr(
+                "If checked, the edits committed on the memory layers are appended to a journal beside "
+                "the mldata file, which is only rewritten when the journal grows too large. "
+                "With a separate .mldata file, the unsaved edits can be recovered after a crash. "
+                "Memory layers are then never saved in background."
+            )
+        )
+
+        self.autosave_checkbox = QCheckBox(self.tr("Autosave the modified layers"), self)
+        self.autosave_checkbox.setChecked(Settings.autosave())
+        self.autosave_checkbox.setToolTip(
+            self.tr(
+                "If checked, the memory layers modified since the project was saved are written in background "
+                "to a checkpoint file beside the project file, from which they can be recovered after a crash. "
+                "The checkpoint file is removed when the project is saved."
+            )
+        )
+
+        self.threads_spinbox = QSpinBox(self)
+        self.threads_spinbox.setRange(1, max(1, os.cpu_count() or 1))
+        self.threads_spinbox.setValue(Settings.load_threads())
+        self.threads_spinbox.setToolTip(
+            self.tr(
+                "Number of threads decoding the memory layers when a project is loaded. "
+                "Set to 1 to load them sequentially."
+            )
+        )
+        self.compression_combobox = QComboBox(self)
+        self.compression_combobox.addItem(self.tr("None"), "")
+        self.compression_combobox.addItem("zlib", "zlib")
+        self.compression_combobox.addItem("lzma", "lzma")
+        self.compression_combobox.setCurrentIndex(max(0, self.compression_combobox.findData(Settings.compression())))
+        self.compression_combobox.setToolTip(
+            self.tr(
+                "Codec used to compress the features in the mldata file. "
+                "zlib is fast, lzma produces smaller files but is slower."
+            )
+        )
+
+        self.compression_level_spinbox = QSpinBox(self)
+        self.compression_level_spinbox.setRange(0, 9)
+        self.compression_level_spinbox.setValue(Settings.compression_level())
+        self.compression_level_spinbox.setToolTip(self.tr("Compression level, from 0 (fastest) to 9 (smallest file)"))
+        self.preview_spinbox = QSpinBox(self)
+        self.preview_spinbox.setRange(0, 2**31 - 1)
+        self.preview_spinbox.setSingleStep(10000)
+        self.preview_spinbox.setSpecialValueText(self.tr("All the features"))
+        self.preview_spinbox.setValue(Settings.preview_features())
+        self.preview_spinbox.setToolTip(
+            self.tr(
+                "Number of features loaded from the memory layers which have more, to preview large projects "
+                "quickly. The previewed layers are loaded completely before being edited or saved, or from the "
+                "plugin menu. A layer can override it with its PreviewFeatures custom property."
+            )
+        )
+        self.sampling_combobox = QComboBox(self)
+        self.sampling_combobox.addItem(self.tr("First features"), FIRST)
+        self.sampling_combobox.addItem(self.tr("Features spread over the layer"), THINNED)
+        self.sampling_combobox.setCurrentIndex(max(0, self.sampling_combobox.findData(Settings.preview_sampling())))
+        self.sampling_combobox.setToolTip(
+            self.tr(
+                "Features loaded from the previewed layers: the first features of the mldata file, "
+                "or features read across the whole layer and thinned over its extent."
+            )
+        )
+        self.autosave_spinbox = QSpinBox(self)
+        self.autosave_spinbox.setRange(1, 3600)
+        self.autosave_spinbox.setSuffix(self.tr(" s"))
+        self.autosave_spinbox.setValue(Settings.autosave_delay())
+        self.autosave_spinbox.setToolTip(
+            self.tr(
+                "The modified layers are autosaved once no edit was committed during this delay, "
+                "and at the latest four times this delay after the first edit."
+            )
+        )
+        self.autosave_checkbox.toggled.connect(self.update_widgets)
+        self.preview_spinbox.valueChanged.connect(self.update_widgets)
+        self.compression_combobox.currentIndexChanged.connect(self.update_widgets)
+        self.checkbox.toggled.connect(self.update_widgets)
+
+        form_layout = QFormLayout()
+        form_layout.addRow(self.tr("Loading threads"), self.threads_spinbox)
+        form_layout.addRow(self.tr("Compression"), self.compression_combobox)
+        form_layout.addRow(self.tr("Compression level"), self.compression_level_spinbox)
+        form_layout.addRow(self.tr("Preview"), self.preview_spinbox)
+        form_layout.addRow(self.tr("Preview sampling"), self.sampling_combobox)
+        form_layout.addRow(self.tr("Autosave delay"), self.autosave_spinbox)
+
         button_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
         button_box.accepted.connect(self.accept)
         button_box.rejected.connect(self.reject)
 
         layout.addWidget(self.checkbox)
+        layout.addWidget(self.layer_files_checkbox)
+        layout.addWidget(self.background_checkbox)
+        layout.addWidget(self.backup_checkbox)
+        layout.addWidget(self.columnar_checkbox)
+        layout.addWidget(self.compact_geometry_checkbox)
+        layout.addWidget(self.lazy_checkbox)
+        layout.addWidget(self.journal_checkbox)
+        layout.addWidget(self.autosave_checkbox)
+        layout.addLayout(form_layout)
         layout.addStretch()
         layout.addWidget(button_box)
 
+        self.update_widgets()
+
+    def update_widgets(self):
+        self.compression_level_spinbox.setEnabled(bool(self.compression_combobox.currentData()))
+        self.layer_files_checkbox.setEnabled(self.checkbox.isChecked())
+        self.sampling_combobox.setEnabled(self.preview_spinbox.value() > 0)
+        self.autosave_spinbox.setEnabled(self.autosave_checkbox.isChecked())
+
     def accept(self):
         Settings.set_mldata_embedded(self.checkbox.isChecked())
+        Settings.set_layer_files(self.layer_files_checkbox.isChecked())
+        Settings.set_background_save(self.background_checkbox.isChecked())
+        Settings.set_keep_backup(self.backup_checkbox.isChecked())
+        Settings.set_columnar_encoding(self.columnar_checkbox.isChecked())
+        Settings.set_compact_geometry(self.compact_geometry_checkbox.isChecked())
+        Settings.set_lazy_loading(self.lazy_checkbox.isChecked())
+        Settings.set_edit_journal(self.journal_checkbox.isChecked())
+        Settings.set_load_threads(self.threads_spinbox.value())
+        Settings.set_compression(self.compression_combobox.currentData())
+        Settings.set_compression_level(self.compression_level_spinbox.value())
+        Settings.set_preview_features(self.preview_spinbox.value())
+        Settings.set_preview_sampling(self.sampling_combobox.currentData())
+        Settings.set_autosave(self.autosave_checkbox.isChecked())
+        Settings.set_autosave_delay(self.autosave_spinbox.value())
         super().accept()
@@ -0,0 +1,56 @@
+import time
+
+# Operations
+READ = "read"
+WRITE = "write"
+COPY = "copy"
+
+
+class LayerStats:
+    """Timing statistics of a layer read from or written to an mldata file
+
+    elapsed is the total duration of the operation. It is split between the time spent encoding or
+    decoding the attributes (attribute_time), the geometries (geometry_time) and the time spent
+    fetching the features from or inserting them in the data provider (provider_time). The remainder
+    is spent in the chunk (de)compression, the file I/O and the creation of the features.
+    """
+
+    def __init__(self, layer_id, operation):
+        self.layer_id = layer_id
+        self.operation = operation
+        self.feature_count = 0
+        # Size of the layer record in the mldata file
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.attribute_time = 0.0
+        self.geometry_time = 0.0
+        self.provider_time = 0.0
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.elapsed += time.perf_counter() - self._start
+
+    @property
+    def throughput(self):
+        """Number of features per second"""
+        return self.feature_count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            "layer_id": self.layer_id,
+            "operation": self.operation,
+            "feature_count": self.feature_count,
+            "bytes": self.bytes,
+            "elapsed": self.elapsed,
+            "attribute_time": self.attribute_time,
+            "geometry_time": self.geometry_time,
+            "provider_time": self.provider_time,
+            "throughput": self.throughput,
+        }
+
+    def __str__(self):
+        return (
+            f"{self.feature_count} features, {self.bytes / 1e6:.2f} MB in {self.elapsed:.3f} s "
+            f"(attributes {self.attribute_time:.3f} s, geometries {self.geometry_time:.3f} s, "
+            f"provider {self.provider_time:.3f} s)"
+        )
@@ -0,0 +1,116 @@
+"""Verification of mldata files, which depends neither on QGIS nor on Qt
+
+The chunks of version 3 files are framed and prefixed by their CRC-32, so the file is checked
+without decoding the features: the memory mapped chunks are only hashed, which runs at disk speed.
+Version 1 and 2 files, which have no checksums, are checked by decoding them.
+
+    report = verify_file("project.qgs.mldata")
+    for damaged in report.damaged:
+        print(damaged)
+"""
+
+from time import perf_counter
+
+from .decoder import DataFile, LayerData
+from .mldata import FLAG_CHECKSUM, HEADER_SIZE, TRAILER_SIZE, DamagedRange, is_layer_header
+
+
+class VerifyReport:
+    """Result of the verification of an mldata file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.version = None
+        self.size = 0
+        self.layer_count = 0
+        self.chunk_count = 0
+        # Number of features of the intact chunks
+        self.feature_count = 0
+        # Ids of the layers written without checksums, whose chunks could not be checked
+        self.unchecked_layers = []
+        # List of DamagedRange
+        self.damaged = []
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.damaged
+
+    @property
+    def throughput(self):
+        """Bytes checked per second"""
+        return self.size / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        status = "OK" if self.ok else f"{len(self.damaged)} damaged ranges"
+        return (
+            f"{self.filename}: version {self.version}, {self.layer_count} layers, {self.chunk_count} chunks, "
+            f"{self.feature_count} intact features, {self.size / 1e6:.1f} MB checked in {self.elapsed:.2f} s: {status}"
+        )
+
+
+def verify_file(source):
+    """Check the layers of an mldata file (path or bytes-like object), return a VerifyReport"""
+    start = perf_counter()
+    report = VerifyReport(str(source) if not isinstance(source, (bytes, bytearray, memoryview)) else "<buffer>")
+    with DataFile(source, recover=True) as data:
+        report.version = data.version
+        report.size = len(data.buffer)
+
+        if data.index is not None:
+            index_end = report.size - TRAILER_SIZE
+            for entry in data.index:
+                end = entry.offset + entry.length
+                if not HEADER_SIZE <= entry.offset <= end <= index_end:
+                    reason = "invalid table of contents entry"
+                    report.damaged.append(DamagedRange(entry.offset, entry.length, entry.layer_id, None, reason))
+                    continue
+                verify_layer(report, data, entry.offset, end, entry.layer_id)
+        else:
+            # Version 1 or 2 file, or damaged table of contents: the layers are scanned from the start
+            pos = HEADER_SIZE
+            while pos is not None and pos < report.size:
+                if data.index_error is not None and not is_layer_at(data, pos):
+                    # The remains of the table of contents follow the last layer record
+                    break
+                pos = verify_layer(report, data, pos, None)
+            # A truncated layer record was already reported up to the end of the file
+            if data.index_error is not None and pos is not None:
+                reason = f"index lost: {data.index_error}"
+                report.damaged.append(DamagedRange(pos, report.size - pos, None, 0, reason))
+    report.elapsed = perf_counter() - start
+    return report
+
+
+def is_layer_at(data, offset):
+    """Whether a layer record of a version 3 file starts at offset"""
+    try:
+        layer = LayerData(data.version, data.buffer, offset)
+    except (ValueError, UnicodeDecodeError):
+        return False
+    return is_layer_header(layer.layer_id, layer.flags)
+
+
+def verify_layer(report, data, offset, end, layer_id=None):
+    """Check the layer record at offset, return the position of its end (None if it could not be found)"""
+    size = len(data.buffer)
+    try:
+        layer = LayerData(data.version, data.buffer, offset)
+    except (ValueError, UnicodeDecodeError) as e:
+        report.damaged.append(DamagedRange(offset, (end or size) - offset, layer_id, None, f"layer header: {e}"))
+        return None
+    if layer_id is not None and layer.layer_id != layer_id:
+        reason = f"the table of contents expects layer {layer_id} at this offset"
+        report.damaged.append(DamagedRange(offset, (end or size) - offset, layer_id, None, reason))
+        return None
+    report.layer_count += 1
+    if data.version > 2 and not layer.flags & FLAG_CHECKSUM:
+        report.unchecked_layers.append(layer.layer_id)
+    chunk_count, feature_count, damaged, layer_end = layer.verify(end)
+    report.chunk_count += chunk_count
+    report.feature_count += feature_count
+    report.damaged.extend(damaged)
+    if end is not None and layer_end is not None and layer_end != end:
+        reason = "unexpected data after the layer record"
+        report.damaged.append(DamagedRange(layer_end, end - layer_end, layer.layer_id, None, reason))
+    return layer_end
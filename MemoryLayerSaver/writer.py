@@ -1,89 +1,598 @@
-from qgis.PyQt.QtCore import QDataStream, QFile, QIODevice, QMetaType
+import datetime
+from time import perf_counter
 
+from qgis.core import QgsFeatureRequest, QgsFields, QgsRectangle
+from qgis.PyQt.QtCore import QByteArray, QDataStream, QDate, QDateTime, QIODevice, QSaveFile, Qt, QTime, QVariant
+
+from .columnar import encode_columns
+from .encoder import fingerprint_features
+from .geometry_codec import encode_geometries
+from .mldata import (
+    COMPRESSION_FLAGS,
+    DEFAULT_CHUNK_SIZE,
+    FLAG_CHECKSUM,
+    FLAG_COLUMNAR,
+    FLAG_COMPACT_GEOMETRY,
+    FORMAT_VERSION,
+    INDEX_MAGIC,
+    MAGIC,
+    CanceledError,
+    LayerEntry,
+    backup_file,
+    checksum,
+    compress,
+    new_fingerprint,
+    sync_directory,
+)
+from .settings import Settings
+from .stats import COPY, WRITE, LayerStats
 from .toolbox import log
 
+UNIX_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def provider_source(layer):
+    """Return a feature source on all the features of the memory provider of the layer, and their count
+
+    The subset string of the memory layer is applied by its provider: it is only cleared on the
+    provider, with its signals blocked, while the feature source is created. The layer is neither
+    reloaded nor repainted. The source holds a copy of the provider features (QgsFeature is implicitly
+    shared, so the copy is cheap) and can be iterated from another thread.
+
+    Clearing the subset string drops the extent and the min/max values cached by the provider, which
+    are computed again the next time they are requested: the source is created at most once per layer
+    and per save (see LayerSnapshot), and the extent of the layer is computed while it is written.
+    """
+    dp = layer.dataProvider()
+    ss = dp.subsetString()
+    if not ss:
+        return dp.featureSource(), dp.featureCount()
+    blocked = dp.blockSignals(True)
+    try:
+        dp.setSubsetString("", False)
+        # Without subset string, the memory provider counts its features in constant time
+        source, count = dp.featureSource(), dp.featureCount()
+    finally:
+        dp.setSubsetString(ss, False)
+        dp.blockSignals(blocked)
+    return source, count
+
+
+def python_value(value):
+    """Return an attribute value as the python value read back by the decoder
+
+    NULL values are None, the Qt date and time types their datetime counterparts (datetimes in local
+    time are naive, the others in UTC), byte arrays bytes, and the containers are converted
+    recursively. The values of the other types are converted to strings.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, QVariant):
+        return None if value.isNull() else python_value(value.value())
+    if isinstance(value, QDateTime):
+        if not value.isValid():
+            return None
+        if value.timeSpec() == Qt.TimeSpec.LocalTime:
+            return value.toPyDateTime()
+        return UNIX_EPOCH + datetime.timedelta(milliseconds=value.toMSecsSinceEpoch())
+    if isinstance(value, QDate):
+        return value.toPyDate() if value.isValid() else None
+    if isinstance(value, QTime):
+        return value.toPyTime() if value.isValid() else None
+    if isinstance(value, QByteArray):
+        return value.data()
+    if isinstance(value, (list, tuple)):
+        return [python_value(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): python_value(item) for key, item in value.items()}
+    return str(value)
+
+
+class LayerSnapshot:
+    """Copy of the content of a memory layer, which can be written outside of the main thread
+
+    The snapshot keeps a feature source of the memory provider (see provider_source), which is
+    created in constant time on the main thread: the features are only iterated by the thread
+    writing them, and their geometries and attributes are only duplicated if the layer is edited
+    while the snapshot is alive. If copy_features is False, only the layer description is kept,
+    the layer record must then be copied from the previous file.
+    """
+
+    def __init__(self, layer, copy_features=True):
+        self.layer_id = layer.id()
+        self.subset = layer.subsetString()
+        self.fields = QgsFields(layer.dataProvider().fields())
+        self.source = None
+        self.feature_count = 0
+        self.geometry_precision = Settings.geometry_precision(layer)
+        if copy_features:
+            self.source, self.feature_count = provider_source(layer)
+
+    @staticmethod
+    def of_layers(layers, previous=None, modified_layers=None):
+        """Return the snapshots of the layers (QgsVectorLayer or LayerSnapshot), in the same order
+
+        Only the layers whose record cannot be copied from the previous file keep a source of their features.
+        """
+        return [
+            layer
+            if isinstance(layer, LayerSnapshot)
+            else LayerSnapshot(layer, Writer.reusable_entry(layer, previous, modified_layers) is None)
+            for layer in layers
+        ]
+
+    @property
+    def has_features(self):
+        return self.source is not None
+
+    def features(self):
+        """Return a new iterator on the features of the snapshot"""
+        if self.source is None:
+            raise ValueError("The snapshot of layer " + self.layer_id + " does not contain its features")
+        return self.source.getFeatures(QgsFeatureRequest())
+
 
 class Writer:
-    def __init__(self, filename):
+    """Write the memory layers to an mldata file
+
+    The layers are streamed to a temporary file beside the mldata file, which is flushed to disk and
+    atomically renamed over the mldata file once it is complete (see commit): the mldata file always
+    holds either its previous or its new version, even if QGIS is killed while saving.
+
+    If a feedback is given, the progress is reported to it in features written, and a CanceledError is
+    raised between two chunks once it is canceled: the temporary file is then discarded on exit.
+    """
+
+    def __init__(
+        self,
+        filename,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        columnar=False,
+        compression=None,
+        compression_level=6,
+        journal_id=None,
+        backup=False,
+        compact_geometry=False,
+        feedback=None,
+        save_id=None,
+    ):
         self._filename = filename
+        self._chunk_size = max(1, int(chunk_size))
+        # The chunks are always written with their checksum
+        self._flags = FLAG_CHECKSUM | (FLAG_COLUMNAR if columnar else 0)
+        if compact_geometry:
+            self._flags |= FLAG_COMPACT_GEOMETRY
+        if compression:
+            if compression not in COMPRESSION_FLAGS:
+                raise ValueError("Unknown compression " + compression)
+            self._flags |= COMPRESSION_FLAGS[compression]
+        self._compression_level = compression_level
+        # Identifier of the edit journal which applies to this file, if any
+        self._journal_id = journal_id
+        # Identifier of the save, also stored in the project, so a file which does not match the project is detected
+        self._save_id = save_id
+        # Whether the previous version of the file is kept as filename.bak
+        self._backup = backup
+        # QgsFeedback (or any object with its isCanceled and setProgress methods, e.g. a QgsTask)
+        self._feedback = feedback
+        # Number of features to write and already written, for the progress reported to the feedback
+        self._progress_total = 0
+        self._progress_done = 0
         self._file = None
         self._dstream = None
+        self._entries = []
+        # layer id -> LayerStats of the layers written
+        self._stats = {}
 
     def __enter__(self):
         self.open()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # Correction: appel de la méthode close() au lieu de référencer l'attribut close
+        # The file is only replaced if all the layers were successfully written
+        if exc_type is None and self._file is not None:
+            self.write_index()
+            self.commit()
         self.close()
 
     def open(self):
-        self._file = QFile(self._filename)
+        self._file = QSaveFile(self._filename)
         if not self._file.open(QIODevice.OpenModeFlag.WriteOnly):
             raise ValueError("Cannot open " + self._filename)
         self._dstream = QDataStream(self._file)
         self._dstream.setVersion(QDataStream.Version.Qt_4_5)
-        for c in b"QGis.MemoryLayerData":
+        for c in MAGIC:
             self._dstream.writeUInt8(c)
         # Version of MLD format
-        self._dstream.writeUInt32(2)
+        self._dstream.writeUInt32(FORMAT_VERSION)
+        self._entries = []
+
+    def commit(self):
+        """Flush the temporary file to disk and rename it over the mldata file
+
+        The readers on the previous version of the file must be closed beforehand.
+        """
+        if not self._file:
+            raise ValueError("Layer stream not open for writing")
+        self._dstream.setDevice(None)
+        if self._backup:
+            backup_file(self._filename)
+        file = self._file
+        self._file = None
+        self._dstream = None
+        # QSaveFile syncs the temporary file to disk before renaming it
+        if not file.commit():
+            raise ValueError(f"Cannot write {self._filename}: {file.errorString()}")
+        sync_directory(self._filename)
 
     def close(self):
+        """Close the file, the temporary file is discarded if it was not committed"""
         try:
             self._dstream.setDevice(None)
-            self._file.close()
+            self._file.cancelWriting()
+            self._file.commit()
         except BaseException:
             pass
         self._dstream = None
         self._file = None
 
-    def write_layers(self, layers):
-        for layer in layers:
-            self.write_layer(layer)
+    @property
+    def stats(self):
+        """Timing statistics of the layers written so far (layer id -> LayerStats)"""
+        return self._stats
+
+    def check_canceled(self):
+        """Raise a CanceledError if the feedback was canceled"""
+        if self._feedback is not None and self._feedback.isCanceled():
+            raise CanceledError(f"Writing {self._filename} was canceled")
+
+    def advance(self, count):
+        """Add count features to the features written, and report the progress to the feedback"""
+        self._progress_done += count
+        if self._feedback is not None and self._progress_total > 0:
+            self._feedback.setProgress(min(100.0, 100.0 * self._progress_done / self._progress_total))
+
+    def write_layers(self, layers, previous=None, modified_layers=None):
+        """Write the layers (QgsVectorLayer or LayerSnapshot) to the file
+
+        If a reader on the previous version of the file is given, the layers which are not in
+        modified_layers (set of layer ids) are copied verbatim from it instead of being encoded again.
+        So are the modified layers whose contents still match their fingerprint in the previous
+        file (e.g. edits which were undone), once they are encoded (see write_snapshot).
+        """
+        # The features of each layer are read through a single source
+        layers = LayerSnapshot.of_layers(layers, previous, modified_layers)
+        entries = [self.reusable_entry(layer, previous, modified_layers) for layer in layers]
+        if self._feedback is not None:
+            self._progress_total += sum(
+                entry.feature_count if entry is not None else layer.feature_count
+                for layer, entry in zip(layers, entries)
+            )
+        for layer, entry in zip(layers, entries):
+            self.check_canceled()
+            if entry is not None:
+                self.copy_layer(previous, entry)
+            else:
+                self.write_snapshot(layer, previous)
+
+    @staticmethod
+    def reusable_entry(layer, previous, modified_layers):
+        """Return the entry of the previous file which is still up to date for the layer, if any
+
+        The entries of the modified layers are never returned (see matching_entry).
+        """
+        if previous is None or modified_layers is None:
+            return None
+        layer_id = layer.layer_id if isinstance(layer, LayerSnapshot) else layer.id()
+        if layer_id in modified_layers:
+            return None
+        return Writer.matching_entry(layer, previous)
+
+    @staticmethod
+    def matching_entry(layer, previous):
+        """Return the entry of the previous file which describes the layer as it is written, if any
 
-    def write_layer(self, layer):
-        log("Writing layer " + layer.id())
+        The subset string, the fields and the encoding settings of the layer must match its entry,
+        the record can then be copied if the features are unchanged.
+        """
+        if previous is None:
+            return None
+        if isinstance(layer, LayerSnapshot):
+            layer_id, subset, fields, precision = layer.layer_id, layer.subset, layer.fields, layer.geometry_precision
+        else:
+            layer_id, subset, fields = layer.id(), layer.subsetString(), layer.dataProvider().fields()
+            precision = Settings.geometry_precision(layer)
+        entry = previous.entry(layer_id)
+        if entry is None or entry.subset != subset:
+            return None
+        if entry.properties.get("precision") != precision:
+            return None
+        if [Writer.field_definition(fld) for fld in fields] != list(entry.fields):
+            return None
+        return entry
+
+    @staticmethod
+    def update_fingerprint(fingerprint, rows, geometries, field_types):
+        """Feed the attribute values and the WKB of a chunk of features to the fingerprint (hash object)
+
+        The attributes are converted to the python values the decoder reads back (see python_value)
+        and hashed through their canonical encoding, shared with the DataFileWriter (see
+        encoder.fingerprint_features).
+        """
+        rows = [[python_value(value) for value in row] for row in rows]
+        fingerprint_features(fingerprint, rows, geometries, field_types)
+
+    @staticmethod
+    def feature_row(feat, field_count):
+        """Return the list of the attributes of a provider feature, None for the missing fields
+
+        The attributes of the provider features are in the order of the provider fields.
+        """
+        row = feat.attributes()
+        if len(row) < field_count:
+            row.extend([None] * (field_count - len(row)))
+        elif len(row) > field_count:
+            del row[field_count:]
+        return row
+
+    def copy_layer(self, reader, entry):
+        """Copy a layer record from another mldata file without decoding it"""
+        log("Copying layer " + entry.layer_id)
+        if not self._dstream:
+            raise ValueError("Layer stream not open for writing")
+        stats = LayerStats(entry.layer_id, COPY)
+        offset = self._file.pos()
+        for block in reader.read_raw(entry):
+            self.check_canceled()
+            self._dstream.writeRawData(block)
+            # The progress of a copied layer is proportional to the bytes copied
+            self.advance(entry.feature_count * len(block) / entry.length)
+        stats.feature_count = entry.feature_count
+        stats.bytes = entry.length
+        stats.stop()
+        self._stats[entry.layer_id] = stats
+        self._entries.append(
+            LayerEntry(
+                entry.layer_id,
+                offset,
+                entry.length,
+                entry.feature_count,
+                entry.flags,
+                entry.subset,
+                list(entry.fields),
+                dict(entry.properties),
+            )
+        )
+
+    def write_snapshot(self, snapshot, previous=None):
+        """Write the record of a snapshot
+
+        If a reader on the previous version of the file is given, and the fingerprint of the features
+        matches their entry in it, the record written is replaced by the one of the previous file.
+        """
+        entry = self.write_record(
+            snapshot.layer_id,
+            snapshot.subset,
+            snapshot.fields,
+            snapshot.features(),
+            snapshot.geometry_precision,
+        )
+        previous_entry = self.matching_entry(snapshot, previous)
+        if (
+            previous_entry is not None
+            and previous_entry.feature_count == entry.feature_count
+            and previous_entry.properties.get("fingerprint") == entry.properties["fingerprint"]
+        ):
+            self.replace_record(entry, previous, previous_entry)
+
+    def replace_record(self, entry, reader, previous_entry):
+        """Replace the last record written by the record of another file, which holds the same features
+
+        The output is rewound to the start of the record, and truncated there as the other record
+        may be shorter, before the other record is copied.
+        """
+        log(f"Layer {entry.layer_id} is unchanged since the previous save")
+        if self._entries[-1] is not entry:
+            raise ValueError("Only the last record written can be replaced")
+        self._entries.pop()
+        if not self._file.resize(entry.offset) or not self._file.seek(entry.offset):
+            raise ValueError(f"Cannot write {self._filename}: {self._file.errorString()}")
+        # The features are copied again
+        self._progress_total += previous_entry.feature_count
+        self.copy_layer(reader, previous_entry)
+
+    def write_record(self, layer_id, ss, flds, features, precision=None):
+        """Write a layer record: header, field definitions and chunks of features, return its entry
+
+        The extent of the features, computed while they are written, is stored in the table of
+        contents. If precision (number of decimals) is given, the geometries are written in
+        compact blocks, with their coordinates rounded to it.
+        """
+        log("Writing layer " + layer_id)
         if not self._dstream:
-            raise ValueError("Layer stream not open for reading")
+            raise ValueError("Layer stream not open for writing")
         ds = self._dstream
-        dp = layer.dataProvider()
-        ss = layer.subsetString()
-        attr = dp.attributeIndexes()
-        ds.writeQString(layer.id())
+        flags = (self._flags | FLAG_COMPACT_GEOMETRY) if precision is not None else self._flags
+        stats = LayerStats(layer_id, WRITE)
+        entry = LayerEntry(layer_id, self._file.pos(), flags=flags, subset=ss)
+        ds.writeQString(layer_id)
         ds.writeQString(ss)
-        ds.writeInt16(len(attr))
-        flds = dp.fields()
-        fldnames = []
+        ds.writeInt16(flds.count())
+        field_types = []
         for fld in flds:
-            fldnames.append(fld.name())
-            ds.writeQString(fld.name())
-            field_type = fld.type()
-            if isinstance(field_type, QMetaType.Type):
-                field_type_value = int(field_type)
-            else:
-                field_type_value = int(field_type)
-            ds.writeInt16(field_type_value)
-            ds.writeQString(fld.typeName())
-            ds.writeInt16(int(fld.length()))
-            ds.writeInt16(int(fld.precision()))
-            ds.writeQString(fld.comment())
-
-        layer.setSubsetString("")
-        feats = layer.getFeatures()
-        for feat in feats:
-            ds.writeBool(True)
-            if attr:
-                for field in fldnames:
-                    try:
-                        ds.writeQVariant(feat[field])
-                    except KeyError:
-                        ds.writeQVariant(None)
+            field_types.append(int(fld.type()))
+            definition = self.field_definition(fld)
+            entry.fields.append(definition)
+            self.write_field(definition)
+        ds.writeUInt32(flags)
+
+        fingerprint = new_fingerprint()
+        extent = QgsRectangle()
+        extent.setMinimal()
+        rows = []
+        geometries = []
+        count = 0
+        # The features are fetched from the provider between the end of an iteration and the start of the next
+        fetched = perf_counter()
+        for feat in features:
+            start = perf_counter()
+            rows.append(self.feature_row(feat, len(field_types)))
+            middle = perf_counter()
             geom = feat.geometry()
-            if not geom:
-                ds.writeUInt32(0)
+            geometries.append(geom.asWkb() if geom else None)
+            if geom and not geom.isEmpty():
+                extent.combineExtentWith(geom.boundingBox())
+            end = perf_counter()
+            stats.provider_time += start - fetched
+            stats.attribute_time += middle - start
+            stats.geometry_time += end - middle
+            if len(rows) == self._chunk_size:
+                self.check_canceled()
+                self.update_fingerprint(fingerprint, rows, geometries, field_types)
+                data = self.encode_chunk(rows, geometries, field_types, flags, stats, precision)
+                self.write_chunk(data, len(rows))
+                self.advance(len(rows))
+                count += len(rows)
+                rows = []
+                geometries = []
+            fetched = perf_counter()
+        if rows:
+            self.check_canceled()
+            self.update_fingerprint(fingerprint, rows, geometries, field_types)
+            data = self.encode_chunk(rows, geometries, field_types, flags, stats, precision)
+            self.write_chunk(data, len(rows))
+            self.advance(len(rows))
+            count += len(rows)
+        # End of the chunks
+        ds.writeUInt32(0)
+
+        entry.feature_count = count
+        entry.properties["fingerprint"] = fingerprint.hexdigest()
+        if precision is not None:
+            entry.properties["precision"] = precision
+        if not extent.isNull():
+            entry.properties["extent"] = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
+        entry.length = self._file.pos() - entry.offset
+        self._entries.append(entry)
+
+        stats.feature_count = count
+        stats.bytes = entry.length
+        stats.stop()
+        self._stats[layer_id] = stats
+        log(f"Layer {layer_id} written: {stats}")
+        return entry
+
+    @staticmethod
+    def field_definition(fld):
+        """Return the (name, type, typename, length, precision, comment) tuple of a field"""
+        return fld.name(), int(fld.type()), fld.typeName(), int(fld.length()), int(fld.precision()), fld.comment()
+
+    def write_field(self, definition):
+        ds = self._dstream
+        name, field_type, typename, length, precision, comment = definition
+        ds.writeQString(name)
+        ds.writeInt16(field_type)
+        ds.writeQString(typename)
+        ds.writeInt16(length)
+        ds.writeInt16(precision)
+        ds.writeQString(comment)
+
+    @staticmethod
+    def new_chunk():
+        """Return an empty chunk buffer and the stream used to fill it"""
+        chunk = QByteArray()
+        stream = QDataStream(chunk, QIODevice.OpenModeFlag.WriteOnly)
+        stream.setVersion(QDataStream.Version.Qt_4_5)
+        return chunk, stream
+
+    def encode_chunk(self, rows, geometries, field_types, flags, stats=None, precision=None):
+        """Encode the attributes and geometries of a chunk of features, return the chunk payload
+
+        The time spent encoding the attributes and the geometries is added to stats (LayerStats), if given.
+        """
+        if stats is None:
+            stats = LayerStats(None, WRITE)
+        if flags & (FLAG_COLUMNAR | FLAG_COMPACT_GEOMETRY):
+            chunk, stream = self.new_chunk()
+            start = perf_counter()
+            if flags & FLAG_COLUMNAR:
+                encode_columns(stream, rows, field_types)
+            else:
+                for row in rows:
+                    for value in row:
+                        stream.writeQVariant(value)
+            middle = perf_counter()
+            if flags & FLAG_COMPACT_GEOMETRY:
+                block = encode_geometries(geometries, precision)
+                stream.writeUInt32(len(block))
+                stream.writeRawData(block)
+            else:
+                for wkb in geometries:
+                    self.write_geometry(stream, wkb)
+            stats.attribute_time += middle - start
+            stats.geometry_time += perf_counter() - middle
+            data = chunk.data()
+        else:
+            data = self.encode_rows(rows, geometries, stats)
+        return compress(data, flags, self._compression_level)
+
+    @staticmethod
+    def encode_rows(rows, geometries, stats=None):
+        """Return the uncompressed payload of a row chunk"""
+        chunk, stream = Writer.new_chunk()
+        start = perf_counter()
+        for row, wkb in zip(rows, geometries):
+            for value in row:
+                stream.writeQVariant(value)
+            middle = perf_counter()
+            Writer.write_geometry(stream, wkb)
+            end = perf_counter()
+            if stats is not None:
+                stats.attribute_time += middle - start
+                stats.geometry_time += end - middle
+            start = end
+        return chunk.data()
+
+    @staticmethod
+    def write_geometry(stream, wkb):
+        if wkb is None:
+            stream.writeUInt32(0)
+        else:
+            stream.writeUInt32(len(wkb))
+            stream.writeRawData(wkb)
+
+    def write_chunk(self, data, count):
+        ds = self._dstream
+        ds.writeUInt32(count)
+        ds.writeUInt32(len(data))
+        ds.writeUInt32(checksum(data))
+        ds.writeRawData(data)
+
+    def write_index(self):
+        """Write the table of contents at the end of the file"""
+        if not self._dstream:
+            raise ValueError("Layer stream not open for writing")
+        ds = self._dstream
+        index_offset = self._file.pos()
+        ds.writeUInt32(len(self._entries))
+        for entry in self._entries:
+            if self._journal_id:
+                entry.properties["journal"] = self._journal_id
+            else:
+                entry.properties.pop("journal", None)
+            if self._save_id:
+                entry.properties["save"] = self._save_id
             else:
-                wkb = geom.asWkb()
-                ds.writeUInt32(len(wkb))
-                ds.writeRawData(wkb)
-        ds.writeBool(False)
-        layer.setSubsetString(ss)
+                entry.properties.pop("save", None)
+            ds.writeQString(entry.layer_id)
+            ds.writeInt64(entry.offset)
+            ds.writeInt64(entry.length)
+            ds.writeInt64(entry.feature_count)
+            ds.writeUInt32(entry.flags)
+            ds.writeQString(entry.subset)
+            ds.writeInt16(len(entry.fields))
+            for definition in entry.fields:
+                self.write_field(definition)
+            ds.writeQVariant(entry.properties)
+        ds.writeInt64(index_offset)
+        ds.writeRawData(INDEX_MAGIC)
@@ -0,0 +1,106 @@
+"""Compare the size, write time and read time of the mldata file for each compression codec.
+
+Run it headless from a QGIS python environment:
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_compression.py --features 100000
+"""
+
+import argparse
+import math
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from qgis.core import QgsApplication, QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer  # noqa: E402
+
+from MemoryLayerSaver.reader import Reader  # noqa: E402
+from MemoryLayerSaver.writer import Writer  # noqa: E402
+
+FIELDS = "field=id:integer&field=name:string&field=category:string&field=value:double"
+CODECS = [(None, 0), ("zlib", 1), ("zlib", 6), ("zlib", 9), ("lzma", 1), ("lzma", 6)]
+
+
+def random_points(count):
+    x, y = random.uniform(-170, 170), random.uniform(-80, 80)
+    points = []
+    for _i in range(count):
+        x += random.uniform(-0.01, 0.01)
+        y += random.uniform(-0.01, 0.01)
+        points.append(QgsPointXY(x, y))
+    return points
+
+
+def random_polygon(vertices):
+    cx, cy = random.uniform(-170, 170), random.uniform(-80, 80)
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = random.uniform(0.5, 1)
+        ring.append(QgsPointXY(cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+    return QgsGeometry.fromPolygonXY([ring])
+
+
+GEOMETRIES = {
+    "Point": lambda: QgsGeometry.fromPointXY(random_points(1)[0]),
+    "LineString": lambda: QgsGeometry.fromPolylineXY(random_points(50)),
+    "Polygon": lambda: random_polygon(50),
+}
+
+
+def create_layer(geometry_type, count):
+    layer = QgsVectorLayer(f"{geometry_type}?crs=EPSG:4326&{FIELDS}", geometry_type, "memory")
+    dp = layer.dataProvider()
+    fields = dp.fields()
+    batch = []
+    for i in range(count):
+        feat = QgsFeature(fields)
+        feat.setAttributes([i, f"feature {i}", random.choice(["road", "river", "building"]), random.random()])
+        feat.setGeometry(GEOMETRIES[geometry_type]())
+        batch.append(feat)
+        if len(batch) >= 10000:
+            dp.addFeatures(batch)
+            batch = []
+    dp.addFeatures(batch)
+    return layer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=100000, help="Number of features of each layer")
+    args = parser.parse_args()
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir) / "bench.mldata")
+        for geometry_type in GEOMETRIES:
+            layer = create_layer(geometry_type, args.features)
+            for compression, level in CODECS:
+                start = time.perf_counter()
+                with Writer(filename, compression=compression, compression_level=level) as writer:
+                    writer.write_layers([layer])
+                write_time = time.perf_counter() - start
+                size = Path(filename).stat().st_size
+
+                layer.dataProvider().truncate()
+                start = time.perf_counter()
+                with Reader(filename) as reader:
+                    reader.read_layers([layer])
+                read_time = time.perf_counter() - start
+
+                codec = f"{compression} {level}" if compression else "none"
+                print(
+                    f"{geometry_type:<10} {codec:<7}: {size / 1e6:9.2f} MB, "
+                    f"write {write_time:7.2f} s, read {read_time:7.2f} s"
+                )
+
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Check that the pure python decoder returns the same features as the Reader, and compare their speed.
+
+Run it headless from a QGIS python environment:
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_decoder.py --features 100000
+
+The script exits with status 1 if the decoder and the Reader disagree on a feature.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from qgis.core import NULL, QgsApplication  # noqa: E402
+from qgis.PyQt.QtCore import QByteArray, QDate, QDateTime, QTime  # noqa: E402
+from synthetic import GEOMETRY_TYPES, create_layer  # noqa: E402
+
+from MemoryLayerSaver.decoder import DataFile  # noqa: E402
+from MemoryLayerSaver.reader import Reader  # noqa: E402
+from MemoryLayerSaver.writer import Writer  # noqa: E402
+
+WRITER_OPTIONS = {
+    "rows": {},
+    "columnar": {"columnar": True},
+    "zlib": {"compression": "zlib"},
+    "columnar+lzma": {"columnar": True, "compression": "lzma"},
+}
+
+
+def python_value(value):
+    """Convert a value read by the Reader to the type returned by the decoder"""
+    if value is None or value == NULL:
+        return None
+    if isinstance(value, QDateTime):
+        return value.toPyDateTime()
+    if isinstance(value, QDate):
+        return value.toPyDate()
+    if isinstance(value, QTime):
+        return value.toPyTime()
+    if isinstance(value, QByteArray):
+        return value.data()
+    return value
+
+
+def compare(layer, decoded):
+    """Return the list of differences between the features of the layer and the decoded features"""
+    errors = []
+    features = list(layer.dataProvider().getFeatures())
+    if len(features) != len(decoded):
+        return [f"{len(decoded)} features decoded, {len(features)} read"]
+    for feat, (attributes, wkb) in zip(features, decoded):
+        expected = [python_value(value) for value in feat.attributes()]
+        if expected != attributes:
+            errors.append(f"feature {feat.id()}: attributes {attributes} != {expected}")
+        geom = feat.geometry()
+        expected_wkb = bytes(geom.asWkb()) if not geom.isNull() else None
+        if expected_wkb != wkb:
+            errors.append(f"feature {feat.id()}: geometries differ")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=100000, help="Number of features of each layer")
+    args = parser.parse_args()
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir) / "bench.mldata")
+        for geometry_type in GEOMETRY_TYPES:
+            layer = create_layer(args.features, geometry_type, "mixed", 7, 20)
+            for name, options in WRITER_OPTIONS.items():
+                with Writer(filename, **options) as writer:
+                    writer.write_layers([layer])
+
+                layer.dataProvider().truncate()
+                start = time.perf_counter()
+                with Reader(filename) as reader:
+                    reader.read_layers([layer])
+                read_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                with DataFile(filename) as data:
+                    decoded = [
+                        (attributes, bytes(wkb) if wkb is not None else None)
+                        for attributes, wkb in data.layer(layer.id()).features()
+                    ]
+                decode_time = time.perf_counter() - start
+
+                errors = compare(layer, decoded)
+                failed = failed or bool(errors)
+                print(
+                    f"{geometry_type:<12} {name:<14}: Reader {read_time:7.2f} s, decoder {decode_time:7.2f} s, "
+                    f"{'OK' if not errors else f'{len(errors)} differences'}"
+                )
+                for error in errors[:10]:
+                    print("    " + error)
+
+    app.exitQgis()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
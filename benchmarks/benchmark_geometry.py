@@ -0,0 +1,136 @@
+"""Compare the size and the speed of the compact geometry encoding with WKB.
+
+The geometries have the shapes of the synthetic benchmark layers (see synthetic.py), but are built
+as WKB without QGIS, so this benchmark only requires python:
+
+    python benchmarks/benchmark_geometry.py --features 100000 --precision 7 3
+
+For each geometry type, the chunks are encoded as WKB (the size prefixed WKB of each feature, as
+in the row chunks), in the compact encoding without quantization, and with each precision. The
+sizes are also given after zlib compression of the chunks. The decoding times include the
+rebuilding of the WKB given to QgsGeometry.fromWkb.
+"""
+
+import argparse
+import math
+import random
+import struct
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from MemoryLayerSaver.geometry_codec import decode_geometries, encode_geometries  # noqa: E402
+from MemoryLayerSaver.mldata import DEFAULT_CHUNK_SIZE  # noqa: E402
+
+GEOMETRY_TYPES = ["Point", "LineString", "Polygon", "MultiPolygon"]
+
+UINT32 = struct.Struct(">I")
+
+
+def points_wkb(points):
+    return struct.pack(f"<I{2 * len(points)}d", len(points), *(c for point in points for c in point))
+
+
+def polygon_wkb(rings):
+    return struct.pack("<BII", 1, 3, len(rings)) + b"".join(points_wkb(ring) for ring in rings)
+
+
+def random_ring(rng, cx, cy, vertices):
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = rng.uniform(0.5, 1)
+        ring.append((cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+    ring.append(ring[0])
+    return ring
+
+
+def random_wkb(geometry_type, rng, vertices):
+    """Same geometries as synthetic.random_geometry, as WKB"""
+    cx, cy = rng.uniform(-170, 170), rng.uniform(-80, 80)
+    if geometry_type == "Point":
+        return struct.pack("<BIdd", 1, 1, cx, cy)
+    if geometry_type == "LineString":
+        points = []
+        for _i in range(max(2, vertices)):
+            cx += rng.uniform(-0.01, 0.01)
+            cy += rng.uniform(-0.01, 0.01)
+            points.append((cx, cy))
+        return struct.pack("<BI", 1, 2) + points_wkb(points)
+    if geometry_type == "Polygon":
+        return polygon_wkb([random_ring(rng, cx, cy, max(3, vertices))])
+    parts = [polygon_wkb([random_ring(rng, cx + 3 * k, cy, max(3, vertices // 3))]) for k in range(3)]
+    return struct.pack("<BII", 1, 6, len(parts)) + b"".join(parts)
+
+
+def chunks(geometries, chunk_size):
+    return [geometries[i : i + chunk_size] for i in range(0, len(geometries), chunk_size)]
+
+
+def encode_wkb(chunk):
+    return b"".join(UINT32.pack(len(wkb)) + wkb for wkb in chunk)
+
+
+def decode_wkb(data, count):
+    view = memoryview(data)
+    pos = 0
+    geometries = []
+    for _i in range(count):
+        (size,) = UINT32.unpack_from(view, pos)
+        geometries.append(view[pos + 4 : pos + 4 + size])
+        pos += 4 + size
+    return geometries
+
+
+def measure(geometries, chunk_size, encode, decode):
+    """Return the size, the compressed size, the encoding and the decoding times of the chunks"""
+    start = time.perf_counter()
+    blocks = [encode(chunk) for chunk in chunks(geometries, chunk_size)]
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for block, chunk in zip(blocks, chunks(geometries, chunk_size)):
+        decode(block, len(chunk))
+    decode_time = time.perf_counter() - start
+    size = sum(len(block) for block in blocks)
+    compressed = sum(len(zlib.compress(block, 6)) for block in blocks)
+    return size, compressed, encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=100000, help="Number of features per geometry type")
+    parser.add_argument("--geometries", nargs="+", default=GEOMETRY_TYPES, choices=GEOMETRY_TYPES)
+    parser.add_argument("--vertices", type=int, default=50, help="Vertices of the geometries")
+    parser.add_argument("--precision", type=int, nargs="+", default=[7, 3], help="Numbers of decimals")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Features per chunk")
+    args = parser.parse_args()
+
+    codecs = [("WKB", encode_wkb, decode_wkb), ("compact", encode_geometries, decode_geometries)]
+    for precision in args.precision:
+        codecs.append(
+            (
+                f"compact {precision}",
+                lambda chunk, precision=precision: encode_geometries(chunk, precision),
+                decode_geometries,
+            )
+        )
+
+    for geometry_type in args.geometries:
+        rng = random.Random(0)
+        geometries = [random_wkb(geometry_type, rng, args.vertices) for _i in range(args.features)]
+        print(f"{args.features} {geometry_type} ({args.vertices} vertices)")
+        reference = None
+        for name, encode, decode in codecs:
+            size, compressed, encode_time, decode_time = measure(geometries, args.chunk_size, encode, decode)
+            reference = reference or size
+            print(
+                f"    {name:<12}: {size / 1e6:9.2f} MB ({size / reference:6.1%}), zlib {compressed / 1e6:9.2f} MB | "
+                f"encode {encode_time:6.2f} s | decode {decode_time:6.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
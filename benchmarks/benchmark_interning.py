@@ -0,0 +1,122 @@
+"""Measure the memory used by a layer with categorical text fields once read, with and without interning.
+
+The layer has a few text fields whose values are taken from small sets of categories (status codes,
+class names...), the case where the intern tables of the Reader share the values of the features
+(see MemoryLayerSaver/interning.py). It is written once per attribute encoding (rows, and columnar
+whose string columns are dictionary encoded), then each file is read into an empty memory layer with
+each intern table capacity (0 disables the interning).
+
+Run it headless from a QGIS python environment:
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_interning.py --features 1000000
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_interning.py --encodings rows --capacities 0
+
+Peak is the growth of the resident set size during the read, steady is its growth once the read is
+over and the layer holds the features (Linux only). The memory freed by a case is not always returned
+to the system, so run one encoding and one capacity per process for exact figures.
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmark_suite import current_rss, peak_rss, reset_peak_rss  # noqa: E402
+from qgis.core import QgsApplication, QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer  # noqa: E402
+
+from MemoryLayerSaver.interning import DEFAULT_INTERN_CAPACITY  # noqa: E402
+from MemoryLayerSaver.reader import Reader  # noqa: E402
+from MemoryLayerSaver.writer import Writer  # noqa: E402
+
+ENCODINGS = ["rows", "columnar"]
+
+STATUSES = ["planned", "under construction", "in service", "out of service", "demolished"]
+
+
+def categorical_layer(count, field_count, categories, seed=0):
+    """Create a point layer whose text fields take their values from small sets of categories"""
+    uri = "Point?crs=EPSG:4326&field=id:integer" + "".join(f"&field=class_{i}:string" for i in range(field_count))
+    layer = QgsVectorLayer(uri, "categorical", "memory")
+    dp = layer.dataProvider()
+    fields = dp.fields()
+    rng = random.Random(seed)
+    # Each field has its own categories, the first one is a realistic status field
+    values = [STATUSES] + [[f"class {i}.{k}" for k in range(categories)] for i in range(1, field_count)]
+    batch = []
+    for i in range(count):
+        feat = QgsFeature(fields)
+        feat.setAttributes([i] + [rng.choice(values[k]) for k in range(field_count)])
+        feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(rng.uniform(-180, 180), rng.uniform(-90, 90))))
+        batch.append(feat)
+        if len(batch) >= 10000:
+            dp.addFeatures(batch)
+            batch = []
+    dp.addFeatures(batch)
+    return layer
+
+
+def read_case(filename, capacity, count):
+    """Read the file into an empty layer, return the duration and the peak and steady memory growths"""
+    layer = QgsVectorLayer("Point?crs=EPSG:4326", "categorical", "memory")
+    gc.collect()
+    reset_peak_rss()
+    before = current_rss()
+    start = time.perf_counter()
+    with Reader(filename, intern_capacity=capacity) as reader:
+        reader.read_layers([layer])
+    elapsed = time.perf_counter() - start
+    peak = max(0, peak_rss() - before)
+    gc.collect()
+    steady = max(0, current_rss() - before)
+    if layer.dataProvider().featureCount() != count:
+        raise RuntimeError(f"{layer.dataProvider().featureCount()} features read, {count} expected")
+    del layer
+    gc.collect()
+    return elapsed, peak, steady
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=500000, help="Number of features of the layer")
+    parser.add_argument("--fields", type=int, default=6, help="Number of text fields")
+    parser.add_argument("--categories", type=int, default=20, help="Number of categories per text field")
+    parser.add_argument("--encodings", nargs="+", default=ENCODINGS, choices=ENCODINGS)
+    parser.add_argument(
+        "--capacities", type=int, nargs="+", default=[0, DEFAULT_INTERN_CAPACITY], help="Intern table capacities"
+    )
+    args = parser.parse_args()
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = categorical_layer(args.features, args.fields, args.categories)
+        filenames = {}
+        for encoding in args.encodings:
+            filenames[encoding] = str(Path(tmpdir) / f"{encoding}.mldata")
+            with Writer(filenames[encoding], columnar=encoding == "columnar") as writer:
+                writer.write_layers([source])
+        del source
+        gc.collect()
+
+        print(f"{args.features} features, {args.fields} text fields of {args.categories} categories")
+        for encoding in args.encodings:
+            for capacity in args.capacities:
+                elapsed, peak, steady = read_case(filenames[encoding], capacity, args.features)
+                print(
+                    f"    {encoding:<8} capacity {capacity:>6}: read {elapsed:6.2f} s | "
+                    f"peak {peak / 1e6:8.1f} MB | steady {steady / 1e6:8.1f} MB"
+                )
+
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Measure the tracking, save and load of a project with thousands of small scratch layers.
+
+A project is filled with small memory layers (5000 by default) which are tracked by the plugin. The script
+measures the registration of the layers when they are added to the project, the lookup of the saved layers
+(the registry of the plugin, compared with a scan of all the layers of the project), a full save, the save
+of an unchanged file (the layers are copied from the previous file), a full load, the registration of the
+layers in the lazy loader and the removal of the layers from the project.
+
+Run it headless from a QGIS python environment:
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_layers.py
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_layers.py --layers 20000 --features 10
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from qgis.core import QgsApplication, QgsFeedback, QgsProject  # noqa: E402
+from synthetic import GEOMETRY_TYPES, create_layer  # noqa: E402
+
+from MemoryLayerSaver.lazy_loader import LazyLoader  # noqa: E402
+from MemoryLayerSaver.memory_layer_saver import MemoryLayerSaver  # noqa: E402
+from MemoryLayerSaver.reader import Reader  # noqa: E402
+from MemoryLayerSaver.settings import Settings  # noqa: E402
+
+
+def timed(function):
+    """Run function, return its result and its duration (s)"""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def scan_layers():
+    """The saved layers found by a scan of all the layers of the project, as before the registry"""
+    return [layer for layer in QgsProject.instance().mapLayers().values() if Settings.is_saved_layer(layer)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=5000, help="Number of scratch layers")
+    parser.add_argument("--features", type=int, default=5, help="Features per layer")
+    parser.add_argument("--geometry", default="Point", choices=GEOMETRY_TYPES)
+    parser.add_argument("--lookups", type=int, default=100, help="Lookups of the saved layers")
+    args = parser.parse_args()
+
+    app = QgsApplication([], False)
+    app.initQgis()
+    project = QgsProject.instance()
+
+    plugin = MemoryLayerSaver()
+    layers = [create_layer(args.features, args.geometry, seed=i) for i in range(args.layers)]
+    _result, elapsed = timed(lambda: project.addMapLayers(layers))
+    print(f"{args.layers} layers of {args.features} {args.geometry} features")
+    print(f"    add to the project : {elapsed:8.3f} s")
+
+    _result, registry_time = timed(lambda: [plugin.memory_layers() for _i in range(args.lookups)])
+    _result, scan_time = timed(lambda: [scan_layers() for _i in range(args.lookups)])
+    print(f"    lookup (registry)  : {1000 * registry_time / args.lookups:8.3f} ms")
+    print(f"    lookup (scan)      : {1000 * scan_time / args.lookups:8.3f} ms")
+    saved = plugin.memory_layers()
+    if len(saved) != args.layers:
+        raise RuntimeError(f"{len(saved)} layers in the registry, {args.layers} expected")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir) / "layers.mldata")
+        # All the layers were flagged as modified when they were added to the project
+        _result, elapsed = timed(lambda: plugin.write_layers(filename, saved, feedback=QgsFeedback()))
+        print(f"    full save          : {elapsed:8.3f} s ({Path(filename).stat().st_size / 1e6:.2f} MB)")
+        # Nothing was modified since the full save, every layer is checked against its previous record
+        plugin.modified_layers = set()
+        _result, elapsed = timed(lambda: plugin.write_layers(filename, saved, feedback=QgsFeedback()))
+        print(f"    unchanged save     : {elapsed:8.3f} s")
+        # A modified layer, all the others are copied from the previous file
+        saved[0].dataProvider().truncate()
+        plugin.modified_layers = {saved[0].id()}
+        _result, elapsed = timed(lambda: plugin.write_layers(filename, saved, feedback=QgsFeedback()))
+        print(f"    one modified layer : {elapsed:8.3f} s")
+
+        for layer in saved:
+            layer.dataProvider().truncate()
+
+        def read():
+            with Reader(filename) as reader:
+                reader.read_layers(saved)
+
+        _result, elapsed = timed(read)
+        print(f"    full load          : {elapsed:8.3f} s")
+
+        for layer in saved:
+            layer.dataProvider().truncate()
+        # Hide the layers so that none of them is loaded when it is registered
+        for node in project.layerTreeRoot().findLayers():
+            node.setItemVisibilityChecked(False)
+        lazy_loader = LazyLoader()
+
+        def register():
+            with Reader(filename) as reader:
+                lazy_loader.register_layers(reader, saved)
+
+        _result, elapsed = timed(register)
+        print(f"    lazy registration  : {elapsed:8.3f} s")
+        lazy_loader.clear()
+        lazy_loader.unload()
+
+    _result, elapsed = timed(project.removeAllMapLayers)
+    print(f"    remove all layers  : {elapsed:8.3f} s")
+    if plugin.memory_layers():
+        raise RuntimeError("Layers left in the registry")
+    plugin.detach()
+
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
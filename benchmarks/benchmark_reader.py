@@ -0,0 +1,71 @@
+"""Measure the reading throughput of the Reader for several batch sizes.
+
+Run it headless from a QGIS python environment:
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_reader.py --features 2000000
+
+A batch size of 1 reproduces the former behaviour (one addFeatures call per feature).
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from qgis.core import QgsApplication, QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer  # noqa: E402
+
+from MemoryLayerSaver.reader import Reader  # noqa: E402
+from MemoryLayerSaver.writer import Writer  # noqa: E402
+
+
+def point_layer(count):
+    uri = "Point?crs=EPSG:4326&field=id:integer&field=name:string&field=value:double"
+    layer = QgsVectorLayer(uri, "bench", "memory")
+    dp = layer.dataProvider()
+    fields = dp.fields()
+    batch = []
+    for i in range(count):
+        feat = QgsFeature(fields)
+        feat.setAttributes([i, f"feature {i}", random.random()])
+        feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(random.uniform(-180, 180), random.uniform(-90, 90))))
+        batch.append(feat)
+        if len(batch) >= 10000:
+            dp.addFeatures(batch)
+            batch = []
+    dp.addFeatures(batch)
+    return layer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=200000, help="Number of features of the layer")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    source = point_layer(args.features)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir) / "bench.mldata")
+        with Writer(filename) as writer:
+            writer.write_layers([source])
+
+        for batch_size in args.batch_sizes:
+            # Empty the layer so that it can be read again
+            source.dataProvider().truncate()
+            start = time.perf_counter()
+            with Reader(filename, batch_size) as reader:
+                reader.read_layers([source])
+            elapsed = time.perf_counter() - start
+            print(f"batch size {batch_size:>7}: {elapsed:8.2f} s, {source.featureCount() / elapsed:12.0f} features/s")
+
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Measure the throughput, file size and peak memory of the Writer and the Reader on synthetic layers.
+
+Each case generates a memory layer (feature count, geometry type, vertices per geometry, field mix and
+count, subset string), writes it with Writer.write_layers and reads it back with Reader.read_layers.
+
+Run it headless from a QGIS python environment:
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_suite.py
+    QT_QPA_PLATFORM=offscreen python benchmarks/benchmark_suite.py --features 10000 1000000 --geometries Point
+
+The results can be saved with --output and compared with a previous run with --baseline: the script
+exits with status 1 if the throughput of a case dropped by more than --tolerance.
+Peak memory is the growth of the resident set size during the operation (Linux only).
+"""
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from qgis.core import QgsApplication  # noqa: E402
+from synthetic import FIELD_MIXES, GEOMETRY_TYPES, create_layer  # noqa: E402
+
+from MemoryLayerSaver.reader import Reader  # noqa: E402
+from MemoryLayerSaver.settings import GEOMETRY_PRECISION_KEY  # noqa: E402
+from MemoryLayerSaver.writer import Writer  # noqa: E402
+
+SUBSETS = {"none": "", "half": "$id % 2 = 0"}
+
+
+def current_rss():
+    """Resident set size of the process, in bytes"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the process (Linux >= 4.0), return False if not supported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Peak resident set size of the process since the last reset, in bytes"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(function):
+    """Run function, return its duration (s) and the growth of the resident set size (bytes)"""
+    reset_peak_rss()
+    before = current_rss()
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    return elapsed, max(0, peak_rss() - before)
+
+
+def run_case(filename, case, writer_options, precision=None):
+    layer = create_layer(
+        case["features"],
+        case["geometry"],
+        case["fields"],
+        case["field_count"],
+        case["vertices"],
+    )
+    layer.setSubsetString(SUBSETS[case["subset"]])
+    if precision is not None:
+        layer.setCustomProperty(GEOMETRY_PRECISION_KEY, precision)
+
+    def write():
+        with Writer(filename, **writer_options) as writer:
+            writer.write_layers([layer])
+
+    def read():
+        with Reader(filename) as reader:
+            reader.read_layers([layer])
+
+    write_time, write_memory = measure(write)
+    size = Path(filename).stat().st_size
+    # Empty the layer so that it can be read again
+    layer.dataProvider().truncate()
+    read_time, read_memory = measure(read)
+    if layer.dataProvider().featureCount() != case["features"]:
+        raise RuntimeError(f"{layer.dataProvider().featureCount()} features read, {case['features']} expected")
+
+    return {
+        "size": size,
+        "write_time": write_time,
+        "write_throughput": case["features"] / write_time,
+        "write_memory": write_memory,
+        "read_time": read_time,
+        "read_throughput": case["features"] / read_time,
+        "read_memory": read_memory,
+    }
+
+
+def case_name(case):
+    return "{features} {geometry}/{vertices} {fields}x{field_count} subset={subset}".format(**case)
+
+
+def regressions(results, baseline, tolerance):
+    """Return the cases whose throughput dropped by more than tolerance compared to the baseline"""
+    previous = {result["name"]: result for result in baseline}
+    slower = []
+    for result in results:
+        reference = previous.get(result["name"])
+        if reference is None:
+            continue
+        for key in ("write_throughput", "read_throughput"):
+            if result[key] < (1 - tolerance) * reference[key]:
+                slower.append(f"{result['name']}: {key} {result[key]:.0f} < {reference[key]:.0f}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, nargs="+", default=[1000, 100000], help="Feature counts")
+    parser.add_argument("--geometries", nargs="+", default=GEOMETRY_TYPES, choices=GEOMETRY_TYPES)
+    parser.add_argument("--vertices", type=int, nargs="+", default=[20, 200], help="Vertices of the geometries")
+    parser.add_argument("--fields", nargs="+", default=list(FIELD_MIXES), choices=list(FIELD_MIXES))
+    parser.add_argument("--field-counts", type=int, nargs="+", default=[7], help="Number of fields")
+    parser.add_argument("--subsets", nargs="+", default=list(SUBSETS), choices=list(SUBSETS))
+    parser.add_argument("--columnar", action="store_true", help="Use the columnar attribute encoding")
+    parser.add_argument("--compression", choices=["zlib", "lzma"], help="Compress the chunks")
+    parser.add_argument("--compact-geometry", action="store_true", help="Use the compact geometry encoding")
+    parser.add_argument("--precision", type=int, help="Round the coordinates to this number of decimals")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed throughput drop (default 0.2)")
+    args = parser.parse_args()
+
+    writer_options = {
+        "columnar": args.columnar,
+        "compression": args.compression,
+        "compact_geometry": args.compact_geometry,
+    }
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = str(Path(tmpdir) / "bench.mldata")
+        for features, geometry, vertices, fields, field_count, subset in itertools.product(
+            args.features, args.geometries, args.vertices, args.fields, args.field_counts, args.subsets
+        ):
+            # The vertex count is meaningless for points and layers without geometry
+            if geometry in ("Point", "None") and vertices != args.vertices[0]:
+                continue
+            case = {
+                "features": features,
+                "geometry": geometry,
+                "vertices": vertices if geometry not in ("Point", "None") else 1,
+                "fields": fields,
+                "field_count": field_count,
+                "subset": subset,
+            }
+            result = {"name": case_name(case), **case, **run_case(filename, case, writer_options, args.precision)}
+            results.append(result)
+            print(
+                f"{result['name']:<50}: {result['size'] / 1e6:9.2f} MB | "
+                f"write {result['write_throughput']:10.0f} f/s {result['write_memory'] / 1e6:8.1f} MB | "
+                f"read {result['read_throughput']:10.0f} f/s {result['read_memory'] / 1e6:8.1f} MB"
+            )
+
+    app.exitQgis()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for line in slower:
+            print("Regression: " + line)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
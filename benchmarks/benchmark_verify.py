@@ -0,0 +1,81 @@
+"""Compare the speed of the verification of an mldata file with the speed of reading it.
+
+The file is generated with the pure python encoder, so this benchmark does not require QGIS:
+
+    python benchmarks/benchmark_verify.py --size 2000
+
+The verification only hashes the chunks, its throughput should be close to the read throughput.
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from MemoryLayerSaver.encoder import FIELD_DOUBLE, FIELD_LONGLONG, FIELD_STRING, DataFileWriter  # noqa: E402
+from MemoryLayerSaver.verify import verify_file  # noqa: E402
+
+FIELDS = [
+    ("id", FIELD_LONGLONG, "int8", 0, 0, ""),
+    ("name", FIELD_STRING, "string", 0, 0, ""),
+    ("value", FIELD_DOUBLE, "double", 0, 0, ""),
+]
+
+
+def linestring_wkb(vertices):
+    x, y = random.uniform(-170, 170), random.uniform(-80, 80)
+    coordinates = []
+    for _i in range(vertices):
+        x += random.uniform(-0.01, 0.01)
+        y += random.uniform(-0.01, 0.01)
+        coordinates += (x, y)
+    return struct.pack(f"<BII{2 * vertices}d", 1, 2, vertices, *coordinates)
+
+
+def features(count, vertices):
+    # A few distinct geometries are enough, only the size of the file matters
+    geometries = [linestring_wkb(vertices) for _i in range(100)]
+    for i in range(count):
+        yield [i, f"feature {i}", i / 3], geometries[i % len(geometries)]
+
+
+def read_file(path, block_size=1 << 20):
+    with open(path, "rb", buffering=0) as f:
+        while f.read(block_size):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=500, help="Approximate size of the file in MB")
+    parser.add_argument("--vertices", type=int, default=50, help="Number of vertices of the geometries")
+    args = parser.parse_args()
+
+    feature_size = 9 + 16 * args.vertices + 80
+    count = args.size * 1000000 // feature_size
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "bench.mldata"
+        start = time.perf_counter()
+        with DataFileWriter(path) as writer:
+            writer.write_layer("layer", FIELDS, features(count, args.vertices))
+        size = os.path.getsize(path)
+        print(f"{count} features, {size / 1e6:.0f} MB written in {time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        read_file(path)
+        read_time = time.perf_counter() - start
+        print(f"Read:   {read_time:7.2f} s, {size / 1e6 / read_time:8.0f} MB/s")
+
+        report = verify_file(path)
+        status = "OK" if report.ok else "damaged"
+        print(f"Verify: {report.elapsed:7.2f} s, {report.throughput / 1e6:8.0f} MB/s ({status})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Generation of synthetic memory layers for the benchmarks.
+
+The layers are generated with a fixed random seed, so that successive runs measure the same data.
+"""
+
+import math
+import random
+
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+from qgis.PyQt.QtCore import QDate, QDateTime
+
+# Field mixes: list of (name prefix, memory provider type) repeated to reach the field count
+FIELD_MIXES = {
+    "numeric": [("int", "integer"), ("big", "int8"), ("real", "double")],
+    "text": [("name", "string"), ("category", "string")],
+    "mixed": [
+        ("int", "integer"),
+        ("name", "string"),
+        ("real", "double"),
+        ("category", "string"),
+        ("flag", "boolean"),
+        ("day", "date"),
+        ("time", "datetime"),
+    ],
+}
+
+GEOMETRY_TYPES = ["Point", "LineString", "Polygon", "MultiPolygon", "None"]
+
+CATEGORIES = ["road", "river", "building", "forest", "lake", "railway"]
+
+
+def field_specs(mix, count):
+    """Return the (name, type) of count fields taken from the field mix"""
+    pattern = FIELD_MIXES[mix]
+    return [(f"{pattern[i % len(pattern)][0]}_{i}", pattern[i % len(pattern)][1]) for i in range(count)]
+
+
+def random_value(field_type, rng, i):
+    # One value out of ten is NULL
+    if rng.random() < 0.1:
+        return None
+    if field_type == "integer":
+        return rng.randint(-1000000, 1000000)
+    if field_type == "int8":
+        return rng.randint(-(2**40), 2**40)
+    if field_type == "double":
+        return rng.uniform(-1000, 1000)
+    if field_type == "boolean":
+        return rng.random() < 0.5
+    if field_type == "date":
+        return QDate(2000, 1, 1).addDays(rng.randint(0, 9000))
+    if field_type == "datetime":
+        return QDateTime(QDate(2000, 1, 1).addDays(rng.randint(0, 9000)))
+    if field_type == "string":
+        # Low cardinality categories and unique names
+        return rng.choice(CATEGORIES) if rng.random() < 0.5 else f"feature {i}"
+    raise ValueError("Unknown field type " + field_type)
+
+
+def random_ring(rng, cx, cy, vertices):
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        radius = rng.uniform(0.5, 1)
+        ring.append(QgsPointXY(cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
+    ring.append(ring[0])
+    return ring
+
+
+def random_geometry(geometry_type, rng, vertices):
+    cx, cy = rng.uniform(-170, 170), rng.uniform(-80, 80)
+    if geometry_type == "Point":
+        return QgsGeometry.fromPointXY(QgsPointXY(cx, cy))
+    if geometry_type == "LineString":
+        points = []
+        for _i in range(max(2, vertices)):
+            cx += rng.uniform(-0.01, 0.01)
+            cy += rng.uniform(-0.01, 0.01)
+            points.append(QgsPointXY(cx, cy))
+        return QgsGeometry.fromPolylineXY(points)
+    if geometry_type == "Polygon":
+        return QgsGeometry.fromPolygonXY([random_ring(rng, cx, cy, max(3, vertices))])
+    if geometry_type == "MultiPolygon":
+        return QgsGeometry.fromMultiPolygonXY(
+            [[random_ring(rng, cx + 3 * k, cy, max(3, vertices // 3))] for k in range(3)]
+        )
+    return None
+
+
+def create_layer(feature_count, geometry_type="Point", field_mix="mixed", field_count=7, vertices=50, seed=0):
+    """Create a memory layer filled with random features"""
+    fields = field_specs(field_mix, field_count)
+    uri = f"{geometry_type}?crs=EPSG:4326" + "".join(f"&field={name}:{ftype}" for name, ftype in fields)
+    layer = QgsVectorLayer(uri, f"{geometry_type} {field_mix}", "memory")
+    dp = layer.dataProvider()
+    qgs_fields = dp.fields()
+    rng = random.Random(seed)
+    batch = []
+    for i in range(feature_count):
+        feat = QgsFeature(qgs_fields)
+        feat.setAttributes([random_value(ftype, rng, i) for _name, ftype in fields])
+        geometry = random_geometry(geometry_type, rng, vertices)
+        if geometry is not None:
+            feat.setGeometry(geometry)
+        batch.append(feat)
+        if len(batch) >= 10000:
+            dp.addFeatures(batch)
+            batch = []
+    dp.addFeatures(batch)
+    layer.updateExtents()
+    return layer
@@ -0,0 +1,58 @@
+"""Decoding of the QDateTime values written by QDataStream (Qt_4_5)"""
+
+import datetime
+import os
+import struct
+import time
+
+import pytest
+
+from MemoryLayerSaver.decoder import (
+    JULIAN_DAY_OFFSET,
+    SPEC_LOCAL,
+    SPEC_OFFSET_FROM_UTC,
+    SPEC_TIME_ZONE,
+    SPEC_UTC,
+    Stream,
+)
+
+UTC = datetime.timezone.utc
+# 2024-07-01 12:34:56.789 UTC
+STORED = datetime.datetime(2024, 7, 1, 12, 34, 56, 789000, tzinfo=UTC)
+
+
+def qdatetime(value, spec):
+    """Encode an aware datetime as QDataStream does: UTC date (julian day), UTC time (msecs) and spec"""
+    value = value.astimezone(UTC)
+    msecs = ((value.hour * 60 + value.minute) * 60 + value.second) * 1000 + value.microsecond // 1000
+    return struct.pack(">IIb", value.toordinal() + JULIAN_DAY_OFFSET, msecs, spec)
+
+
+@pytest.fixture(autouse=True)
+def new_york():
+    previous = os.environ.get("TZ")
+    os.environ["TZ"] = "America/New_York"
+    time.tzset()
+    yield
+    if previous is None:
+        os.environ.pop("TZ", None)
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+@pytest.mark.parametrize("spec", [SPEC_LOCAL, 0, 1])
+def test_local_datetimes(spec):
+    # Read back in local time (EDT, UTC-4), as QDateTime.toPyDateTime does
+    assert Stream(qdatetime(STORED, spec)).qdatetime() == datetime.datetime(2024, 7, 1, 8, 34, 56, 789000)
+
+
+@pytest.mark.parametrize("spec", [SPEC_UTC, SPEC_OFFSET_FROM_UTC, SPEC_TIME_ZONE])
+def test_utc_datetimes(spec):
+    value = Stream(qdatetime(STORED, spec)).qdatetime()
+    assert value == STORED
+    assert value.tzinfo is UTC
+
+
+def test_null_datetime():
+    assert Stream(struct.pack(">IIb", 0, 0xFFFFFFFF, SPEC_LOCAL)).qdatetime() is None
@@ -0,0 +1,183 @@
+"""Round trips of layers written by the pure python encoder and read by the pure python decoder"""
+
+import datetime
+import os
+import stat
+import struct
+import sys
+import time
+
+import pytest
+
+from MemoryLayerSaver.decoder import DataFile
+from MemoryLayerSaver.encoder import (
+    FIELD_BOOL,
+    FIELD_BYTEARRAY,
+    FIELD_DATE,
+    FIELD_DATETIME,
+    FIELD_DOUBLE,
+    FIELD_INT,
+    FIELD_LIST,
+    FIELD_LONGLONG,
+    FIELD_STRING,
+    FIELD_STRINGLIST,
+    FIELD_TIME,
+    DataFileWriter,
+    fingerprint_features,
+)
+from MemoryLayerSaver.mldata import new_fingerprint
+
+FIELDS = [
+    ("flag", FIELD_BOOL, "boolean", 0, 0, ""),
+    ("count", FIELD_INT, "integer", 10, 0, "an integer"),
+    ("big", FIELD_LONGLONG, "int8", 20, 0, ""),
+    ("value", FIELD_DOUBLE, "double", 20, 6, ""),
+    ("items", FIELD_LIST, "list", 0, 0, ""),
+    ("name", FIELD_STRING, "string", 255, 0, ""),
+    ("tags", FIELD_STRINGLIST, "stringlist", 0, 0, ""),
+    ("blob", FIELD_BYTEARRAY, "binary", 0, 0, ""),
+    ("day", FIELD_DATE, "date", 0, 0, ""),
+    ("hour", FIELD_TIME, "time", 0, 0, ""),
+    ("local", FIELD_DATETIME, "datetime", 0, 0, ""),
+    ("utc", FIELD_DATETIME, "datetime", 0, 0, ""),
+]
+
+UTC = datetime.timezone.utc
+
+
+def point(x, y):
+    return struct.pack("=BIdd", sys.byteorder == "little", 1, x, y)
+
+
+def features(count):
+    for i in range(count):
+        attributes = [
+            i % 2 == 0,
+            i - 5,
+            2**40 + i,
+            i / 3,
+            [i, "text", 1.5],
+            f"name {i}",
+            ["a", f"tag {i}"],
+            bytes([i % 256]) * 3,
+            datetime.date(2020, 1, 1) + datetime.timedelta(days=i),
+            datetime.time(12, 30, i % 60, 250000),
+            datetime.datetime(2024, 6, 15, 1, 30) + datetime.timedelta(hours=i),
+            datetime.datetime(2024, 10, 27, 0, 45, tzinfo=UTC) + datetime.timedelta(minutes=i),
+        ]
+        yield attributes, point(i * 0.5, -i * 0.25)
+    # NULL values and no geometry
+    yield [None] * len(FIELDS), None
+
+
+def round_trip(filename, fields, rows, **options):
+    precision = options.pop("precision", None)
+    with DataFileWriter(filename, chunk_size=7, **options) as writer:
+        writer.write_layer("layer_1", fields, rows, subset='"count" > 0', precision=precision)
+    with DataFile(filename) as data:
+        layer = data.layer("layer_1")
+        assert layer.fields == fields
+        assert layer.subset == '"count" > 0'
+        return [(attributes, bytes(wkb) if wkb is not None else None) for attributes, wkb in layer.features()]
+
+
+@pytest.fixture
+def timezone():
+    """Set the local time zone of the process, the previous one is restored after the test"""
+    previous = os.environ.get("TZ")
+
+    def set_timezone(name):
+        os.environ["TZ"] = name
+        time.tzset()
+
+    yield set_timezone
+    if previous is None:
+        os.environ.pop("TZ", None)
+    else:
+        os.environ["TZ"] = previous
+    time.tzset()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"compression": "zlib"}, {"compression": "lzma"}, {"compact_geometry": True}, {"precision": 6}],
+)
+def test_all_field_types(tmp_path, options):
+    rows = list(features(20))
+    assert round_trip(tmp_path / "layers.mldata", FIELDS, rows, **options) == rows
+
+
+@pytest.mark.parametrize("name", ["UTC", "Europe/Paris", "America/St_Johns", "Pacific/Chatham", "Asia/Kolkata"])
+def test_datetimes_in_local_time_zone(tmp_path, timezone, name):
+    timezone(name)
+    rows = list(features(48))
+    decoded = round_trip(tmp_path / "layers.mldata", FIELDS, rows)
+    # Local date times are read back as naive datetimes, the others in UTC
+    assert [attributes[10] for attributes, _wkb in decoded] == [attributes[10] for attributes, _wkb in rows]
+    assert [attributes[11] for attributes, _wkb in decoded] == [attributes[11] for attributes, _wkb in rows]
+    assert all(attributes[11].tzinfo is UTC for attributes, _wkb in decoded[:-1])
+
+
+def test_datetimes_written_in_utc(tmp_path, timezone):
+    # The same instant written from two time zones is stored identically, and read back in the local time zone
+    timezone("Europe/Paris")
+    with DataFileWriter(tmp_path / "paris.mldata") as writer:
+        writer.write_layer("layer_1", FIELDS[10:11], [([datetime.datetime(2024, 7, 1, 14)], None)])
+    timezone("America/New_York")
+    with DataFileWriter(tmp_path / "new_york.mldata") as writer:
+        writer.write_layer("layer_1", FIELDS[10:11], [([datetime.datetime(2024, 7, 1, 8)], None)])
+    assert (tmp_path / "paris.mldata").read_bytes() == (tmp_path / "new_york.mldata").read_bytes()
+    with DataFile(tmp_path / "paris.mldata") as data:
+        [(attributes, _wkb)] = data.layer("layer_1").features()
+    assert attributes == [datetime.datetime(2024, 7, 1, 8)]
+
+
+def test_aware_datetimes_converted_to_utc(tmp_path, timezone):
+    timezone("Asia/Tokyo")
+    value = datetime.datetime(2024, 1, 1, 9, tzinfo=datetime.timezone(datetime.timedelta(hours=9)))
+    [(attributes, _wkb)] = round_trip(tmp_path / "layers.mldata", FIELDS[11:], [([value], None)])
+    assert attributes == [datetime.datetime(2024, 1, 1, tzinfo=UTC)]
+
+
+@pytest.mark.parametrize("value", [datetime.datetime(1, 1, 2, 3, 4, 5), datetime.datetime(9999, 12, 30, 23, 59)])
+def test_datetimes_out_of_platform_range(tmp_path, timezone, value):
+    timezone("Europe/Paris")
+    [(attributes, _wkb)] = round_trip(tmp_path / "layers.mldata", FIELDS[10:11], [([value], None)])
+    assert abs(attributes[0] - value) <= datetime.timedelta(hours=1)
+
+
+def test_new_file_mode(tmp_path):
+    filename = tmp_path / "layers.mldata"
+    round_trip(filename, FIELDS, [])
+    umask = os.umask(0)
+    os.umask(umask)
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o666 & ~umask
+
+
+def test_replaced_file_mode(tmp_path):
+    filename = tmp_path / "layers.mldata"
+    round_trip(filename, FIELDS, [])
+    os.chmod(filename, 0o640)
+    round_trip(filename, FIELDS, list(features(3)))
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o640
+
+
+def fingerprint_of(rows):
+    fingerprint = new_fingerprint()
+    field_types = [definition[1] for definition in FIELDS]
+    fingerprint_features(fingerprint, [attributes for attributes, _wkb in rows], [wkb for _a, wkb in rows], field_types)
+    return fingerprint.hexdigest()
+
+
+@pytest.mark.parametrize(
+    "options", [{"chunk_size": 3}, {"chunk_size": 50, "compression": "lzma"}, {"compact_geometry": True}]
+)
+def test_fingerprint_of_decoded_features(tmp_path, options):
+    # The fingerprint of the features read back, as computed by the Writer, is the one stored in the file
+    rows = list(features(20))
+    with DataFileWriter(tmp_path / "layers.mldata", **options) as writer:
+        entry = writer.write_layer("layer_1", FIELDS, rows)
+    with DataFile(tmp_path / "layers.mldata") as data:
+        decoded = list(data.layer("layer_1").features())
+    assert entry.properties["fingerprint"] == fingerprint_of(decoded)
+    assert entry.properties["fingerprint"] != fingerprint_of(rows[1:])
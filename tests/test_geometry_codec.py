@@ -0,0 +1,128 @@
+"""Round trips of the compact geometry blocks"""
+
+import math
+import struct
+import sys
+
+import pytest
+
+from MemoryLayerSaver.geometry_codec import (
+    MAX_PRECISION,
+    decode_geometries,
+    encode_geometries,
+    round_coordinates,
+)
+from MemoryLayerSaver.mldata import GEOMETRY_DOUBLE
+
+NATIVE = sys.byteorder == "little"
+
+
+def point(x, y):
+    return struct.pack("=BIdd", NATIVE, 1, x, y)
+
+
+def linestring(coordinates):
+    return struct.pack(f"=BII{2 * len(coordinates)}d", NATIVE, 2, len(coordinates), *sum(coordinates, ()))
+
+
+def polygon(rings):
+    parts = [struct.pack("=BII", NATIVE, 3, len(rings))]
+    for ring in rings:
+        parts.append(struct.pack(f"=I{2 * len(ring)}d", len(ring), *sum(ring, ())))
+    return b"".join(parts)
+
+
+def multipoint(points):
+    return struct.pack("=BII", NATIVE, 4, len(points)) + b"".join(point(x, y) for x, y in points)
+
+
+def coordinates(wkb):
+    """Return the coordinates of a WKB produced by the helpers above"""
+    wkb_type = struct.unpack_from("=I", wkb, 1)[0]
+    if wkb_type == 1:
+        return list(struct.unpack_from("=2d", wkb, 5))
+    if wkb_type == 2:
+        count = struct.unpack_from("=I", wkb, 5)[0]
+        return list(struct.unpack_from(f"={2 * count}d", wkb, 9))
+    if wkb_type == 3:
+        values = []
+        pos = 9
+        for _i in range(struct.unpack_from("=I", wkb, 5)[0]):
+            count = struct.unpack_from("=I", wkb, pos)[0]
+            values += struct.unpack_from(f"={2 * count}d", wkb, pos + 4)
+            pos += 4 + 16 * count
+        return values
+    values = []
+    for i in range(struct.unpack_from("=I", wkb, 5)[0]):
+        values += coordinates(wkb[9 + 21 * i : 30 + 21 * i])
+    return values
+
+
+GEOMETRIES = [
+    point(2.3522219, 48.856614),
+    None,
+    linestring([(0.0, 0.0), (1.123456789, -2.5), (1000000.75, 3.0e-7)]),
+    polygon([[(0, 0), (10, 0), (10, 10), (0, 0)], [(1, 1), (2, 1), (2, 2), (1, 1)]]),
+    multipoint([(-179.999999, -89.5), (179.999999, 89.5)]),
+    point(-123456789.123, 987654321.987),
+]
+
+
+def round_trip(geometries, precision):
+    block = encode_geometries(geometries, precision)
+    return block, [bytes(wkb) if wkb is not None else None for wkb in decode_geometries(block, len(geometries))]
+
+
+def test_doubles():
+    _block, decoded = round_trip(GEOMETRIES, None)
+    assert decoded == GEOMETRIES
+
+
+@pytest.mark.parametrize("precision", [-MAX_PRECISION, -3, 0, 1, 6, 9, MAX_PRECISION])
+def test_quantized(precision):
+    _block, decoded = round_trip(GEOMETRIES, precision)
+    for wkb, original in zip(decoded, GEOMETRIES):
+        if original is None:
+            assert wkb is None
+            continue
+        assert wkb[:5] == original[:5]
+        assert coordinates(wkb) == list(round_coordinates(coordinates(original), precision))
+
+
+@pytest.mark.parametrize(
+    "precision, values",
+    [
+        (-MAX_PRECISION, [1e300]),
+        (0, [9.3e18]),
+        (6, [-1e13]),
+        (MAX_PRECISION, [1e5]),
+        (0, [math.inf]),
+        (MAX_PRECISION, [-math.inf]),
+        # The coordinates fit in 64 bits, their difference does not
+        (0, [-9e18, 9e18]),
+    ],
+)
+def test_overflow_stored_as_doubles(precision, values):
+    # The quantized coordinates do not fit in 64 bits (or are not finite): the block keeps the doubles
+    geometries = [point(1.5, 2.5), linestring([(value, 1.0) for value in values])]
+    block, decoded = round_trip(geometries, precision)
+    assert block[0] == GEOMETRY_DOUBLE
+    assert decoded == geometries
+
+
+@pytest.mark.parametrize("precision", [None, 0, 6])
+def test_nan(precision):
+    geometries = [point(math.nan, 1.0), point(3.25, 4.5)]
+    _block, decoded = round_trip(geometries, precision)
+    assert math.isnan(coordinates(decoded[0])[0])
+    assert coordinates(decoded[1]) == [3.25, 4.5]
+
+
+@pytest.mark.parametrize("precision", [-MAX_PRECISION - 1, MAX_PRECISION + 1])
+def test_invalid_precision(precision):
+    with pytest.raises(ValueError):
+        encode_geometries(GEOMETRIES, precision)
+
+
+def test_empty_chunk():
+    assert round_trip([None, None], 6)[1] == [None, None]
@@ -0,0 +1,95 @@
+"""Verification of intact, corrupted and truncated mldata files"""
+
+import struct
+
+import pytest
+
+from MemoryLayerSaver.encoder import FIELD_INT, FIELD_STRING, DataFileWriter
+from MemoryLayerSaver.mldata import TRAILER_SIZE
+from MemoryLayerSaver.verify import verify_file
+
+FIELDS = [("id", FIELD_INT, "integer", 10, 0, ""), ("name", FIELD_STRING, "string", 255, 0, "")]
+# Features per layer, written in chunks of 10 features
+FEATURES = 35
+CHUNKS = 4
+
+
+@pytest.fixture
+def written(tmp_path):
+    """Return the content of a file of two layers, and their table of contents entries"""
+    filename = tmp_path / "layers.mldata"
+    with DataFileWriter(filename, chunk_size=10, compression="zlib") as writer:
+        for layer_id in ("layer_1", "layer_2"):
+            writer.write_layer(layer_id, FIELDS, [([i, f"{layer_id} {i}"], None) for i in range(FEATURES)])
+        entries = writer.entries
+    return bytearray(filename.read_bytes()), entries
+
+
+def index_offset(data):
+    return struct.unpack_from(">q", data, len(data) - TRAILER_SIZE)[0]
+
+
+def test_intact(written):
+    data, _entries = written
+    report = verify_file(data)
+    assert report.ok
+    assert report.layer_count == 2
+    assert report.chunk_count == 2 * CHUNKS
+    assert report.feature_count == 2 * FEATURES
+
+
+def test_wrong_checksum(written):
+    data, entries = written
+    # Last byte of the last chunk of the first layer, before its terminating zero count
+    data[entries[0].offset + entries[0].length - 5] ^= 0xFF
+    report = verify_file(data)
+    [damaged] = report.damaged
+    assert damaged.layer_id == "layer_1"
+    assert damaged.reason == "wrong checksum"
+    assert damaged.feature_count == FEATURES % 10
+    assert report.layer_count == 2
+    assert report.feature_count == 2 * FEATURES - FEATURES % 10
+
+
+def test_truncated_chunk(written):
+    data, entries = written
+    # The second layer is cut in its second chunk: the table of contents is lost with it
+    end = entries[1].offset + (entries[1].length // 2)
+    report = verify_file(bytes(data[:end]))
+    [damaged] = report.damaged
+    assert damaged.layer_id == "layer_2"
+    assert damaged.reason == "truncated chunk"
+    assert damaged.offset + damaged.length == end
+    assert report.layer_count == 2
+
+
+@pytest.mark.parametrize("cut", ["trailer", "index", "half index"])
+def test_index_lost(written, cut):
+    data, _entries = written
+    offset = index_offset(data)
+    end = {"trailer": len(data) - TRAILER_SIZE, "index": offset, "half index": (offset + len(data)) // 2}[cut]
+    report = verify_file(bytes(data[:end]))
+    # The layers are scanned from the start of the file, the lost index is reported once
+    [damaged] = report.damaged
+    assert damaged.reason.startswith("index lost")
+    assert damaged.offset == offset
+    assert damaged.offset + damaged.length == end
+    assert damaged.feature_count == 0
+    assert report.layer_count == 2
+    assert report.feature_count == 2 * FEATURES
+
+
+def test_zeroed_trailer(written):
+    data, _entries = written
+    offset = index_offset(data)
+    data[-TRAILER_SIZE:] = bytes(TRAILER_SIZE)
+    report = verify_file(data)
+    [damaged] = report.damaged
+    assert damaged.reason.startswith("index lost")
+    assert (damaged.offset, damaged.offset + damaged.length) == (offset, len(data))
+    assert report.feature_count == 2 * FEATURES
+
+
+def test_not_an_mldata_file():
+    with pytest.raises(ValueError):
+        verify_file(b"not an mldata file")